@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+# title           : Benchmark.py
+# description     : This script measures the throughput (Mbit/s) of the encoders and decoders and the
+#                   construction time of trellises over a grid of parameters. The results are stored as
+#                   JSON files, two result files (e.g. of two commits) can be compared.
+#                   usage: python Benchmark.py [--quick] [-o results.json]
+#                          python Benchmark.py --compare base.json new.json
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+from collections import OrderedDict
+import numpy as np
+from Trellis import Trellis
+from ConvTrellisDef import ConvTrellisDef
+from ConvEncoder import ConvEncoder
+from ConvEncoder import TurboEncoder
+from ViterbiDecoder import ViterbiDecoder
+from SisoDecoder import SisoDecoder
+from TurboDecoder import TurboDecoder
+from Interleaver import get_interleaver
+
+# generator polynomials (octal) of rate 1/2 codes with maximum free distance, per constraint length
+gen_poly_octal = {3: (5, 7), 4: (15, 17), 5: (23, 35), 6: (53, 75), 7: (133, 171), 8: (247, 371), 9: (561, 753)}
+
+# parameter grids: constraint lengths, trellis reductions (log2 radix), block sizes, batch sizes
+grids = {
+    'quick': {'K': [3, 7], 'reduction': [1, 2], 'n_data': [40, 1024], 'n_blocks': [1, 16]},
+    'full': {'K': [3, 4, 5, 6, 7, 8, 9], 'reduction': [1, 2, 4], 'n_data': [40, 512, 1024, 6144],
+             'n_blocks': [1, 8, 64]},
+}
+
+
+def get_gen_matrix(K):
+    """ generator polynomials of the rate 1/2 code with constraint length K as lists of bits """
+    return [[int(b) for b in np.binary_repr(int(str(g), 8), K)] for g in gen_poly_octal[K]]
+
+
+def measure(func, min_time=0.2, repeat=3):
+    """
+    Time per call of func: func is called until min_time is reached, this is repeated
+    and the fastest of the repetitions is taken.
+    """
+    func()  # warm up (caches, memory allocation)
+    best = np.inf
+    for r in range(repeat):
+        n_calls = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            n_calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / repeat:
+                break
+        best = min(best, elapsed / n_calls)
+    return best
+
+
+def bench_trellis(K, reduction, **kwargs):
+    def func():
+        Trellis(ConvTrellisDef(get_gen_matrix(K)), reduction)
+    return func, 0
+
+
+def bench_conv_encoder(K, n_data, n_blocks, **kwargs):
+    encoder = ConvEncoder(Trellis(ConvTrellisDef(get_gen_matrix(K))))
+    data = np.random.randint(0, 2, (n_blocks, n_data), dtype=np.uint8)
+
+    def func():
+        encoder.encode(data)
+    return func, n_blocks * n_data
+
+
+def bench_viterbi(K, reduction, n_data, n_blocks, **kwargs):
+    trellis = Trellis(ConvTrellisDef(get_gen_matrix(K)), reduction)
+    viterbi = ViterbiDecoder(trellis)
+    n_data = n_data // trellis.wu * trellis.wu
+    llrs = np.random.randn(n_blocks, n_data * trellis.tdef.wc)
+
+    def func():
+        viterbi.decode(llrs, n_data)
+    return func, n_blocks * n_data
+
+
+def bench_siso(K, reduction, n_data, n_blocks, **kwargs):
+    trellis = Trellis(ConvTrellisDef(get_gen_matrix(K)), reduction)
+    convsiso = SisoDecoder(trellis)
+    n_data = n_data // trellis.wu * trellis.wu
+    input_u = np.random.randn(n_blocks, n_data)
+    input_c = np.random.randn(n_blocks, n_data * trellis.tdef.wc)
+
+    def func():
+        convsiso.decode(input_u, input_c, n_data)
+    return func, n_blocks * n_data
+
+
+def _turbo_code(n_data):
+    # turbo code of LTE (rsc 13/15) with the LTE interleaver, as in TurboTest.py
+    il = get_interleaver('lte', n_data)
+    trellis_p = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    turboenc = TurboEncoder([Trellis(ConvTrellisDef([[1]])), trellis_p, trellis_p], il)
+    csiso = SisoDecoder(trellis_p)
+    csiso.backward_init = False
+    return turboenc, TurboDecoder(il, csiso, csiso)
+
+
+def bench_turbo_encoder(n_data, n_blocks, **kwargs):
+    turboenc, _ = _turbo_code(n_data)
+    data = np.random.randint(0, 2, (n_blocks, n_data), dtype=np.uint8)
+
+    def func():
+        turboenc.encode(data)
+    return func, n_blocks * n_data
+
+
+def bench_turbo_decoder(n_data, n_blocks, iterations=6, **kwargs):
+    turboenc, td = _turbo_code(n_data)
+    td.iterations = iterations
+    data = np.random.randint(0, 2, (n_blocks, n_data), dtype=np.uint8)
+    encoded = turboenc.flatten(turboenc.encode(data))
+    [ys, yp1, yp2] = turboenc.extract(2.0 * encoded - 1 + 0.8 * np.random.randn(*encoded.shape))
+
+    def func():
+        td.decode(ys, yp1, yp2)
+    return func, n_blocks * n_data
+
+
+# benchmark name -> (setup function, grid parameters), run in this order
+benchmarks = OrderedDict([
+    ('Trellis', (bench_trellis, ['K', 'reduction'])),
+    ('ConvEncoder.encode', (bench_conv_encoder, ['K', 'n_data', 'n_blocks'])),
+    ('TurboEncoder.encode', (bench_turbo_encoder, ['n_data', 'n_blocks'])),
+    ('ViterbiDecoder.decode', (bench_viterbi, ['K', 'reduction', 'n_data', 'n_blocks'])),
+    ('SisoDecoder.decode', (bench_siso, ['K', 'reduction', 'n_data', 'n_blocks'])),
+    ('TurboDecoder.decode', (bench_turbo_decoder, ['n_data', 'n_blocks'])),
+])
+
+
+def run(grid='quick', names=None, min_time=0.2, repeat=3, verbose=True):
+    """
+    Run the benchmarks over all combinations of their grid parameters.
+
+    Parameters
+    ----------
+    grid [str or dict]: name of a grid in grids or a dict {parameter: list of values}
+    names [list]: names of the benchmarks to run (None: all, see benchmarks)
+    min_time [float]: measurement time per case in seconds
+    repeat [int]: number of repetitions per case (the fastest is taken)
+    verbose [bool]: print each result
+
+    Returns
+    -------
+    results: [list of dict] one entry per case with the keys name, params, seconds (per call) and
+             mbps (data bits per second / 1e6, None for the trellis construction)
+    """
+    if isinstance(grid, str):
+        grid = grids[grid]
+    results = []
+    for name, (setup, param_names) in benchmarks.items():
+        if names is not None and name not in names:
+            continue
+        values = [grid[p] for p in param_names]
+        for combination in np.array(np.meshgrid(*values, indexing='ij')).reshape(len(values), -1).T:
+            params = dict(zip(param_names, [int(v) for v in combination]))
+            np.random.seed(0)
+            func, n_bits = setup(**params)
+            seconds = measure(func, min_time, repeat)
+            mbps = n_bits / seconds / 1e6 if n_bits else None
+            results.append({'name': name, 'params': params, 'seconds': seconds, 'mbps': mbps})
+            if verbose:
+                print(format_result(results[-1]))
+    return results
+
+
+def format_result(result):
+    params = ', '.join('{}={}'.format(k, v) for k, v in result['params'].items())
+    if result['mbps'] is None:
+        return '{:24s} {:48s} {:10.3f} ms'.format(result['name'], params, result['seconds'] * 1e3)
+    return '{:24s} {:48s} {:10.4f} Mbit/s'.format(result['name'], params, result['mbps'])
+
+
+def save(results, path):
+    """ store the results together with the commit and the versions as JSON """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    info = {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor()}
+    with open(path, 'w') as f:
+        json.dump({'info': info, 'results': results}, f, indent=1)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(base, new):
+    """
+    Compare two result files (or loaded results), returns a list of (name, params, speedup) for all
+    cases contained in both, speedup = time of base / time of new
+    """
+    if isinstance(base, str):
+        base = load(base)
+    if isinstance(new, str):
+        new = load(new)
+    base_seconds = {(r['name'], json.dumps(r['params'], sort_keys=True)): r['seconds'] for r in base['results']}
+    speedups = []
+    for r in new['results']:
+        key = (r['name'], json.dumps(r['params'], sort_keys=True))
+        if key in base_seconds:
+            speedups.append((r['name'], r['params'], base_seconds[key] / r['seconds']))
+    return speedups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='turpy throughput benchmarks')
+    parser.add_argument('--quick', action='store_true', help='small parameter grid')
+    parser.add_argument('--names', nargs='+', help='benchmarks to run: ' + ', '.join(benchmarks))
+    parser.add_argument('--min-time', type=float, default=0.2, help='measurement time per case [s]')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='result file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        for name, params, speedup in compare(*args.compare):
+            params = ', '.join('{}={}'.format(k, v) for k, v in params.items())
+            print('{:24s} {:48s} {:6.2f}x'.format(name, params, speedup))
+        return
+
+    results = run('quick' if args.quick else 'full', args.names, args.min_time)
+    save(results, args.output)
+    print('results stored in ' + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#! /usr/bin/env python
+# title           : Channel.py
+# description     : This module implements the modulation (BPSK, QPSK, 16-QAM with Gray mapping), AWGN and
+#                   Rayleigh fading channels and the soft demapping of the received symbols to llrs.
+#                   All operations are vectorized along the last axis and batched over the leading axes,
+#                   the llrs are ordered like the bits (e.g. to be split by TurboEncoder.extract).
+#                   Bit 1 is mapped to positive amplitudes, llr = log(P(bit = 1) / P(bit = 0)) as in the decoders.
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import numpy as np
+
+# Gray mapped amplitude levels (pulse amplitude modulation) per real dimension:
+# bits per dimension -> levels[label] with label = b0 + 2 * b1 (b0: sign, b1: magnitude)
+pam_levels = {
+    1: np.array([-1, 1]),
+    2: np.array([-3, 3, -1, 1]),
+}
+
+# modulation scheme -> (number of real dimensions, bits per dimension)
+modulation_schemes = {
+    'bpsk': (1, 1),
+    'qpsk': (2, 1),
+    '16qam': (2, 2),
+}
+
+
+def get_noise_var(ebn0_db, rate, modulation):
+    """
+    Noise variance N0 (of the complex noise, N0 / 2 per real dimension) at unit symbol energy for a given EbN0
+
+    Parameters
+    ----------
+    ebn0_db [float]: EbN0 in dB
+    rate [float]: code rate (data bits per coded bit)
+    modulation [Modulation]: modulation instance (bits per symbol)
+
+    Returns
+    -------
+    noise_var: [float] N0 = 1 / (EbN0 * rate * bits_per_symbol)
+    """
+    return 1 / (10.0 ** (ebn0_db / 10.0) * rate * modulation.bits_per_symbol)
+
+
+class Modulation(object):
+
+    def __init__(self, scheme='bpsk'):
+        self.scheme = scheme  # 'bpsk', 'qpsk' or '16qam'
+        if scheme not in modulation_schemes:
+            raise ValueError('unknown modulation scheme: ' + str(scheme))
+        self.n_dims, self.bits_per_dim = modulation_schemes[scheme]  # real dimensions, bits per dimension
+        self.bits_per_symbol = self.n_dims * self.bits_per_dim
+        levels = pam_levels[self.bits_per_dim]
+        # amplitude scaling to unit average symbol energy
+        self.scale = 1 / np.sqrt(self.n_dims * np.mean(levels ** 2))
+        self.levels = (levels * self.scale).astype(np.float32)  # amplitudes per label
+        labels = np.arange(len(levels))
+        self.label_bits = (labels[:, None] >> np.arange(self.bits_per_dim)) & 1  # [label x bit]
+
+    def get_constellation(self):
+        """ complex constellation points, index = b0 + 2 * b1 + 4 * b2 + ... (bits of the symbol) """
+        labels = np.arange(2 ** self.bits_per_symbol)
+        i = self.levels[labels % 2 ** self.bits_per_dim]
+        if self.n_dims == 1:
+            return i.astype(np.complex64)
+        return (i + 1j * self.levels[labels >> self.bits_per_dim]).astype(np.complex64)
+
+    def modulate(self, bits):
+        """
+        Map bits to symbols, bits_per_symbol consecutive bits form a symbol: the first bits_per_dim
+        bits are mapped to the real part, the others to the imaginary part. If the number of bits is
+        not a multiple of bits_per_symbol, zero bits are appended.
+
+        Parameters
+        ----------
+        bits [array]: bits of shape (..., n_bits)
+
+        Returns
+        -------
+        symbols: [array] float32 (bpsk) or complex64 symbols of shape (..., ceil(n_bits / bits_per_symbol))
+        """
+        bits = np.asarray(bits, dtype=np.uint8)
+        n_pad = -bits.shape[-1] % self.bits_per_symbol
+        if n_pad:
+            bits = np.concatenate((bits, np.zeros(bits.shape[:-1] + (n_pad,), dtype=np.uint8)), axis=-1)
+        labels = bits.reshape(bits.shape[:-1] + (-1, self.n_dims, self.bits_per_dim)) @ (
+            2 ** np.arange(self.bits_per_dim, dtype=np.uint8))
+        amplitudes = np.take(self.levels, labels)  # [..., n_symbols x n_dims]
+        if self.n_dims == 1:
+            return amplitudes[..., 0]
+        return amplitudes.view(np.complex64)[..., 0]
+
+    def demodulate(self, y, noise_var, h=None, method='max_log', n_bits=None, out=None):
+        """
+        Soft demapping of received symbols y = h * x + n to llrs of the bits.
+
+        Parameters
+        ----------
+        y [array]: received symbols of shape (..., n_symbols), real (bpsk over AWGN) or complex
+        noise_var [float or array]: noise variance N0 (N0 / 2 per real dimension), broadcast to the symbols
+        h [array]: channel coefficients (fading) of the symbols (None: AWGN, h = 1)
+        method [str]: 'max_log' or 'exact' (log-sum-exp over the constellation points), identical for bpsk and qpsk
+        n_bits [int]: number of bits (llrs) per block (None: n_symbols * bits_per_symbol)
+        out [array]: float32 buffer of shape (..., n_bits) for the llrs (None: allocated)
+
+        Returns
+        -------
+        llr: [array] float32 llrs of shape (..., n_bits)
+        """
+        y = np.asarray(y)
+        if n_bits is None:
+            n_bits = y.shape[-1] * self.bits_per_symbol
+        if out is None:
+            out = np.empty(y.shape[:-1] + (n_bits,), dtype=np.float32)
+
+        # coherent detection: rotation by the phase of h, the amplitude gain |h| is kept
+        if h is not None:
+            gain = np.abs(h).astype(np.float32)
+            y = y * (np.conj(h) / np.maximum(gain, np.finfo(np.float32).tiny))
+        else:
+            gain = np.float32(1)
+        if self.n_dims == 1:
+            r = np.real(y).astype(np.float32)[..., None]
+        else:
+            r = np.stack((np.real(y), np.imag(y)), axis=-1).astype(np.float32)  # [..., n_symbols x n_dims]
+        # per symbol values broadcast over the dimensions
+        gain = np.asarray(gain)[..., None]
+        noise_var = np.asarray(noise_var, dtype=np.float32)[..., None]
+
+        # llrs per real dimension [..., n_symbols x n_dims x bits_per_dim]
+        if self.bits_per_dim == 1:
+            # log p(r | +a) / p(r | -a) with variance N0 / 2: 4 * a * gain * r / N0
+            llr = ((4 * self.levels[1]) * gain * r / noise_var)[..., None]
+        else:
+            metric = -(r[..., None] - gain[..., None] * self.levels) ** 2 / noise_var[..., None]
+            reduce = np.max if method == 'max_log' else np.logaddexp.reduce
+            llr = np.empty(r.shape + (self.bits_per_dim,), dtype=np.float32)
+            for k in range(self.bits_per_dim):
+                ones = np.nonzero(self.label_bits[:, k] == 1)[0]
+                zeros = np.nonzero(self.label_bits[:, k] == 0)[0]
+                llr[..., k] = reduce(np.take(metric, ones, axis=-1), axis=-1) \
+                    - reduce(np.take(metric, zeros, axis=-1), axis=-1)
+
+        out[...] = llr.reshape(llr.shape[:-3] + (-1,))[..., :n_bits]
+        return out
+
+
+class Channel(object):
+
+    def __init__(self, fading='awgn'):
+        # 'awgn': y = x + n
+        # 'rayleigh': y = h * x + n, h complex gaussian with E|h|^2 = 1, independent per symbol
+        # 'block_rayleigh': as 'rayleigh' with one coefficient per block (last axis)
+        self.fading = fading
+        if fading not in ['awgn', 'rayleigh', 'block_rayleigh']:
+            raise ValueError('unknown channel: ' + str(fading))
+
+    def transmit(self, x, noise_var, rng=None):
+        """
+        Transmit symbols over the channel.
+
+        Parameters
+        ----------
+        x [array]: symbols of shape (..., n_symbols), real (bpsk) or complex
+        noise_var [float]: noise variance N0 (N0 / 2 per real dimension)
+        rng [numpy.random.Generator]: random number generator (None: numpy.random.default_rng())
+
+        Returns
+        -------
+        y: [array] received symbols (float32 for real symbols over AWGN, else complex64)
+        h: [array] channel coefficients (complex64) of the symbols, None for AWGN
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        x = np.asarray(x)
+        std = np.float32(np.sqrt(noise_var / 2))
+        h = None
+        if self.fading != 'awgn':
+            shape = x.shape if self.fading == 'rayleigh' else x.shape[:-1] + (1,)
+            h = self._complex_normal(rng, shape, np.float32(np.sqrt(0.5)))
+            x = h * x
+        if np.iscomplexobj(x):
+            y = x.astype(np.complex64) + self._complex_normal(rng, x.shape, std)
+        else:
+            y = x.astype(np.float32) + std * rng.standard_normal(x.shape, dtype=np.float32)
+        if h is not None:
+            h = np.broadcast_to(h, y.shape)
+        return y, h
+
+    @staticmethod
+    def _complex_normal(rng, shape, std):
+        # complex gaussian samples with standard deviation std per real dimension
+        return (std * rng.standard_normal(shape + (2,), dtype=np.float32)).view(np.complex64)[..., 0]
@@ -8,20 +8,28 @@ import numpy as np
 import utils
 
 
+# positions of the 12 tail bits of the LTE turbo code (36.212 5.1.3.2.2) in the three streams:
+# tail bits [x_0 x_1 x_2 z_0 z_1 z_2 x'_0 x'_1 x'_2 z'_0 z'_1 z'_2] (x, z: systematic and parity tail bits of
+# the first constituent encoder, x', z' of the second one) -> 4 tail bits per stream
+lte_tail_index = np.array([[0, 4, 6, 10], [3, 2, 9, 8], [1, 5, 7, 11]])
+
+
 class ConvEncoder(object):
 
     def __init__(self, trellis):
         self.state = 0
         self.trellis = trellis
+        self.rate_matching = None  # rate matching of the encoded stream, e.g. RateMatching.Puncturer (None: none)
 
     def reset(self):
         self.state = 0
 
     def step(self, data):
-        branch_taken = self.trellis.get_next_branches_pc[self.state][data]
-        out = self.trellis.get_enc_bits_pc[branch_taken]
-        self.state = self.trellis.get_next_state_pc[branch_taken]
-        out = np.array(out)
+        branch_taken = self.trellis.next_branches_np[self.state, data]
+        if branch_taken < 0:
+            raise ValueError('no branch for the data input (trellis with merged parallel branches)')
+        out = self.trellis.enc_bits_np[branch_taken]
+        self.state = int(self.trellis.next_state_np[branch_taken])
         return out
 
     def get_state(self):
@@ -31,6 +39,8 @@ class ConvEncoder(object):
         # add k-1 zero termination bits
         if k == -1:
             k = self.trellis.tdef.K - 1
+        if isinstance(data, np.ndarray):
+            return np.concatenate((data, np.zeros(data.shape[:-1] + (k,), dtype=data.dtype)), axis=-1)
         return data + [0] * k
 
     def remove_zero_termination(self, u):
@@ -38,6 +48,9 @@ class ConvEncoder(object):
 
     def encode(self, data, zero_termination=True):
 
+        if isinstance(data, np.ndarray):
+            return self.encode_array(data, zero_termination)
+
         self.reset()
 
         if zero_termination:
@@ -50,8 +63,160 @@ class ConvEncoder(object):
             dat_int = utils.bin2dec(dat)
             encoded = np.concatenate((encoded.astype(int), self.step(dat_int)))
 
+        if self.rate_matching is not None:
+            encoded = self.rate_matching.match(encoded)
         return list(encoded)
 
+    def encode_array(self, data, zero_termination=True):
+        """
+        Vectorized encoding of a bit array, the result is the same as the one of encode.
+        The parity bits are calculated as a GF(2) convolution of the whole block with the
+        generator polynomials. For recursive codes the data is first divided by the feedback
+        polynomial (again on the whole block, see _divide_feedback).
+
+        Parameters
+        ----------
+        data [array]: data bits, shape (n_bits,) or (n_blocks, n_bits) for a batch of blocks
+        zero_termination [bool]: append K-1 zero bits to the data
+
+        Returns
+        -------
+        encoded: [array] uint8 encoded bits, shape (n_bits * rate,) or (n_blocks, n_bits * rate)
+                 (the transmitted bits if rate_matching is set)
+        """
+
+        tdef = self.trellis.tdef
+        data = np.asarray(data, dtype=np.uint8)
+        if zero_termination:
+            data = np.concatenate((data, np.zeros(data.shape[:-1] + (tdef.K - 1,), dtype=np.uint8)), axis=-1)
+        n = data.shape[-1] // self.trellis.wu * self.trellis.wu
+        data = data[..., :n]
+
+        # input sequence of the shift register
+        w = self._divide_feedback(data) if tdef.rsc else data
+
+        # encoded bits: GF(2) convolution of the shift register input with the generator polynomials
+        gen = np.fliplr(tdef.gen_matrix).astype(np.uint8)  # gen[j][m]: tap of generator j with delay m
+        encoded = np.zeros(data.shape + (tdef.wc,), dtype=np.uint8)
+        for m in range(min(tdef.K, n)):
+            if gen[:, m].any():
+                encoded[..., m:, :] ^= w[..., :n - m, None] & gen[:, m]
+        encoded = encoded.reshape(data.shape[:-1] + (-1,))
+        if self.rate_matching is not None:
+            return self.rate_matching.match(encoded)
+        return encoded
+
+    def encode_tail_biting(self, data):
+        """
+        Tail-biting encoding of a feedforward code: the encoder starts in the state it ends in, i.e. the
+        shift register is preloaded with the last K-1 data bits. No termination bits are transmitted,
+        the parity bits are a circular GF(2) convolution of the block with the generator polynomials.
+
+        Parameters
+        ----------
+        data [list or array]: data bits, shape (n_bits,) or (n_blocks, n_bits) for a batch of blocks
+
+        Returns
+        -------
+        encoded: [array] uint8 encoded bits, shape (n_bits * rate,) or (n_blocks, n_bits * rate)
+                 (the transmitted bits if rate_matching is set, a list for list inputs)
+        """
+
+        tdef = self.trellis.tdef
+        if tdef.rsc:
+            raise ValueError('tail-biting encoding is implemented for feedforward codes only')
+        is_list = not isinstance(data, np.ndarray)
+        data = np.asarray(data, dtype=np.uint8)
+        gen = np.fliplr(tdef.gen_matrix).astype(np.uint8)  # gen[j][m]: tap of generator j with delay m
+        encoded = np.zeros(data.shape + (tdef.wc,), dtype=np.uint8)
+        for m in range(tdef.K):
+            if gen[:, m].any():
+                encoded ^= np.roll(data, m, axis=-1)[..., None] & gen[:, m]
+        encoded = encoded.reshape(data.shape[:-1] + (-1,))
+        if self.rate_matching is not None:
+            encoded = self.rate_matching.match(encoded)
+        if is_list:
+            return list(encoded)
+        return encoded
+
+    def get_n_encoded(self, n_data, zero_termination=True):
+        """ number of encoded bits of n_data data bits (mother code, before rate matching) """
+        n = n_data + (self.trellis.tdef.K - 1 if zero_termination else 0)
+        return n // self.trellis.wu * self.trellis.wc
+
+    def dematch(self, llr, n_data, zero_termination=True):
+        """ llrs of the mother code from the llrs of the transmitted bits (zero llrs for punctured bits) """
+        if self.rate_matching is None:
+            return llr
+        return self.rate_matching.dematch(llr, self.get_n_encoded(n_data, zero_termination))
+
+    def get_tail_bits(self, data):
+        """
+        The K-1 input bits which drive the encoder from its state after encoding data (starting in state 0)
+        back to state 0: zero bits for feedforward codes, the feedback of the shift register for recursive codes.
+
+        Parameters
+        ----------
+        data [array]: data bits, shape (n_bits,) or (n_blocks, n_bits)
+
+        Returns
+        -------
+        tail: [array] uint8 tail bits, shape (K-1,) or (n_blocks, K-1)
+        """
+        tdef = self.trellis.tdef
+        data = np.asarray(data, dtype=np.uint8)
+        tail = np.zeros(data.shape[:-1] + (tdef.K - 1,), dtype=np.uint8)
+        if not tdef.rsc:
+            return tail
+        f = np.fliplr(tdef.gen_feedback)[0]  # f[m]: feedback tap with delay m
+        n = data.shape[-1]
+        w = np.concatenate((self._divide_feedback(data), tail), axis=-1)  # the register input is 0 during the tail
+        for j in range(tdef.K - 1):
+            for m in range(1, len(f)):
+                if f[m] and n + j - m >= 0:
+                    tail[..., j] ^= w[..., n + j - m]
+        return tail
+
+    def _divide_feedback(self, data):
+        """
+        Division of the data by the feedback polynomial f over GF(2), w[n] = data[n] + sum_m f[m] w[n-m].
+        The impulse response h of 1/f is periodic with period P, therefore
+        w[n] = sum_p h[p] a[n-p] (p < P) with a[k] = data[k] + data[k-P] + data[k-2P] + ...
+        """
+        h = self._feedback_impulse_response()
+        if h is None:
+            return data.copy()  # no feedback taps, 1/f = 1
+        period = len(h)
+        n = data.shape[-1]
+
+        # a: cumulative xor over all bits with the same index modulo P
+        a = np.concatenate((data, np.zeros(data.shape[:-1] + (-n % period,), dtype=np.uint8)), axis=-1)
+        a = np.bitwise_xor.accumulate(a.reshape(data.shape[:-1] + (-1, period)), axis=-2)
+        a = a.reshape(data.shape[:-1] + (-1,))[..., :n]
+
+        w = np.zeros_like(data)
+        for p in np.nonzero(h)[0]:
+            if p < n:
+                w[..., p:] ^= a[..., :n - p]
+        return w
+
+    def _feedback_impulse_response(self):
+        """
+        one period of the impulse response of 1/f (f: feedback polynomial), None if f has no taps
+        (the impulse response is then a single 1, which is not periodic)
+        """
+        f = np.fliplr(self.trellis.tdef.gen_feedback)[0]  # f[m]: feedback tap with delay m
+        taps = [m for m in range(1, len(f)) if f[m]]
+        if len(taps) == 0:
+            return None
+        deg = max(taps)
+        h = [0] * (deg - 1) + [1]  # initial register content, followed by the response
+        while True:
+            h.append(sum([h[-m] for m in taps]) % 2)
+            # the response is periodic as soon as the register content is equal to the initial one
+            if h[-deg:] == h[:deg]:
+                return np.array(h[deg - 1:-1])
+
 
 class TurboEncoder(object):
 
@@ -60,10 +225,21 @@ class TurboEncoder(object):
         self.trellises = trellises
         self.interleaver = interleaver
         self.r = 3
-        self.n_zp = 4  # zero padding
+        self.n_zp = 4  # zero padding or tail bits per stream
+        # termination of the constituent encoders
+        #   None: the data is padded with n_zp zero bits (the end state of the recursive encoders is not known)
+        #   'lte': each constituent encoder is driven to state 0 by K-1 = 3 tail bits, the 12 systematic and
+        #          parity tail bits are transmitted at the end of the streams (LTE, see lte_tail_index)
+        self.termination = None
+        # rate matching of the flattened stream, RateMatching.Puncturer or CircularBufferRateMatcher
+        # (None: rate 1/3 mother code)
+        self.rate_matching = None
 
     def encode(self, data):
+        # data: list of bits, or numpy bit array of shape (n_bits,) or (n_blocks, n_bits)
 
+        if self.termination == 'lte':
+            return self.encode_terminated(data)
         encoded = []
         for index, trellis in enumerate(self.trellises):
             # for each trellis generate an encoded stream
@@ -77,15 +253,73 @@ class TurboEncoder(object):
             encoded.append(encoded_conv)
         return encoded
 
-    def extract(self, enc_stream):
+    def encode_terminated(self, data):
+        """
+        Encoding with trellis termination of both constituent encoders (termination = 'lte'): the tail
+        bits of each recursive encoder (see ConvEncoder.get_tail_bits) are encoded after the data and
+        the systematic and parity tail bits are distributed over the streams as in LTE.
+
+        Parameters
+        ----------
+        data [list or array]: data bits, shape (n_bits,) or (n_blocks, n_bits)
+
+        Returns
+        -------
+        encoded: [list] systematic, parity 1 and parity 2 stream, each of n_bits + 4 bits
+                 (arrays of shape (n_blocks, n_bits + 4) for array inputs)
+        """
+        if self.n_zp != 4:
+            raise ValueError('lte termination requires n_zp = 4 tail bits per stream')
+        is_list = not isinstance(data, np.ndarray)
+        data = np.asarray(data, dtype=np.uint8)
+        n = data.shape[-1]
+        streams = [ConvEncoder(self.trellises[0]).encode(data, False)]
+        tails = []
+        for index, trellis in enumerate(self.trellises[1:3]):
+            if trellis.tdef.K != 4 or trellis.wc != 1:
+                raise ValueError('lte termination requires constituent codes with K = 4 and one parity bit')
+            cve = ConvEncoder(trellis)
+            datam = self.interleaver.interleave(data) if index > 0 else data
+            tail = cve.get_tail_bits(datam)
+            parity = cve.encode(np.concatenate((datam, tail), axis=-1), False)
+            streams.append(parity[..., :n])
+            tails += [tail, parity[..., n:]]
+        tails = np.take(np.concatenate(tails, axis=-1), lte_tail_index, axis=-1)  # [... x 3 x 4]
+        encoded = [np.concatenate((streams[i], tails[..., i, :]), axis=-1) for i in range(3)]
+        if is_list:
+            return [list(e) for e in encoded]
+        return encoded
+
+    def get_n_encoded(self, n_data):
+        """ number of bits of the flattened stream of n_data data bits (mother code, before rate matching) """
+        return self.r * (n_data + self.n_zp)
+
+    def extract(self, enc_stream, n_data=None):
+        # with rate matching the llrs of the transmitted bits of blocks of n_data data bits are given,
+        # the llrs of the bits that are not transmitted are set to zero (repeated bits are combined)
+        if self.rate_matching is not None:
+            if n_data is None:
+                raise ValueError('n_data is required to extract rate matched streams')
+            enc_stream = self.rate_matching.dematch(enc_stream, self.get_n_encoded(n_data))
+        if isinstance(enc_stream, np.ndarray):  # extract along the last axis
+            return [enc_stream[..., i::self.r] for i in range(self.r)]
         enc_extracted = []
         for i in range(self.r):
             enc_extracted.append(enc_stream[i::self.r])
         return enc_extracted
 
     def flatten(self, enc_extracted):
+        # with rate matching only the transmitted bits of the flattened stream are returned
+        if isinstance(enc_extracted[0], np.ndarray):  # flatten along the last axis
+            enc_stream = np.stack(enc_extracted, axis=-1)
+            enc_stream = enc_stream.reshape(enc_stream.shape[:-2] + (-1,))
+            if self.rate_matching is not None:
+                return self.rate_matching.match(enc_stream)
+            return enc_stream
         enc_stream = []
         for i in range(len(enc_extracted[0])):
             for j in range(self.r):
                 enc_stream.append(enc_extracted[j][i])
+        if self.rate_matching is not None:
+            return list(self.rate_matching.match(enc_stream))
         return enc_stream
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+# title           : DecoderStats.py
+# description     : This class collects profiling statistics of the decoders (see the stats attribute of
+#                   SisoDecoder, ViterbiDecoder and TurboDecoder): wall time per phase, per turbo iteration,
+#                   iterations used and operation counts. Several instances (e.g. of the work units of a
+#                   simulation) can be aggregated and reported as throughput and time breakdown.
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import time
+import numpy as np
+
+
+class DecoderStats(object):
+
+    def __init__(self):
+        # wall time per phase [s]: 'branch_metrics', 'acs' (state metric recursions), 'soft_output',
+        # 'traceback', 'interleaving', 'extrinsic' (a priori and extrinsic information), 'stopping'
+        self.phase_time = {}
+        # operation count per phase: branch metrics computed, state metric updates (one radix-way
+        # add-compare-select each), soft values, traceback steps, (de)interleaved values, ...
+        self.op_count = {}
+        self.iteration_time = []  # wall time of each turbo iteration (of all blocks decoded together)
+        self.iterations_used = []  # iterations used per decoded block (turbo decoder)
+        self.n_calls = 0  # number of (outermost) decode calls
+        self.n_bits = 0  # number of decoded data bits
+        self.decode_time = 0.0  # wall time of the decode calls [s]
+        self._depth = 0  # nesting depth of decode calls (a turbo decoder calls its siso decoders)
+
+    def phase(self, name, n_ops=0):
+        """ context manager adding the wall time of the block and n_ops operations to the phase name """
+        return _PhaseTimer(self, name, n_ops)
+
+    def call(self, n_bits):
+        """
+        context manager recording a decode call of n_bits data bits, calls within calls
+        (e.g. of the siso decoders of a turbo decoder sharing the instance) are not counted
+        """
+        return _CallTimer(self, n_bits)
+
+    def add_phase(self, name, seconds, n_ops=0):
+        self.phase_time[name] = self.phase_time.get(name, 0.0) + seconds
+        if n_ops:
+            self.op_count[name] = self.op_count.get(name, 0) + int(n_ops)
+
+    def add_iteration(self, seconds):
+        self.iteration_time.append(seconds)
+
+    def add_iterations_used(self, iterations_used):
+        self.iterations_used.extend(np.atleast_1d(iterations_used).tolist())
+
+    def merge(self, other):
+        """ add the statistics of other to this instance """
+        for name, seconds in other.phase_time.items():
+            self.add_phase(name, seconds, other.op_count.get(name, 0))
+        self.iteration_time.extend(other.iteration_time)
+        self.iterations_used.extend(other.iterations_used)
+        self.n_calls += other.n_calls
+        self.n_bits += other.n_bits
+        self.decode_time += other.decode_time
+        return self
+
+    def reset(self):
+        self.__init__()
+
+    def get_throughput(self):
+        """ decoded data bits per second / 1e6 (Mbit/s) """
+        return self.n_bits / self.decode_time / 1e6 if self.decode_time > 0 else 0.0
+
+    def get_breakdown(self):
+        """
+        fraction of the decode time per phase, the time not covered by a phase is given as 'other'
+        (phases of decoders running in threads, e.g. sub-blocks with an executor, may sum up to more than 1)
+        """
+        if self.decode_time <= 0:
+            return {}
+        breakdown = {name: seconds / self.decode_time for name, seconds in self.phase_time.items()}
+        breakdown['other'] = max(0.0, 1 - sum(breakdown.values()))
+        return breakdown
+
+    def report(self):
+        """ throughput, time breakdown, operation counts and iterations as text """
+        lines = ['decode calls: {}, data bits: {}, time: {:.4f} s, throughput: {:.4f} Mbit/s'.format(
+            self.n_calls, self.n_bits, self.decode_time, self.get_throughput())]
+        for name, fraction in sorted(self.get_breakdown().items(), key=lambda item: -item[1]):
+            line = '  {:16s} {:10.4f} s {:6.1f} %'.format(name, self.phase_time.get(name, fraction * self.decode_time),
+                                                          100 * fraction)
+            if name in self.op_count:
+                line += '  {:14d} ops'.format(self.op_count[name])
+            lines.append(line)
+        if self.iterations_used:
+            lines.append('iterations used: mean {:.2f}, max {}'.format(np.mean(self.iterations_used),
+                                                                      max(self.iterations_used)))
+        if self.iteration_time:
+            lines.append('time per iteration: mean {:.6f} s'.format(np.mean(self.iteration_time)))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'DecoderStats(n_calls={}, n_bits={}, decode_time={:.4f})'.format(self.n_calls, self.n_bits,
+                                                                                self.decode_time)
+
+
+def aggregate(stats_list):
+    """ aggregate the statistics of several instances (e.g. of the work units of a run) into a new instance """
+    stats = DecoderStats()
+    for s in stats_list:
+        stats.merge(s)
+    return stats
+
+
+def phase_timer(stats, name, n_ops=0):
+    """ stats.phase(name, n_ops), or a context manager without any action if stats is None """
+    if stats is None:
+        return _null_timer
+    return _PhaseTimer(stats, name, n_ops)
+
+
+def call_timer(stats, n_bits):
+    """ stats.call(n_bits), or a context manager without any action if stats is None """
+    if stats is None:
+        return _null_timer
+    return _CallTimer(stats, n_bits)
+
+
+class _PhaseTimer(object):
+
+    def __init__(self, stats, name, n_ops):
+        self.stats = stats
+        self.name = name
+        self.n_ops = n_ops
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_phase(self.name, time.perf_counter() - self.start, self.n_ops)
+
+
+class _CallTimer(object):
+
+    def __init__(self, stats, n_bits):
+        self.stats = stats
+        self.n_bits = n_bits
+
+    def __enter__(self):
+        self.stats._depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        stats = self.stats
+        stats._depth -= 1
+        if stats._depth == 0:
+            stats.n_calls += 1
+            stats.n_bits += int(self.n_bits)
+            stats.decode_time += time.perf_counter() - self.start
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timer = _NullTimer()
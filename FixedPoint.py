@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+# title           : FixedPoint.py
+# description     : This class implements the fixed-point arithmetic of quantized decoders (see SisoDecoder
+#                   and ViterbiDecoder). Llrs are quantized to llr_bits, state metrics are kept in
+#                   sm_bits wide integers with modulo normalization or subtract-max renormalization.
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import numpy as np
+
+
+class FixedPoint(object):
+
+    def __init__(self, llr_bits=6, llr_frac_bits=1, sm_bits=16, normalization='modulo'):
+        self.llr_bits = llr_bits  # bit width of the input llrs (incl. sign)
+        self.llr_frac_bits = llr_frac_bits  # fractional bits of the llrs, quantization step 2^-llr_frac_bits
+        self.sm_bits = sm_bits  # bit width of the state metrics (<= 32)
+        # normalization of the state metrics:
+        #   'modulo': the state metrics wrap around (two's complement), they are compared by their
+        #             modular difference (the spread of the metrics has to be < 2^(sm_bits - 1))
+        #   'subtract_max': saturating arithmetic, the maximum state metric is subtracted after each stage
+        # (16 or 32 bit modulo is the fastest mode, the recursions run in place in the native integer type,
+        # the other modes compute with wide intermediate results)
+        self.normalization = normalization
+        self.out_bits = None  # bit width of the soft outputs (None: no saturation)
+
+    def get_dtype(self):
+        # storage type of the state metrics
+        return np.int16 if self.sm_bits <= 16 else np.int32
+
+    def get_init_value(self):
+        # initial state metric of the states which are not the start state
+        # (modulo: alpha + gamma + beta of all branches have to stay within a spread of 2^(sm_bits - 1))
+        if self.normalization == 'modulo':
+            return -2 ** (self.sm_bits - 3)
+        return -2 ** (self.sm_bits - 1)
+
+    def quantize(self, llr):
+        """ quantize float llrs to llr_bits (rounding, symmetric saturation) """
+        llr_max = 2 ** (self.llr_bits - 1) - 1
+        q = np.rint(np.asarray(llr, dtype=float) * 2 ** self.llr_frac_bits)
+        return np.clip(q, -llr_max, llr_max).astype(self.get_dtype())
+
+    def dequantize(self, x):
+        """ integer soft values to float llrs, saturated to out_bits """
+        if self.out_bits is not None:
+            x = self._saturate(x, self.out_bits)
+        return x / 2 ** self.llr_frac_bits
+
+    def add(self, a, b):
+        if self._native_wrap():
+            return np.add(a, b, dtype=self.get_dtype())
+        return self._reduce(np.add(a, b, dtype=self._get_wide_dtype()))
+
+    def subtract(self, a, b):
+        if self._native_wrap():
+            return np.subtract(a, b, dtype=self.get_dtype())
+        return self._reduce(np.subtract(a, b, dtype=self._get_wide_dtype()))
+
+    def argmax(self, x):
+        """ index of the maximum along the last axis (the first one for ties) """
+        if self.normalization != 'modulo':
+            return np.argmax(x, axis=-1)
+        m = x[..., 0]
+        index = np.zeros(m.shape, dtype=np.int8)
+        for k in range(1, x.shape[-1]):
+            better = self.subtract(x[..., k], m) > 0
+            m = np.where(better, x[..., k], m)
+            index[better] = k
+        return index
+
+    def max(self, x):
+        """ maximum along the last axis """
+        if self.normalization != 'modulo':
+            return np.max(x, axis=-1)
+        m = x[..., 0]
+        for k in range(1, x.shape[-1]):
+            m = np.where(self.subtract(x[..., k], m) > 0, x[..., k], m)
+        return m
+
+    def acs(self, sm, gamma, out=None):
+        """
+        add, compare, select of a recursion step, the same result as normalize(max(add(sm, gamma)))
+        with the maximum over the radix axis: sm, gamma [... x radix x Ns] -> state metric vectors [... x Ns]
+        (sm is overwritten, the result is written to out if given)
+        """
+        if self._native_wrap():
+            # in place in the native type without wide intermediate results, modular maximum
+            # max(a, b) = a + max(b - a, 0) with wrapping differences
+            np.add(sm, gamma, out=sm)
+            m = sm[..., 0, :]
+            if out is None:
+                out = np.empty_like(m)
+            radix = sm.shape[-2]
+            if radix == 1:
+                np.copyto(out, m)
+            for k in range(1, radix):
+                np.subtract(sm[..., k, :], m, out=out)
+                np.maximum(out, 0, out=out)
+                if k < radix - 1:
+                    m += out
+                else:
+                    out += m
+            return out
+        if self.normalization == 'subtract_max':
+            # add and subtract in the wide type, bit exact to saturating each operation: the saturation
+            # commutes with the maximum and the differences to the maximum are <= 0
+            lo, hi = -2 ** (self.sm_bits - 1), 2 ** (self.sm_bits - 1) - 1
+            x = np.add(sm, gamma, dtype=self._get_wide_dtype())
+            m = np.maximum(x[..., 0, :], x[..., 1, :]) if x.shape[-2] == 2 else np.max(x, axis=-2)
+            np.clip(m, lo, hi, out=m)
+            m -= np.max(m, axis=-1, keepdims=True)
+            np.maximum(m, lo, out=m)
+        else:
+            m = self.normalize(self.max(np.moveaxis(self.add(sm, gamma), -2, -1)))
+        if out is None:
+            return m.astype(self.get_dtype(), copy=False)
+        np.copyto(out, m, casting='unsafe')
+        return out
+
+    def normalize(self, sm_vec):
+        """ renormalization of state metric vectors [... x Ns] after a stage """
+        if self.normalization != 'subtract_max':
+            return sm_vec
+        return self.subtract(sm_vec, self.max(sm_vec)[..., None])
+
+    def _native_wrap(self):
+        # modulo arithmetic of 16 or 32 bits is the two's complement wrap around of the integer type
+        return self.normalization == 'modulo' and self.sm_bits in (16, 32)
+
+    def _reduce(self, x):
+        # wide intermediate result to sm_bits: wrap around (modulo) or saturate
+        if self.normalization == 'modulo':
+            half = 2 ** (self.sm_bits - 1)
+            return (((x + half) & (2 * half - 1)) - half).astype(self.get_dtype())
+        return self._saturate(x, self.sm_bits).astype(self.get_dtype())
+
+    def _get_wide_dtype(self):
+        return np.int32 if self.sm_bits <= 16 else np.int64
+
+    @staticmethod
+    def _saturate(x, bits):
+        return np.clip(x, -2 ** (bits - 1), 2 ** (bits - 1) - 1)
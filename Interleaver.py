@@ -4,54 +4,377 @@
 # author          : Felix Arnold
 # python_version  : 3.5.2
 
-import random
 import math
+from functools import lru_cache
+import numpy as np
+
+# QPP interleaver parameters of 3GPP TS 36.212 (LTE), table 5.1.3-3: {K: (f1, f2)}
+lte_qpp_params = {
+    40: (3, 10), 48: (7, 12), 56: (19, 42), 64: (7, 16), 72: (7, 18), 80: (11, 20), 88: (5, 22), 96: (11, 24),
+    104: (7, 26), 112: (41, 84), 120: (103, 90), 128: (15, 32), 136: (9, 34), 144: (17, 108), 152: (9, 38),
+    160: (21, 120), 168: (101, 84), 176: (21, 44), 184: (57, 46), 192: (23, 48), 200: (13, 50), 208: (27, 52),
+    216: (11, 36), 224: (27, 56), 232: (85, 58), 240: (29, 60), 248: (33, 62), 256: (15, 32), 264: (17, 198),
+    272: (33, 68), 280: (103, 210), 288: (19, 36), 296: (19, 74), 304: (37, 76), 312: (19, 78),
+    320: (21, 120), 328: (21, 82), 336: (115, 84), 344: (193, 86), 352: (21, 44), 360: (133, 90),
+    368: (81, 46), 376: (45, 94), 384: (23, 48), 392: (243, 98), 400: (151, 40), 408: (155, 102),
+    416: (25, 52), 424: (51, 106), 432: (47, 72), 440: (91, 110), 448: (29, 168), 456: (29, 114),
+    464: (247, 58), 472: (29, 118), 480: (89, 180), 488: (91, 122), 496: (157, 62), 504: (55, 84),
+    512: (31, 64), 528: (17, 66), 544: (35, 68), 560: (227, 420), 576: (65, 96), 592: (19, 74), 608: (37, 76),
+    624: (41, 234), 640: (39, 80), 656: (185, 82), 672: (43, 252), 688: (21, 86), 704: (155, 44),
+    720: (79, 120), 736: (139, 92), 752: (23, 94), 768: (217, 48), 784: (25, 98), 800: (17, 80),
+    816: (127, 102), 832: (25, 52), 848: (239, 106), 864: (17, 48), 880: (137, 110), 896: (215, 112),
+    912: (29, 114), 928: (15, 58), 944: (147, 118), 960: (29, 60), 976: (59, 122), 992: (65, 124),
+    1008: (55, 84), 1024: (31, 64), 1056: (17, 66), 1088: (171, 204), 1120: (67, 140), 1152: (35, 72),
+    1184: (19, 74), 1216: (39, 76), 1248: (19, 78), 1280: (199, 240), 1312: (21, 82), 1344: (211, 252),
+    1376: (21, 86), 1408: (43, 88), 1440: (149, 60), 1472: (45, 92), 1504: (49, 846), 1536: (71, 48),
+    1568: (13, 28), 1600: (17, 80), 1632: (25, 102), 1664: (183, 104), 1696: (55, 954), 1728: (127, 96),
+    1760: (27, 110), 1792: (29, 112), 1824: (29, 114), 1856: (57, 116), 1888: (45, 354), 1920: (31, 120),
+    1952: (59, 610), 1984: (185, 124), 2016: (113, 420), 2048: (31, 64), 2112: (17, 66), 2176: (171, 136),
+    2240: (209, 420), 2304: (253, 216), 2368: (367, 444), 2432: (265, 456), 2496: (181, 468), 2560: (39, 80),
+    2624: (27, 164), 2688: (127, 504), 2752: (143, 172), 2816: (43, 88), 2880: (29, 300), 2944: (45, 92),
+    3008: (157, 188), 3072: (47, 96), 3136: (13, 28), 3200: (111, 240), 3264: (443, 204), 3328: (51, 104),
+    3392: (51, 212), 3456: (451, 192), 3520: (257, 220), 3584: (57, 336), 3648: (313, 228), 3712: (271, 232),
+    3776: (179, 236), 3840: (331, 120), 3904: (363, 244), 3968: (375, 248), 4032: (127, 168), 4096: (31, 64),
+    4160: (33, 130), 4224: (43, 264), 4288: (33, 134), 4352: (477, 408), 4416: (35, 138), 4480: (233, 280),
+    4544: (357, 142), 4608: (337, 480), 4672: (37, 146), 4736: (71, 444), 4800: (71, 120), 4864: (37, 152),
+    4928: (39, 462), 4992: (127, 234), 5056: (39, 158), 5120: (39, 80), 5184: (31, 96), 5248: (113, 902),
+    5312: (41, 166), 5376: (251, 336), 5440: (43, 170), 5504: (21, 86), 5568: (43, 174), 5632: (45, 176),
+    5696: (45, 178), 5760: (161, 120), 5824: (89, 182), 5888: (323, 184), 5952: (47, 186), 6016: (23, 94),
+    6080: (47, 190), 6144: (263, 480)
+}
+
+# inter-row permutation patterns of 3GPP TS 25.212 (UMTS), section 4.2.3.2.3
+umts_pattern_a = [19, 9, 14, 4, 0, 2, 5, 7, 12, 18, 10, 8, 13, 17, 3, 1, 16, 6, 15, 11]
+umts_pattern_b = [19, 9, 14, 4, 0, 2, 5, 7, 12, 18, 16, 13, 17, 15, 3, 1, 6, 11, 8, 10]
 
 
 class Interleaver(object):
 
     def __init__(self):
-        self.perm = []
-        self.perm_inv = []
+        self.perm = np.zeros(0, dtype=np.int32)
+        self.perm_inv = np.zeros(0, dtype=np.int32)
 
     def get_length(self):
         return len(self.perm)
 
     def set_permutation(self, perm):
-        self.perm = perm
+        self.perm = np.asarray(perm, dtype=self._index_dtype(len(perm)))
+        self._gen_perm_inv()
 
     def gen_no_perm(self, l):
-        self.perm = list(range(l))
+        self.perm = np.arange(l, dtype=self._index_dtype(l))
         self._gen_perm_inv()
 
     def gen_rev_perm(self, l):
-        self.perm = list(reversed(range(l)))
+        self.perm = np.arange(l - 1, -1, -1, dtype=self._index_dtype(l))
         self._gen_perm_inv()
 
-    def gen_rand_perm(self, l):
-        self.perm = list(range(l))
-        random.shuffle(self.perm)
+    def gen_rand_perm(self, l, rng=np.random):
+        # rng: numpy random generator (default: global numpy random state)
+        self.perm = rng.permutation(l).astype(self._index_dtype(l))
         self._gen_perm_inv()
 
     def gen_qpp_perm(self, N):
         # possible values for N = power of two
-        self.perm = list(range(N))
         k = int((math.log2(N) + 1) / 2)
-        self.perm = [((2 ** k - 1) * x + 2 ** (k + 1) * x ** 2) % N for x in self.perm]
-        self._gen_perm_inv()
+        self.gen_qpp_perm_poly(N, 2 ** k - 1, 2 ** (k + 1))
 
     def gen_qpp_perm_poly(self, N, k1, k2):
-        self.perm = list(range(N))
-        self.perm = [(k1 * x + k2 * x ** 2) % N for x in self.perm]
+        # perm[x] = (k1 * x + k2 * x^2) mod N, all intermediate results are reduced modulo N
+        # such that they fit into int64 for N < 2^31 (object arrays of python ints are used otherwise)
+        dtype = np.int64 if N < 2 ** 31 else object
+        x = np.arange(N, dtype=np.int64).astype(dtype)
+        x2 = (x * x) % N
+        self.perm = (((k1 % N) * x) % N + ((k2 % N) * x2) % N) % N
+        self.perm = self.perm.astype(self._index_dtype(N))
         self._gen_perm_inv()
 
+    def gen_lte_perm(self, K):
+        # QPP interleaver of LTE, K is one of the 188 block sizes of lte_qpp_params (40 ... 6144)
+        if K not in lte_qpp_params:
+            raise ValueError('no LTE QPP interleaver for block size {}'.format(K))
+        self.gen_qpp_perm_poly(K, *lte_qpp_params[K])
+
+    def gen_umts_perm(self, K):
+        """
+        Prime interleaver of the UMTS turbo code (3GPP TS 25.212, section 4.2.3.2.3), K = 40 ... 5114.
+        The bits are written row by row into a R x C matrix, the rows are permuted within themselves
+        (based on a primitive root of the prime p) and between each other, and the bits are read out
+        column by column, skipping the padding positions >= K.
+        """
+        if not 40 <= K <= 5114:
+            raise ValueError('no UMTS interleaver for block size {}'.format(K))
+
+        # number of rows R, prime p and number of columns C
+        if K <= 159:
+            R = 5
+        elif K <= 200 or 481 <= K <= 530:
+            R = 10
+        else:
+            R = 20
+        if 481 <= K <= 530:
+            p, C = 53, 53
+        else:
+            p = 7
+            while K > R * (p + 1) or not self._is_prime(p):
+                p += 1
+            C = p - 1 if K <= R * (p - 1) else p if K <= R * p else p + 1
+
+        # base sequence of the intra-row permutation
+        v = self._primitive_root(p)
+        s = [1]
+        for j in range(1, p - 1):
+            s.append(v * s[-1] % p)
+        s = np.array(s)
+
+        # primes q_i > 6 relatively prime to p - 1, permuted by the inter-row pattern
+        if R == 5:
+            T = list(range(4, -1, -1))
+        elif R == 10:
+            T = list(range(9, -1, -1))
+        elif 2281 <= K <= 2480 or 3161 <= K <= 3210:
+            T = umts_pattern_b
+        else:
+            T = umts_pattern_a
+        q = [1]
+        while len(q) < R:
+            q.append(q[-1] + 1)
+            while q[-1] <= 6 or not self._is_prime(q[-1]) or math.gcd(q[-1], p - 1) != 1:
+                q[-1] += 1
+        r = np.zeros(R, dtype=int)
+        r[T] = q
+
+        # intra-row permutations U[i, j]
+        j = np.arange(p - 1)
+        U = s[(j[None, :] * r[:, None]) % (p - 1)]
+        if C == p - 1:
+            U = U - 1
+        else:
+            U = np.hstack((U, np.zeros((R, 1), dtype=int)))
+            if C == p + 1:
+                U = np.hstack((U, np.full((R, 1), p)))
+                if K == R * C:
+                    U[R - 1, 0], U[R - 1, p] = U[R - 1, p], U[R - 1, 0]
+
+        # inter-row permutation, read out column by column and prune
+        index = (np.array(T)[:, None] * C + U[T]).T.reshape(-1)
+        self.set_permutation(index[index < K])
+
+    def gen_srandom_perm(self, l, s=None, rng=np.random, max_trials=100):
+        """
+        S-random interleaver: random permutation where any two indices within a distance of s
+        are mapped to indices with a distance > s (default s: floor(sqrt(l / 2)) - 1).
+        The indices are drawn in random order, an index which does not fit anywhere at the end is
+        swapped with an earlier one. The construction is restarted if this fails as well.
+        """
+        if s is None:
+            s = max(int(math.sqrt(l / 2)) - 1, 1)
+
+        def fits(perm, c, i, lo, hi):
+            # c has a distance > s to perm[lo:i] and perm[i+1:hi]
+            return (np.abs(perm[lo:i] - c) > s).all() and (np.abs(perm[i + 1:hi] - c) > s).all()
+
+        for trial in range(max_trials):
+            perm = np.zeros(l, dtype=np.int64)
+            remaining = rng.permutation(l)
+            for i in range(l):
+                # first remaining index (in random order) with a distance > s to the recent ones
+                recent = perm[max(i - s, 0):i]
+                c = None
+                for start in range(0, len(remaining), 64):
+                    valid = (np.abs(remaining[start:start + 64, None] - recent[None, :]) > s).all(axis=1)
+                    if valid.any():
+                        c = start + int(np.argmax(valid))
+                        break
+                if c is not None:
+                    perm[i] = remaining[c]
+                    remaining = np.delete(remaining, c)
+                    continue
+
+                # stuck: swap with an earlier index j, such that both fit at their new positions
+                perm[i] = remaining[0]
+                for j in rng.permutation(i):
+                    perm[i], perm[j] = perm[j], perm[i]
+                    if fits(perm, perm[j], j, max(j - s, 0), min(j + s + 1, i + 1)) \
+                            and fits(perm, perm[i], i, max(i - s, 0), i):
+                        break
+                    perm[i], perm[j] = perm[j], perm[i]
+                else:
+                    break  # restart
+                remaining = remaining[1:]
+            else:
+                self.set_permutation(perm)
+                return
+        raise ValueError('no S-random interleaver found for l={}, s={}'.format(l, s))
+
+    def gen_drp_perm(self, l, p, s=0, read_dither=[0], write_dither=[0]):
+        """
+        Dithered relative prime (DRP) interleaver: perm[i] = a[b[c[i]]] with the read dither
+        a[i] = R * floor(i / R) + read_dither[i mod R], the relative prime interleaver
+        b[i] = (s + p * i) mod l and the write dither c[i] = W * floor(i / W) + write_dither[i mod W].
+        l has to be a multiple of R and W (the lengths of the dither vectors) and p relatively prime to l.
+        """
+        if math.gcd(p, l) != 1:
+            raise ValueError('p={} is not relatively prime to l={}'.format(p, l))
+        i = np.arange(l, dtype=np.int64)
+        dither = []
+        for d in [read_dither, write_dither]:
+            d = np.asarray(d, dtype=np.int64)
+            if l % len(d) != 0 or sorted(d.tolist()) != list(range(len(d))):
+                raise ValueError('dither vector of length {} does not fit l={}'.format(len(d), l))
+            dither.append(len(d) * (i // len(d)) + d[i % len(d)])
+        a, c = dither
+        b = (s + (p % l) * i) % l
+        self.set_permutation(a[b[c]])
+
+    def get_bank_mapping(self, P, inverse=False):
+        """
+        Memory bank accesses of a P-way parallel decoder: the block is split into P windows of
+        length W = N / P which are processed in parallel, and memory bank t holds the indices
+        t * W ... (t + 1) * W - 1. In cycle j window t accesses perm[t * W + j].
+
+        Parameters
+        ----------
+        P [int]: degree of parallelism (has to divide the block size N)
+        inverse [bool]: mapping of the inverse permutation (deinterleaving)
+
+        Returns
+        -------
+        banks: [array] shape (W, P), banks[j, t] is the bank accessed by window t in cycle j
+        """
+        N = self.get_length()
+        if P < 1 or N % P != 0:
+            raise ValueError('the parallelism {} does not divide the block size {}'.format(P, N))
+        W = N // P
+        perm = self.perm_inv if inverse else self.perm
+        return (perm.reshape(P, W).T // W).astype(np.int32)
+
+    def is_contention_free(self, P):
+        """
+        True if P windows can access the memory banks in parallel without conflicts, i.e. all
+        windows access a different bank in every cycle, for interleaving and deinterleaving.
+        """
+        if P < 1 or self.get_length() % P != 0:
+            return False
+        for inverse in [False, True]:
+            banks = np.sort(self.get_bank_mapping(P, inverse), axis=1)
+            if not (banks == np.arange(P)).all():
+                return False
+        return True
+
+    def get_contention_free_degrees(self):
+        # all degrees of parallelism P for which the interleaver is contention-free
+        N = self.get_length()
+        return [P for P in range(1, N + 1) if N % P == 0 and self.is_contention_free(P)]
+
+    def gen_contention_free_perm(self, N, P, rng=np.random, max_trials=1000):
+        """
+        Generate a QPP interleaver of length N, which is contention-free for all divisors of N
+        and therefore for P. The LTE interleaver is taken for LTE block sizes, otherwise random
+        QPP parameters are drawn: k1 relatively prime to N and k2 a multiple of all prime factors of N.
+        """
+        if P < 1 or N % P != 0:
+            raise ValueError('the parallelism {} does not divide the block size {}'.format(P, N))
+        if N in lte_qpp_params:
+            self.gen_lte_perm(N)
+            return
+        primes = [p for p in range(2, N + 1) if N % p == 0 and self._is_prime(p)]
+        radical = int(np.prod(primes))
+        for trial in range(max_trials):
+            k1 = 1 + int(rng.choice(N - 1)) if N > 1 else 1
+            m = 1 + int(rng.choice(max(N // radical - 1, 1)))
+            if math.gcd(k1, N) != 1:
+                continue
+            self.gen_qpp_perm_poly(N, k1, radical * m)
+            if len(np.unique(self.perm)) == N and self.is_contention_free(P):
+                return
+        raise ValueError('no contention-free interleaver found for N={}, P={}'.format(N, P))
+
+    @staticmethod
+    def _is_prime(n):
+        return n >= 2 and all(n % d for d in range(2, int(math.sqrt(n)) + 1))
+
+    @staticmethod
+    def _primitive_root(p):
+        # smallest primitive root of the prime p (the values of the UMTS table)
+        factors = [f for f in range(2, p) if (p - 1) % f == 0 and Interleaver._is_prime(f)]
+        for v in range(2, p):
+            if all(pow(v, (p - 1) // f, p) != 1 for f in factors):
+                return v
+
     def _gen_perm_inv(self):
-        self.perm_inv = [0] * len(self.perm)
-        for i in range(len(self.perm)):
-            self.perm_inv[self.perm[i]] = i
+        self.perm_inv = np.empty_like(self.perm)
+        self.perm_inv[self.perm] = np.arange(len(self.perm), dtype=self.perm.dtype)
+
+    @staticmethod
+    def _index_dtype(n):
+        return np.int32 if n < 2 ** 31 else np.int64
+
+    def interleave(self, data, out=None):
+        """
+        data: list, or numpy array of shape (..., N) which is interleaved along the last axis
+        (e.g. a batch of blocks). For numpy arrays the result can be written to out.
+        """
+        return self._apply(data, self.perm, out)
+
+    def deinterleave(self, data, out=None):
+        """ inverse of interleave """
+        return self._apply(data, self.perm_inv, out)
+
+    @staticmethod
+    def _apply(data, perm, out):
+        if not isinstance(data, np.ndarray):
+            return [data[index] for index in perm]
+        if out is None:
+            return data[..., perm]
+        return np.take(data, perm, axis=-1, out=out, mode='clip')
+
+
+def get_interleaver(kind, N, **params):
+    """
+    Returns an interleaver from the standard library, generated permutations are cached per
+    (kind, N, params) such that changing block sizes do not regenerate the permutations.
+    The instances are shared between all callers with the same parameters and must not be modified.
+
+    Parameters
+    ----------
+    kind [str]: 'lte' (QPP of 36.212), 'umts' (prime interleaver of 25.212), 'qpp' (gen_qpp_perm_poly
+                with params k1, k2, or gen_qpp_perm without), 'srandom' (params s, seed),
+                'drp' (params p, s, read_dither, write_dither), 'random' (param seed), 'none'
+    N [int]: block size
+    params: parameters of the generator
+
+    Returns
+    -------
+    il: [Interleaver] the interleaver instance
+    """
+    key = tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple, np.ndarray)) else v) for k, v in params.items()))
+    return _get_interleaver(kind, int(N), key)
 
-    def interleave(self, data):
-        return [data[index] for index in self.perm]
 
-    def deinterleave(self, data):
-        return [data[index] for index in self.perm_inv]
+@lru_cache(maxsize=256)
+def _get_interleaver(kind, N, key):
+    params = {k: list(v) if isinstance(v, tuple) else v for k, v in key}
+    il = Interleaver()
+    if kind == 'lte':
+        il.gen_lte_perm(N)
+    elif kind == 'umts':
+        il.gen_umts_perm(N)
+    elif kind == 'qpp':
+        if params:
+            il.gen_qpp_perm_poly(N, params['k1'], params['k2'])
+        else:
+            il.gen_qpp_perm(N)
+    elif kind == 'srandom':
+        il.gen_srandom_perm(N, params.get('s'), np.random.default_rng(params.get('seed', 0)))
+    elif kind == 'drp':
+        il.gen_drp_perm(N, **params)
+    elif kind == 'random':
+        il.gen_rand_perm(N, np.random.default_rng(params.get('seed', 0)))
+    elif kind == 'none':
+        il.gen_no_perm(N)
+    else:
+        raise ValueError('unknown interleaver type ' + repr(kind))
+    il.perm.flags.writeable = False
+    il.perm_inv.flags.writeable = False
+    return il
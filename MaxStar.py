@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+# title           : MaxStar.py
+# description     : This module implements variants of the max* operator (Jacobian logarithm)
+#                   max*(a, b) = log(exp(a) + exp(b)) = max(a, b) + log(1 + exp(-|a - b|))
+#                   used in the recursions and soft outputs of the SISO decoder.
+#                   All functions reduce an array along its last axis.
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import numpy as np
+
+# constant-log-MAP: correction constant_c if |a - b| < constant_t, else 0
+constant_c = 0.5
+constant_t = 1.5
+
+# lookup table log-MAP: correction log(1 + exp(-d)) sampled at d = 0, lut_step, 2 * lut_step, ...
+# (0 beyond the table)
+lut_step = 0.5
+lut = np.append(np.log1p(np.exp(-lut_step * np.arange(8))), 0)
+
+
+def max_log(x):
+    """ max-log approximation: max(a, b) """
+    return np.max(x, axis=-1)
+
+
+def log_map(x):
+    """ exact Jacobian logarithm: log(sum(exp(x))) """
+    return np.logaddexp.reduce(x, axis=-1)
+
+
+def constant_log_map(x):
+    """ max(a, b) + constant_c if |a - b| < constant_t """
+    return _reduce_pairwise(x, lambda d: np.where(d < constant_t, constant_c, 0))
+
+
+def lut_log_map(x):
+    """ max(a, b) + lut[floor(|a - b| / lut_step)] """
+    return _reduce_pairwise(x, lambda d: lut[np.minimum(d / lut_step, len(lut) - 1).astype(int)])
+
+
+max_star_functions = {
+    'max_log': max_log,
+    'log_map': log_map,
+    'constant_log_map': constant_log_map,
+    'lut_log_map': lut_log_map,
+}
+
+
+def _reduce_pairwise(x, correction):
+    # max*(... max*(max*(x0, x1), x2) ..., xn) with max*(a, b) = max(a, b) + correction(|a - b|)
+    m = x[..., 0]
+    for k in range(1, x.shape[-1]):
+        b = x[..., k]
+        with np.errstate(invalid='ignore'):
+            d = np.atleast_1d(np.abs(m - b))
+        d[np.isnan(d)] = np.inf  # -inf - -inf
+        m = np.maximum(m, b) + correction(d)
+    return m
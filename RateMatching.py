@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# title           : RateMatching.py
+# description     : This module implements rate matching of encoded streams by periodic puncturing and by the
+#                   circular buffer rate matching of the LTE turbo code (36.212 5.1.4.1), and the matching
+#                   de-rate matching of the llrs (zero llrs for the bits not transmitted, repeated bits combined).
+#                   The rate matching instances are set as rate_matching of ConvEncoder and TurboEncoder.
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import numpy as np
+
+# inter-column permutation of the sub-block interleaver (36.212 table 5.1.4-1)
+subblock_permutation = np.array([0, 16, 8, 24, 4, 20, 12, 28, 2, 18, 10, 26, 6, 22, 14, 30,
+                                 1, 17, 9, 25, 5, 21, 13, 29, 3, 19, 11, 27, 7, 23, 15, 31])
+
+
+class Puncturer(object):
+
+    def __init__(self, pattern):
+        # puncturing pattern (1: bit transmitted, 0: punctured), repeated periodically over the encoded stream,
+        # e.g. [1, 1, 0, 1, 0, 1] for a rate 1/2 turbo code (systematic, alternating parity bits)
+        self.pattern = pattern
+
+    def get_mask(self, n_encoded):
+        """ boolean mask of the transmitted bits of an encoded stream of n_encoded bits """
+        return np.resize(np.asarray(self.pattern, dtype=bool), n_encoded)
+
+    def get_n_transmitted(self, n_encoded):
+        return int(self.get_mask(n_encoded).sum())
+
+    def match(self, encoded):
+        """ transmitted bits of the encoded stream(s) [..., n_encoded] """
+        encoded = np.asarray(encoded)
+        return encoded[..., self.get_mask(encoded.shape[-1])]
+
+    def dematch(self, llr, n_encoded):
+        """ llrs of the encoded stream(s) [..., n_encoded] with zero llrs for the punctured bits """
+        llr = np.asarray(llr)
+        out = np.zeros(llr.shape[:-1] + (n_encoded,), dtype=np.result_type(llr.dtype, np.float32))
+        out[..., self.get_mask(n_encoded)] = llr
+        return out
+
+
+class CircularBufferRateMatcher(object):
+    """
+    Circular buffer rate matching of the LTE turbo code: the systematic and the two parity streams
+    (the streams of TurboEncoder, i.e. the flattened stream s0 p1_0 p2_0 s1 ...) are interleaved by
+    the sub-block interleaver, collected in the circular buffer (systematic bits first, then the parity bits
+    alternately) and n_transmitted bits are read from the start position of the redundancy version rv,
+    skipping the dummy bits and wrapping around (repetition) if n_transmitted is larger than the buffer.
+    """
+
+    def __init__(self, n_transmitted, rv=0):
+        self.n_transmitted = n_transmitted  # number of bits E after rate matching
+        self.rv = rv  # redundancy version 0..3
+        self.n_streams = 3
+        self._indices = {}  # (n_encoded, n_transmitted, rv) -> indices
+
+    def get_n_transmitted(self, n_encoded):
+        return self.n_transmitted
+
+    def get_buffer(self, n_encoded):
+        """
+        Circular buffer of an encoded stream of n_encoded bits, as indices into the flattened stream
+        (-1: dummy bit), and the start position k0 of the redundancy version
+        """
+        D = n_encoded // self.n_streams  # bits per stream
+        R = -(-D // 32)  # rows of the sub-block interleaver
+        K_pi = 32 * R
+        N_D = K_pi - D  # dummy bits at the start of each stream
+        k = np.arange(K_pi)
+        pos = subblock_permutation[k // R] + 32 * (k % R)  # position in the padded stream
+        pos_2 = (pos + 1) % K_pi  # third stream, interleaved individually
+
+        # flattened index of each stream position, -1 for the dummy bits
+        def index(position, stream):
+            return np.where(position >= N_D, self.n_streams * (position - N_D) + stream, -1)
+
+        buffer = np.empty(3 * K_pi, dtype=int)
+        buffer[:K_pi] = index(pos, 0)
+        buffer[K_pi::2] = index(pos, 1)
+        buffer[K_pi + 1::2] = index(pos_2, 2)
+        n_cb = len(buffer)
+        k0 = R * (2 * -(-n_cb // (8 * R)) * self.rv + 2)
+        return buffer, k0
+
+    def get_indices(self, n_encoded):
+        """ indices into the flattened encoded stream of the transmitted bits """
+        key = (n_encoded, self.n_transmitted, self.rv)
+        if key not in self._indices:
+            buffer, k0 = self.get_buffer(n_encoded)
+            buffer = np.roll(buffer, -k0)
+            self._indices[key] = np.resize(buffer[buffer >= 0], self.n_transmitted)
+        return self._indices[key]
+
+    def match(self, encoded):
+        """ transmitted bits [..., n_transmitted] of the encoded stream(s) [..., n_encoded] """
+        encoded = np.asarray(encoded)
+        return np.take(encoded, self.get_indices(encoded.shape[-1]), axis=-1)
+
+    def dematch(self, llr, n_encoded):
+        """
+        llrs of the encoded stream(s) [..., n_encoded], zero llrs for the bits not transmitted,
+        the llrs of repeated bits are added
+        """
+        llr = np.asarray(llr)
+        indices = self.get_indices(n_encoded)
+        out = np.zeros(llr.shape[:-1] + (n_encoded,), dtype=np.result_type(llr.dtype, np.float32))
+        for start in range(0, len(indices), n_encoded):  # the indices are distinct within a pass of the buffer
+            out[..., indices[start:start + n_encoded]] += llr[..., start:start + n_encoded]
+        return out
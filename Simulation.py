@@ -0,0 +1,267 @@
+#! /usr/bin/env python
+# title           : Simulation.py
+# description     : This module implements a Monte-Carlo bit error rate simulation engine.
+#                   Work units (EbN0 point, batch of blocks) are distributed over a process pool,
+#                   each work unit has its own reproducible random number stream.
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import TrellisCache
+from Channel import Modulation, Channel, get_noise_var
+from RateMatching import Puncturer, CircularBufferRateMatcher
+from ConvEncoder import ConvEncoder
+from ConvEncoder import TurboEncoder
+from ViterbiDecoder import ViterbiDecoder
+from SisoDecoder import SisoDecoder
+from Interleaver import Interleaver
+from TurboDecoder import TurboDecoder
+
+
+class SimulationResult(object):
+    """ Result of one EbN0 point """
+
+    def __init__(self, ebn0_db, n_iterations):
+        self.ebn0_db = ebn0_db
+        self.n_blocks = 0  # number of simulated blocks
+        self.n_bits = 0  # number of simulated data bits
+        self.errors = np.zeros(n_iterations, dtype=int)  # bit errors per iteration
+
+    def add(self, n_blocks, n_bits, errors):
+        self.n_blocks += n_blocks
+        self.n_bits += n_bits
+        self.errors += np.asarray(errors, dtype=int)
+
+    def get_ber(self):
+        return self.errors / max(self.n_bits, 1)
+
+    def __repr__(self):
+        return 'SimulationResult(ebn0_db={}, n_blocks={}, n_bits={}, errors={})'.format(
+            self.ebn0_db, self.n_blocks, self.n_bits, self.errors.tolist())
+
+
+class TurboLink(object):
+    """
+    Work unit function of a turbo coded transmission, by default BPSK over an AWGN channel
+    (the same setup as in TurboTest.py). The blocks of a work unit are decoded as a batch.
+    The max* operator of the siso decoders can be chosen (see SisoDecoder.max_star),
+    the modulation and channel are given by the scheme and fading of Channel.Modulation and Channel.Channel.
+    With a code rate (> 1/3), the encoded stream is rate matched by the LTE circular buffer rate matching.
+    The constituent encoders are terminated as in LTE (termination = 'lte') or zero padded (None).
+    """
+
+    def __init__(self, n_data=512, gp_forward=[[1, 1, 0, 1]], gp_feedback=[0, 0, 1, 1], iterations=6,
+                 max_star='max_log', modulation='bpsk', fading='awgn', rate=None, termination='lte'):
+        self.n_data = n_data
+        self.gp_forward = gp_forward
+        self.gp_feedback = gp_feedback
+        self.iterations = iterations
+        self.max_star = max_star
+        self.modulation = Modulation(modulation)
+        self.channel = Channel(fading)
+        self.rate = rate
+        self.termination = termination
+        self.turboenc = None
+        self.td = None
+
+    def __getstate__(self):
+        # encoder and decoder are rebuilt in the worker processes
+        state = self.__dict__.copy()
+        state['turboenc'] = None
+        state['td'] = None
+        return state
+
+    def get_n_iterations(self):
+        return self.iterations
+
+    def setup(self):
+        il = Interleaver()
+        il.gen_qpp_perm(self.n_data)
+        trellis_p = TrellisCache.get_trellis(self.gp_forward, self.gp_feedback)
+        trellis_identity = TrellisCache.get_trellis([[1]])
+        csiso = SisoDecoder(trellis_p)
+        csiso.backward_init = self.termination is not None  # end state 0 of terminated codes
+        csiso.max_star = self.max_star
+        self.turboenc = TurboEncoder([trellis_identity, trellis_p, trellis_p], il)
+        if self.rate is not None:
+            self.turboenc.rate_matching = CircularBufferRateMatcher(int(np.ceil(self.n_data / self.rate)))
+        self.td = TurboDecoder(il, csiso, csiso)
+        self.turboenc.termination = self.termination
+        self.td.termination = self.termination
+        self.td.iterations = self.iterations
+        if self.max_star != 'max_log':
+            self.td.ext_scale = 1
+
+    def __call__(self, ebn0_db, n_blocks, rng):
+        if self.td is None:
+            self.setup()
+        turboenc = self.turboenc
+
+        # generate data and encode
+        data_u = rng.integers(0, 2, (n_blocks, self.n_data), dtype=np.uint8)
+        encoded = turboenc.flatten(turboenc.encode(data_u))
+
+        # modulation, channel and demapping to llrs
+        # (code rate without the zero padding: 1/3 times the rate of the rate matching)
+        rate = turboenc.get_n_encoded(self.n_data) / encoded.shape[-1] / turboenc.r
+        noise_var = get_noise_var(ebn0_db, rate, self.modulation)
+        y, h = self.channel.transmit(self.modulation.modulate(encoded), noise_var, rng)
+        encoded_rx = self.modulation.demodulate(y, noise_var, h, n_bits=encoded.shape[-1])
+
+        # turbo decoding
+        [ys, yp1, yp2] = turboenc.extract(encoded_rx, self.n_data)
+        _, errors = self.td.decode(ys, yp1, yp2, data_u)
+        return n_blocks * self.n_data, errors
+
+
+class ConvLink(object):
+    """
+    Work unit function of a convolutionally coded transmission with viterbi decoding, by default BPSK over
+    an AWGN channel (the same setup as in ViterbiTest.py). The blocks of a work unit are decoded as a batch.
+    The encoded stream is punctured with a puncturing pattern (see RateMatching.Puncturer) if given.
+    With tail_biting the blocks are tail-biting encoded (feedforward codes) instead of zero terminated.
+    """
+
+    def __init__(self, n_data=1000, gen_poly=[[1, 0, 1], [1, 1, 1]], gen_feedback=[], modulation='bpsk',
+                 fading='awgn', puncturing=None, tail_biting=False):
+        self.n_data = n_data
+        self.gen_poly = gen_poly
+        self.gen_feedback = gen_feedback
+        self.modulation = Modulation(modulation)
+        self.channel = Channel(fading)
+        self.puncturing = puncturing
+        self.tail_biting = tail_biting
+
+    def get_n_iterations(self):
+        return 1
+
+    def __call__(self, ebn0_db, n_blocks, rng):
+        trellis = TrellisCache.get_trellis(self.gen_poly, self.gen_feedback)
+        convenc = ConvEncoder(trellis)
+        if self.puncturing is not None:
+            convenc.rate_matching = Puncturer(self.puncturing)
+        viterbi = ViterbiDecoder(trellis)
+        viterbi.tail_biting = self.tail_biting
+        zero_termination = not self.tail_biting
+
+        # generate data and encode, incl zero termination
+        data_u = rng.integers(0, 2, (n_blocks, self.n_data), dtype=np.uint8)
+        if self.tail_biting:
+            encoded = convenc.encode_tail_biting(data_u)
+        else:
+            encoded = convenc.encode(data_u)
+
+        # modulation, channel and demapping to llrs of the mother code
+        # (code rate without the termination: mother code rate times the rate of the puncturing)
+        rate = convenc.get_n_encoded(self.n_data, zero_termination) / encoded.shape[-1] / trellis.get_rate()
+        noise_var = get_noise_var(ebn0_db, rate, self.modulation)
+        y, h = self.channel.transmit(self.modulation.modulate(encoded), noise_var, rng)
+        encoded_rx = convenc.dematch(self.modulation.demodulate(y, noise_var, h, n_bits=encoded.shape[-1]),
+                                     self.n_data, zero_termination)
+
+        # viterbi decoding
+        n_stages = self.n_data + (trellis.tdef.K - 1) * zero_termination
+        data_r = viterbi.decode(encoded_rx, n_stages)[:, :self.n_data]
+        return n_blocks * self.n_data, [(data_r != data_u).sum()]
+
+
+def run(link, ebn0_range, max_errors=100, max_blocks=1000, blocks_per_unit=10, n_workers=None, seed=0):
+    """
+    Monte-Carlo simulation of a link over a range of EbN0 points.
+
+    The work units of all points are distributed over a process pool. A point is stopped when
+    the errors of the last iteration reach max_errors or max_blocks blocks are simulated.
+    The random numbers of every work unit are drawn from its own stream, spawned from
+    numpy.random.SeedSequence(seed) per point and per unit, and the units of a point are
+    accumulated in unit order. The results are therefore reproducible for a given seed,
+    independently of the number of workers and the order in which the units finish.
+
+    Parameters
+    ----------
+    link [callable]: work unit function link(ebn0_db, n_blocks, rng) -> (n_bits, errors per iteration),
+                     must be picklable and provide get_n_iterations() (e.g. TurboLink, ConvLink)
+    ebn0_range [list]: EbN0 points in dB
+    max_errors [int]: stopping rule, number of bit errors (last iteration) per point
+    max_blocks [int]: stopping rule, maximum number of blocks per point
+    blocks_per_unit [int]: number of blocks per work unit
+    n_workers [int]: number of worker processes (None: number of cpus, 1: simulate in this process)
+    seed [int]: seed of the random number streams
+
+    Returns
+    -------
+    results: [list of SimulationResult] one result per EbN0 point
+    """
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_units = -(-max_blocks // blocks_per_unit)
+    point_seeds = np.random.SeedSequence(seed).spawn(len(ebn0_range))
+    points = [_Point(SimulationResult(ebn0_db, link.get_n_iterations()), seed_seq.spawn(n_units),
+                     blocks_per_unit, max_errors, max_blocks) for ebn0_db, seed_seq in zip(ebn0_range, point_seeds)]
+
+    if n_workers == 1:
+        for point in points:
+            while point.can_submit():
+                unit, n_blocks, rng = point.next_unit()
+                point.add(unit, link(point.result.ebn0_db, n_blocks, rng))
+        return [point.result for point in points]
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = {}  # future -> (point, unit)
+        while True:
+            # keep all workers busy with units of points that are not done
+            for point in points:
+                while len(futures) < 2 * n_workers and point.can_submit():
+                    unit, n_blocks, rng = point.next_unit()
+                    futures[executor.submit(link, point.result.ebn0_db, n_blocks, rng)] = (point, unit)
+            if len(futures) == 0:
+                break
+
+            # collect finished units
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future not in futures:  # unit of a point that is done in the meantime
+                    continue
+                point, unit = futures.pop(future)
+                point.add(unit, future.result())
+                if point.done:  # cancel the units of this point that are no longer needed
+                    for f in [f for f, (q, _) in futures.items() if q is point]:
+                        f.cancel()
+                        futures.pop(f)
+
+    return [point.result for point in points]
+
+
+class _Point(object):
+    """ scheduling state of an EbN0 point """
+
+    def __init__(self, result, unit_seeds, blocks_per_unit, max_errors, max_blocks):
+        self.result = result
+        self.unit_seeds = unit_seeds
+        self.unit_blocks = [min(blocks_per_unit, max_blocks - u * blocks_per_unit) for u in range(len(unit_seeds))]
+        self.max_errors = max_errors
+        self.max_blocks = max_blocks
+        self.n_submitted = 0
+        self.n_accumulated = 0
+        self.pending = {}  # unit index -> result of a finished unit that is not accumulated yet
+        self.done = False
+
+    def can_submit(self):
+        return not self.done and self.n_submitted < len(self.unit_seeds)
+
+    def next_unit(self):
+        unit = self.n_submitted
+        self.n_submitted += 1
+        return unit, self.unit_blocks[unit], np.random.default_rng(self.unit_seeds[unit])
+
+    def add(self, unit, unit_result):
+        # accumulate the finished units in unit order (for reproducibility) until a stopping rule applies
+        self.pending[unit] = unit_result
+        while not self.done and self.n_accumulated in self.pending:
+            n_bits, errors = self.pending.pop(self.n_accumulated)
+            self.result.add(self.unit_blocks[self.n_accumulated], n_bits, errors)
+            self.n_accumulated += 1
+            self.done = self.result.errors[-1] >= self.max_errors or self.result.n_blocks >= self.max_blocks \
+                or self.n_accumulated == len(self.unit_seeds)
@@ -1,10 +1,17 @@
 #! /usr/bin/env python
 # title           : SisoDecoder.py
 # description     : This class implements soft input soft output decoder for specified trellis.
-#                   Its input is a trellis instance. The max-log-BCJR algorithm is employed.
+#                   Its input is a trellis instance. The max-log-BCJR algorithm is employed
+#                   (or, with the numpy engine, the BCJR algorithm with another max* operator).
 # author          : Felix Arnold
 # python_version  : 3.5.2
 
+import copy
+import numpy as np
+import MaxStar
+import TrellisCache
+from DecoderStats import phase_timer, call_timer
+
 
 class SisoDecoder(object):
 
@@ -13,14 +20,49 @@ class SisoDecoder(object):
         self.trellis = trellis
         self.forward_init = True
         self.backward_init = True
+        # initial state metric of the states which are not the start (end) state,
+        # -np.inf makes the known start (end) state a hard constraint
         self.minus_inf = -10
+        self.normalization_period = 0  # subtract the maximum state metric every n stages (0: no renormalization)
+        self.engine = 'python'  # 'python' (reference loops) or 'numpy' (array backed)
+        self.window_size = 0  # number of stages of a window (sliding window decoding, 0: whole block)
+        self.training_length = None  # number of training stages of a window (None: 5 * K data bits)
+        self.n_subblocks = 1  # number of sub-blocks decoded in parallel
+        self.acquisition_length = None  # number of acquisition stages of a sub-block (None: 5 * K data bits)
+        self.executor = None  # concurrent.futures executor for the sub-blocks (None: decode them as a batch)
+        self.fixed_point = None  # FixedPoint instance for quantized decoding (None: floating point)
+        # max* operator of the numpy engine: 'max_log', 'log_map', 'constant_log_map', 'lut_log_map'
+        # (see MaxStar) or a function reducing an array along its last axis
+        self.max_star = 'max_log'
+        # number of trellis stages merged into one recursion step of the numpy engine (decoding on the
+        # trellis with reduction * stage_reduction, used if the number of stages is a multiple of it)
+        self.stage_reduction = 1
+        # DecoderStats instance collecting the decode time, and with the numpy engine the time and operation
+        # counts of the phases 'branch_metrics', 'acs' and 'soft_output' (None: no instrumentation)
+        self.stats = None
+
+    def __getstate__(self):
+        # the executor is not sent along when the decoder is pickled to a worker process
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
 
     def decode(self, input_u, input_c, n_data):
+        with call_timer(self.stats, n_data * (len(input_c) if np.ndim(input_c) == 2 else 1)):
+            # batches, sliding window and sub-block decoding are handled by the array engine
+            if self.engine == 'numpy' or np.ndim(input_c) == 2 or self.window_size or self.n_subblocks > 1 \
+                    or self.fixed_point is not None or self.max_star != 'max_log' or self.stage_reduction > 1:
+                return self.decode_numpy(input_u, input_c, n_data)
+            return self.decode_python(input_u, input_c, n_data)
+
+    def decode_python(self, input_u, input_c, n_data):
 
         minus_inf = self.minus_inf
         trellis = self.trellis
         n_stages = int(n_data / self.trellis.wu)
-        sm_vec_init = [0] + [minus_inf * self.forward_init] * (trellis.Ns - 1)  # init state metric vector
+        sm_vec_init = [0] + [minus_inf if self.forward_init else 0] * (trellis.Ns - 1)  # init state metric vector
+        const_dat = self._constant_bits(trellis.dat_np)
+        const_enc = self._constant_bits(trellis.enc_bits_np)
 
         # forward (alpha)
         sm_vec = sm_vec_init
@@ -42,20 +84,21 @@ class SisoDecoder(object):
                             branch_metric += uin[l]
                     branch_sums.append(sm_vec[trellis.get_prev_state_pc[branches[k]]] + branch_metric)  # add (gamma)
                 sm_vec_new.append(max(branch_sums))  # compare and select
-            sm_vec = list(sm_vec_new)
+            sm_vec = self._normalize_python(sm_vec_new, i + 1)
             sm_forward.append(sm_vec)
 
         # backward (beta)
         output_u = []
         output_c = []
-        sm_vec = [0] + [minus_inf * self.backward_init] * (trellis.Ns - 1)  # init state metric vector
+        sm_vec = [0] + [minus_inf if self.backward_init else 0] * (trellis.Ns - 1)  # init state metric vector
 
         for i in reversed(range(0, n_stages)):  # for each stage
             sm_vec_new = []
             cin = input_c[trellis.wc * i:trellis.wc * (i + 1)]
             uin = input_u[trellis.wu * i: trellis.wu * (i + 1)]
-            max_branch_dat = [[minus_inf, minus_inf] for i in range(trellis.wu)]
-            max_branch_enc = [[minus_inf, minus_inf] for i in range(trellis.wc)]
+            # maxima over the branches with bit 0 and 1 (the initial value does not bound the soft outputs)
+            max_branch_dat = [[-np.inf, -np.inf] for i in range(trellis.wu)]
+            max_branch_enc = [[-np.inf, -np.inf] for i in range(trellis.wc)]
             for j in range(trellis.Ns):  # for each state
                 branches = trellis.get_next_branches_pc[j]
                 branch_sums = []
@@ -90,12 +133,389 @@ class SisoDecoder(object):
 
                 sm_vec_new.append(max(branch_sums))  # compare and select
 
-            sm_vec = list(sm_vec_new)
+            sm_vec = self._normalize_python(sm_vec_new, n_stages - i)
 
             for n in reversed(range(trellis.wu)):  # soft output
-                output_u.insert(0, max_branch_dat[n][1] - max_branch_dat[n][0])
+                output_u.insert(0, self._soft_value(max_branch_dat[n], const_dat[n]))
 
             for n in reversed(range(trellis.wc)):  # soft encoded output
-                output_c.insert(0, max_branch_enc[n][1] - max_branch_enc[n][0])
+                output_c.insert(0, self._soft_value(max_branch_enc[n], const_enc[n]))
+
+        return output_u, output_c
+
+    def _soft_value(self, max_branch, constant):
+        # max over the branches with bit 1 minus max over the branches with bit 0,
+        # -minus_inf or minus_inf for a bit which is 1 or 0 on all branches (constant: None or the bit value)
+        if constant is not None:
+            return -self.minus_inf if constant else self.minus_inf
+        return max_branch[1] - max_branch[0]
+
+    @staticmethod
+    def _constant_bits(bits):
+        # value of each bit (column of bits [Nb x n_bits]) which is the same on all branches, else None
+        return [int(b[0]) if (b == b[0]).all() else None for b in np.asarray(bits).T]
+
+    def _normalize_python(self, sm_vec, n_steps):
+        # renormalization of a state metric vector (list) after n_steps recursion steps
+        if self.normalization_period and n_steps % self.normalization_period == 0:
+            sm_max = max(sm_vec)
+            return [sm - sm_max for sm in sm_vec]
+        return list(sm_vec)
+
+    def decode_numpy(self, input_u, input_c, n_data):
+        """
+        Array backed max-log-BCJR. Produces the same output as decode_python.
+        Several code blocks can be decoded at once by passing 2-D inputs of
+        shape (n_blocks, n_llrs), the recursions are then vectorized over the blocks.
+        If window_size is set, the block is decoded with a sliding window (see decode_windowed).
+        If fixed_point is set, the llrs are quantized and the recursions are computed in integer
+        arithmetic (see FixedPoint), the soft outputs are returned as float llrs.
+        The max operations of the recursions and soft outputs are done with the max* operator
+        max_star (floating point only, the fixed point decoder is max-log).
+        With stage_reduction > 1 the block is decoded on the higher radix trellis, which divides the
+        number of sequential recursion steps by stage_reduction (window_size, training_length and
+        acquisition_length are given in stages of the trellis of the decoder).
+
+        Parameters
+        ----------
+        input_u [list or array]: a priori llrs of the data bits
+        input_c [list or array]: channel llrs of the coded bits
+        n_data [int]: number of data bits per block (n_data / trellis.wu stages are decoded)
+
+        Returns
+        -------
+        output_u, output_c: [list] soft output of the data and coded bits
+                            ([array] of shape (n_blocks, n) for 2-D inputs)
+        """
+
+        batched = np.ndim(input_c) == 2
+        n_stages = int(n_data / self.trellis.wu)
+        if self.stage_reduction > 1 and n_stages % self.stage_reduction == 0:
+            return self._get_reduced_decoder().decode_numpy(input_u, input_c, n_data)
+        uin, cin = self._stage_inputs(input_u, input_c, n_data)
+
+        if self.window_size:
+            output_u, output_c = self.decode_windowed(uin, cin)
+        elif self.n_subblocks > 1:
+            output_u, output_c = self.decode_subblocks(uin, cin)
+        else:
+            n_blocks = cin.shape[1]
+            output_u, output_c = self._decode_stages(uin, cin, self._init_sm(n_blocks, self.forward_init),
+                                                     self._init_sm(n_blocks, self.backward_init))
+
+        if batched:
+            return output_u, output_c
+        return list(output_u[0]), list(output_c[0])
+
+    def _get_reduced_decoder(self):
+        """ a copy of this decoder on the trellis with reduction * stage_reduction """
+        r = self.stage_reduction
+        decoder = copy.copy(self)
+        decoder.trellis = TrellisCache.get_reduced_trellis(self.trellis, r)
+        decoder.stage_reduction = 1
+        decoder.window_size = -(-self.window_size // r)
+        for name in ['training_length', 'acquisition_length', 'normalization_period']:
+            if getattr(self, name):
+                setattr(decoder, name, -(-getattr(self, name) // r))
+        return decoder
+
+    def decode_windowed(self, uin, cin):
+        """
+        Sliding window max-log-BCJR. The forward recursion is continued from window to window but
+        only the alpha metrics of the current window are stored. The backward recursion of each
+        window is started training_length stages after the end of the window with equal state
+        metrics (or at the end of the block with the termination of the block), such that the
+        memory is O((window_size + training_length) * Ns) and the backward recursions of the
+        windows are independent of each other.
+
+        Parameters
+        ----------
+        uin, cin [array]: input llrs of shape (n_stages, n_blocks, wu) and (n_stages, n_blocks, wc)
+
+        Returns
+        -------
+        output_u, output_c: [array] soft outputs of shape (n_blocks, n_stages * wu) and (n_blocks, n_stages * wc)
+        """
+        trellis = self.trellis
+        stats = self.stats
+        n_stages, n_blocks = cin.shape[0], cin.shape[1]
+        window = self.window_size
+        training = self.training_length
+        if training is None:
+            training = trellis.get_convergence_length()
+
+        output_u = np.empty((n_blocks, n_stages * trellis.wu))
+        output_c = np.empty((n_blocks, n_stages * trellis.wc))
+        alpha_start = self._init_sm(n_blocks, self.forward_init)
+        for start in range(0, n_stages, window):
+            stop = min(start + window, n_stages)  # end of the window
+            stop_training = min(stop + training, n_stages)  # end of the training (acquisition) region
+            n_win = stop - start
+            with phase_timer(stats, 'branch_metrics', (stop_training - start) * n_blocks * trellis.Nb):
+                gamma = self._gamma(uin[start:stop_training], cin[start:stop_training])
+
+            with phase_timer(stats, 'acs', (2 * n_win + stop_training - stop) * n_blocks * trellis.Ns):
+                # forward
+                alpha = self._forward(alpha_start, gamma[:n_win])
+                alpha_start = alpha[-1]
+
+                # backward, training
+                if stop_training == n_stages:
+                    beta_end = self._init_sm(n_blocks, self.backward_init)
+                else:
+                    beta_end = self._init_sm(n_blocks, False)
+                _, beta_end = self._backward(beta_end, gamma[n_win:])
+
+                # backward, window
+                beta, _ = self._backward(beta_end, gamma[:n_win])
+
+            with phase_timer(stats, 'soft_output', n_win * n_blocks * (trellis.wu + trellis.wc)):
+                out_u, out_c = self._soft_outputs(alpha, gamma[:n_win], beta)
+            output_u[:, start * trellis.wu:stop * trellis.wu] = out_u
+            output_c[:, start * trellis.wc:stop * trellis.wc] = out_c
+
+        return output_u, output_c
+
+    def decode_subblocks(self, uin, cin):
+        """
+        Parallel sub-block max-log-BCJR. The block is split into n_subblocks sub-blocks of equal length.
+        Each sub-block is extended by acquisition_length stages on both sides, where the recursions
+        start with equal state metrics (unless the extension reaches the start or end of the block).
+        The sub-blocks are independent: they are decoded together as a batch (i.e. the number of
+        sequential recursion steps is divided by n_subblocks) or, if an executor
+        (concurrent.futures) is set, one task per sub-block is submitted to the executor.
+
+        Parameters
+        ----------
+        uin, cin [array]: input llrs of shape (n_stages, n_blocks, wu) and (n_stages, n_blocks, wc)
 
+        Returns
+        -------
+        output_u, output_c: [array] soft outputs of shape (n_blocks, n_stages * wu) and (n_blocks, n_stages * wc)
+        """
+        trellis = self.trellis
+        n_stages, n_blocks = cin.shape[0], cin.shape[1]
+        acquisition = self.acquisition_length
+        if acquisition is None:
+            acquisition = trellis.get_convergence_length()
+        length = -(-n_stages // self.n_subblocks)  # stages per sub-block
+        n_sub = -(-n_stages // length)
+        n_ext = min(n_stages, length + 2 * acquisition)  # stages per extended sub-block
+
+        # first stage of each extended sub-block (all extended sub-blocks have the same length)
+        starts = [min(max(p * length - acquisition, 0), n_stages - n_ext) for p in range(n_sub)]
+        index = np.array(starts)[:, None] + np.arange(n_ext)
+        uin_sub = uin[index].transpose(1, 0, 2, 3).reshape(n_ext, n_sub * n_blocks, trellis.wu)
+        cin_sub = cin[index].transpose(1, 0, 2, 3).reshape(n_ext, n_sub * n_blocks, trellis.wc)
+
+        # initial state metrics: block termination at the block boundaries, otherwise all states equal
+        alpha_init = np.array([self._init_sm(n_blocks, False)] * n_sub)
+        beta_init = np.array([self._init_sm(n_blocks, False)] * n_sub)
+        for p in range(n_sub):
+            if starts[p] == 0:
+                alpha_init[p] = self._init_sm(n_blocks, self.forward_init)
+            if starts[p] + n_ext == n_stages:
+                beta_init[p] = self._init_sm(n_blocks, self.backward_init)
+        alpha_init = alpha_init.reshape(n_sub * n_blocks, trellis.Ns)
+        beta_init = beta_init.reshape(n_sub * n_blocks, trellis.Ns)
+
+        # decode
+        if self.executor is None:
+            out_u, out_c = self._decode_stages(uin_sub, cin_sub, alpha_init, beta_init)
+        else:
+            rows = [slice(p * n_blocks, (p + 1) * n_blocks) for p in range(n_sub)]
+            futures = [self.executor.submit(self._decode_stages, uin_sub[:, r], cin_sub[:, r],
+                                            alpha_init[r], beta_init[r]) for r in rows]
+            results = [f.result() for f in futures]
+            out_u = np.concatenate([r[0] for r in results])
+            out_c = np.concatenate([r[1] for r in results])
+
+        # stitch the sub-blocks together
+        out_u = out_u.reshape(n_sub, n_blocks, n_ext, trellis.wu)
+        out_c = out_c.reshape(n_sub, n_blocks, n_ext, trellis.wc)
+        output_u = np.empty((n_blocks, n_stages, trellis.wu))
+        output_c = np.empty((n_blocks, n_stages, trellis.wc))
+        for p in range(n_sub):
+            start, stop = p * length, min((p + 1) * length, n_stages)
+            output_u[:, start:stop] = out_u[p, :, start - starts[p]:stop - starts[p]]
+            output_c[:, start:stop] = out_c[p, :, start - starts[p]:stop - starts[p]]
+        return output_u.reshape(n_blocks, -1), output_c.reshape(n_blocks, -1)
+
+    def _decode_stages(self, uin, cin, alpha_init, beta_init):
+        """ max-log-BCJR on stage inputs (see _stage_inputs) with the given initial state metric vectors """
+        trellis = self.trellis
+        stats = self.stats
+        n_steps = cin.shape[0] * cin.shape[1]  # stages x blocks
+        with phase_timer(stats, 'branch_metrics', n_steps * trellis.Nb):
+            gamma = self._gamma(uin, cin)
+        with phase_timer(stats, 'acs', 2 * n_steps * trellis.Ns):
+            alpha = self._forward(alpha_init, gamma)
+            beta, _ = self._backward(beta_init, gamma)
+        with phase_timer(stats, 'soft_output', n_steps * (trellis.wu + trellis.wc)):
+            return self._soft_outputs(alpha, gamma, beta)
+
+    def _stage_inputs(self, input_u, input_c, n_data):
+        """ reshape the inputs to (n_stages, n_blocks, wu) and (n_stages, n_blocks, wc) """
+        trellis = self.trellis
+        n_stages = int(n_data / trellis.wu)
+        input_u = np.atleast_2d(np.asarray(input_u, dtype=float))
+        input_c = np.atleast_2d(np.asarray(input_c, dtype=float))
+        if self.fixed_point is not None:
+            input_u = self.fixed_point.quantize(input_u)
+            input_c = self.fixed_point.quantize(input_c)
+        n_blocks = input_c.shape[0]
+        uin = input_u[:, :trellis.wu * n_stages].reshape(n_blocks, n_stages, trellis.wu).transpose(1, 0, 2)
+        cin = input_c[:, :trellis.wc * n_stages].reshape(n_blocks, n_stages, trellis.wc).transpose(1, 0, 2)
+        return uin, cin
+
+    def _init_sm(self, n_blocks, init):
+        """ initial state metric vectors: state 0 or (init = False) all states equally likely """
+        if self.fixed_point is not None:
+            sm_vec = np.full((n_blocks, self.trellis.Ns), self.fixed_point.get_init_value() * init,
+                             dtype=self.fixed_point.get_dtype())
+        else:
+            sm_vec = np.full((n_blocks, self.trellis.Ns), float(self.minus_inf) if init else 0.0)
+        sm_vec[:, 0] = 0
+        return sm_vec
+
+    def _gamma(self, uin, cin):
+        """ branch metrics of all stages, blocks and branches [n_stages x n_blocks x Nb] """
+        trellis = self.trellis
+        llr = np.concatenate((cin, uin), axis=2)
+        return trellis.get_branch_metrics(llr)
+
+    def _forward(self, sm_vec, gamma):
+        """ forward recursion (alpha), alpha[i] holds the state metric vectors before stage i """
+        trellis = self.trellis
+        prev_br = trellis.prev_branches_np.T  # [radix x Ns]
+        prev_br_state = trellis.prev_state_np[prev_br]
+        gamma = np.take(gamma, prev_br, axis=2)  # in the order of the acs [n_stages x n_blocks x radix x Ns]
+        alpha = np.empty((len(gamma) + 1,) + sm_vec.shape, dtype=sm_vec.dtype)
+        alpha[0] = sm_vec
+        if self._fast_acs():
+            for i in range(len(gamma)):  # add, compare, select
+                np.maximum.reduce(np.take(alpha[i], prev_br_state, axis=1) + gamma[i], axis=1, out=alpha[i + 1])
+            return alpha
+        if self.fixed_point is not None:
+            sm = np.empty(gamma.shape[1:], dtype=sm_vec.dtype)  # work buffer [n_blocks x radix x Ns]
+            for i in range(len(gamma)):  # add, compare, select in the integer type
+                np.take(alpha[i], prev_br_state, axis=1, out=sm)
+                self.fixed_point.acs(sm, gamma[i], out=alpha[i + 1])
+            return alpha
+        for i in range(len(gamma)):
+            alpha[i + 1] = self._acs(np.take(alpha[i], prev_br_state, axis=1), gamma[i], i + 1)
+        return alpha
+
+    def _backward(self, sm_vec, gamma):
+        """
+        backward recursion (beta), beta[i] holds the state metric vectors after stage i.
+        Returns all beta and the state metric vectors before the first stage.
+        """
+        trellis = self.trellis
+        next_br = trellis.next_branches_np.T  # [radix x Ns]
+        if next_br.min() < 0:
+            raise ValueError('trellis with merged parallel branches (no branch for some data inputs)')
+        next_br_state = trellis.next_state_np[next_br]
+        gamma = np.take(gamma, next_br, axis=2)  # [n_stages x n_blocks x radix x Ns]
+        beta = np.empty((len(gamma),) + sm_vec.shape, dtype=sm_vec.dtype)
+        if self._fast_acs():
+            for i in reversed(range(len(gamma))):  # add, compare, select
+                beta[i] = sm_vec
+                sm_vec = np.maximum.reduce(np.take(sm_vec, next_br_state, axis=1) + gamma[i], axis=1)
+            return beta, sm_vec
+        if self.fixed_point is not None and len(gamma):
+            sm = np.empty(gamma.shape[1:], dtype=sm_vec.dtype)  # work buffer [n_blocks x radix x Ns]
+            beta[-1] = sm_vec
+            for i in reversed(range(len(gamma))):  # add, compare, select in the integer type
+                np.take(beta[i], next_br_state, axis=1, out=sm)
+                sm_vec = self.fixed_point.acs(sm, gamma[i], out=beta[i - 1] if i > 0 else None)
+            return beta, sm_vec
+        for i in reversed(range(len(gamma))):
+            beta[i] = sm_vec
+            sm_vec = self._acs(np.take(sm_vec, next_br_state, axis=1), gamma[i], len(gamma) - i)
+        return beta, sm_vec
+
+    def _fast_acs(self):
+        # floating point max-log recursion without renormalization (inlined add, compare, select)
+        return self.fixed_point is None and self.max_star == 'max_log' and not self.normalization_period
+
+    def _acs(self, sm, gamma, n_steps):
+        """
+        add, compare, select of one recursion step over the radix branches of all states
+        sm, gamma [n_blocks x radix x Ns] -> new state metric vectors [n_blocks x Ns]
+        (the radix axis is not the last one, such that the max is taken elementwise over radix Ns-vectors)
+        """
+        if self.max_star == 'max_log':
+            sm_vec = np.max(sm + gamma, axis=1)
+        else:
+            sm_vec = self._max_star(np.moveaxis(sm + gamma, 1, -1))
+        return self._normalize(sm_vec, n_steps)
+
+    def _max_star(self, x):
+        """ max* over the last axis """
+        if self.max_star == 'max_log':
+            return np.max(x, axis=-1)
+        if callable(self.max_star):
+            return self.max_star(x)
+        return MaxStar.max_star_functions[self.max_star](x)
+
+    def _normalize(self, sm_vec, n_steps):
+        """ renormalization of the state metric vectors [n_blocks x Ns] after n_steps recursion steps """
+        if self.normalization_period and n_steps % self.normalization_period == 0:
+            sm_vec -= np.max(sm_vec, axis=1, keepdims=True)
+        return sm_vec
+
+    def _soft_outputs(self, alpha, gamma, beta):
+        """ soft outputs of the data and coded bits, shape (n_blocks, n_stages * wu) and (n_blocks, n_stages * wc) """
+        trellis = self.trellis
+        n_blocks = gamma.shape[1]
+
+        # total metric of every branch: alpha + gamma + beta
+        fp = self.fixed_point
+        if fp is None:
+            total = np.take(beta, trellis.next_state_np, axis=2) + gamma
+            total += np.take(alpha[:-1], trellis.prev_state_np, axis=2)
+        else:
+            total = fp.add(fp.add(np.take(beta, trellis.next_state_np, axis=2), gamma),
+                           np.take(alpha[:-1], trellis.prev_state_np, axis=2))
+
+        output_u = self._soft_output(total, trellis.dat_np).reshape(n_blocks, -1)
+        output_c = self._soft_output(total, trellis.enc_bits_np).reshape(n_blocks, -1)
         return output_u, output_c
+
+    def _soft_output(self, total, bits):
+        """
+        max over all branches with bit=1 minus max over all branches with bit=0, for each bit.
+        total [n_stages x n_blocks x Nb] -> output [n_blocks x n_stages x n_bits]
+
+        The branches with the same bit pattern (e.g. the radix branches of a state with the same data bits)
+        are first reduced to one metric per pattern, if all patterns occur equally often (e.g. trellises
+        without merged parallel branches). The bits are then decided on the (at most radix) pattern metrics.
+        """
+        minus_inf = self.minus_inf
+        fp = self.fixed_point
+        n_bits = bits.shape[1]
+        out = np.empty((total.shape[1], total.shape[0], n_bits))
+
+        patterns, counts = np.unique(bits @ (2 ** np.arange(n_bits)), return_counts=True)
+        if len(patterns) < len(bits) and (counts == counts[0]).all():
+            order = np.argsort(bits @ (2 ** np.arange(n_bits)), kind='stable')
+            grouped = np.take(total, order, axis=2).reshape(total.shape[:2] + (len(patterns), counts[0]))
+            total = fp.max(grouped) if fp is not None else self._max_star(grouped)
+            bits = (patterns[:, None] >> np.arange(n_bits)) & 1
+
+        for n in range(n_bits):
+            ones = np.nonzero(bits[:, n] == 1)[0]
+            zeros = np.nonzero(bits[:, n] == 0)[0]
+            total_1 = np.take(total, ones, axis=2)
+            total_0 = np.take(total, zeros, axis=2)
+            if len(ones) == 0 or len(zeros) == 0:  # bit with a constant value
+                if fp is None:
+                    out[:, :, n] = -minus_inf if len(zeros) == 0 else minus_inf
+                else:
+                    out[:, :, n] = fp.dequantize(fp.get_init_value() * (-1 if len(zeros) == 0 else 1))
+            elif fp is None:
+                out[:, :, n] = (self._max_star(total_1) - self._max_star(total_0)).T
+            else:
+                out[:, :, n] = fp.dequantize(fp.subtract(fp.max(total_1), fp.max(total_0))).T
+        return out
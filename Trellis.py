@@ -5,12 +5,35 @@
 # author          : Felix Arnold
 # python_version  : 3.5.2
 
+import numpy as np
 import utils
 
 
+def _pc_property(name):
+    # precomputed list get_<name>_pc, derived from the numpy table <name>_np on first access
+    # if the trellis was built from tables (e.g. memory mapped, see set_tables)
+    def fget(self):
+        if self._pc[name] is None:
+            self._pc[name] = getattr(self, name + '_np').tolist()
+        return self._pc[name]
+
+    def fset(self, value):
+        self._pc[name] = value
+    return property(fget, fset)
+
+
 class Trellis(object):
 
-    def __init__(self, trellisDefinition, reduction=1, merge_parallel=False):
+    table_names = ['dat', 'enc_bits', 'next_state', 'prev_state', 'next_branches', 'prev_branches']
+
+    get_dat_pc = _pc_property('dat')
+    get_enc_bits_pc = _pc_property('enc_bits')
+    get_next_state_pc = _pc_property('next_state')
+    get_prev_state_pc = _pc_property('prev_state')
+    get_next_branches_pc = _pc_property('next_branches')
+    get_prev_branches_pc = _pc_property('prev_branches')
+
+    def __init__(self, trellisDefinition, reduction=1, merge_parallel=False, tables=None):
 
         self.tdef = trellisDefinition
         self.reduction = reduction
@@ -22,6 +45,7 @@ class Trellis(object):
         self.wu = self.tdef.wu * reduction  # number of data bits
 
         # empty precomputed lists
+        self._pc = {}
         self.get_dat_pc = []
         self.get_enc_bits_pc = []
         self.get_next_state_pc = []
@@ -29,15 +53,98 @@ class Trellis(object):
         self.get_next_branches_pc = []
         self.get_prev_branches_pc = []
 
-        # perform computation of trellis
-        if reduction == 1 and not self.merge_parallel:
-            self.pre_calc_reduction1()
+        # contiguous array versions of the precomputed lists
+        self.dat_np = None  # [Nb x wu] int8
+        self.enc_bits_np = None  # [Nb x wc] int8
+        self.next_state_np = None  # [Nb] int32
+        self.prev_state_np = None  # [Nb] int32
+        self.next_branches_np = None  # [Ns x radix] int32, -1: no branch (merged parallel branches)
+        self.prev_branches_np = None  # [Ns x radix] int32
+
+        # perform computation of trellis (or take precomputed tables, see TrellisCache)
+        if tables is not None:
+            self.set_tables(tables)
         else:
-            self.pre_calculation()
+            if reduction == 1 and not self.merge_parallel:
+                self.pre_calc_reduction1()
+            else:
+                self.pre_calculation()
+            self.compile_tables()
 
     def get_rate(self):
         return self.wc / self.wu
 
+    def get_convergence_length(self):
+        """
+        number of stages of 5 * K data bits, after which recursions started with unknown state metrics
+        have converged (default traceback depth, training and acquisition length of the decoders)
+        """
+        return -(-5 * self.tdef.K // self.wu)
+
+    def get_branch_metrics(self, llr, data=True, branches=None):
+        """
+        Correlation metrics of the branches: sum of the llrs of all bits of a branch which are 1.
+        The bits are accumulated in the order coded bits, data bits (as in the reference decoders) such that
+        the result is bit exact. The partial sums are built over the distinct bit prefixes of the branches
+        (at most 2^(l+1) after bit l, e.g. 2^wc code words for data=False), each partial sum is calculated
+        once and expanded to the branches at the end.
+
+        Parameters
+        ----------
+        llr [array]: llrs of the coded bits followed by the data bits of a stage [... x (wc + wu)],
+                     or of the coded bits only [... x wc] (data=False)
+        data [bool]: include the data bits
+        branches [array]: indices of the branches to return (any shape, None: all branches)
+
+        Returns
+        -------
+        gamma: [array] branch metrics [... x Nb] (or [... x branches.shape])
+        """
+        bits = np.hstack((self.enc_bits_np, self.dat_np)) if data else self.enc_bits_np
+        if branches is None:
+            branches = np.arange(len(bits))
+        metric = np.zeros(llr.shape[:-1] + (1,), dtype=llr.dtype)  # partial sums of the distinct prefixes
+        prefix = np.zeros(len(bits), dtype=int)  # prefix of each branch
+        for l in range(bits.shape[1]):
+            keys, prefix = np.unique(2 * prefix + bits[:, l], return_inverse=True)
+            metric = np.take(metric, keys // 2, axis=-1)
+            metric += np.where(keys % 2 == 1, llr[..., l:l + 1], 0).astype(llr.dtype, copy=False)  # no 0 * -inf
+        gamma = np.take(metric, prefix.reshape(-1)[branches].reshape(-1), axis=-1)
+        return gamma.reshape(llr.shape[:-1] + np.shape(branches))
+
+    def compile_tables(self):
+        """
+        Convert the precomputed lists into contiguous numpy tables:
+          - dat_np, enc_bits_np: data and coded bits of each branch
+          - next_state_np, prev_state_np: end and start state of each branch
+          - next_branches_np, prev_branches_np: branches leaving / entering each state
+            (next_branches_np[state][data] is the branch taken for the data input, -1 if there is
+            no such branch because parallel branches were merged (merge_parallel), note that numpy
+            indexing with -1 does not fail but takes the last element)
+        """
+        self.dat_np = np.array(self.get_dat_pc, dtype=np.int8).reshape(-1, self.wu)
+        self.enc_bits_np = np.array(self.get_enc_bits_pc, dtype=np.int8).reshape(-1, self.wc)
+        self.next_state_np = np.array(self.get_next_state_pc, dtype=np.int32)
+        self.prev_state_np = np.array(self.get_prev_state_pc, dtype=np.int32)
+        self.next_branches_np = np.array(self.get_next_branches_pc, dtype=np.int32).reshape(self.Ns, -1)
+        self.prev_branches_np = np.array(self.get_prev_branches_pc, dtype=np.int32).reshape(self.Ns, -1)
+
+    def get_tables(self):
+        """
+        Returns the numpy tables as a dictionary {name: array} (names see table_names)
+        """
+        return {name: getattr(self, name + '_np') for name in self.table_names}
+
+    def set_tables(self, tables):
+        """
+        Set the numpy tables from a dictionary as returned by get_tables. The arrays are used as is
+        (e.g. memory mapped), the precomputed lists are derived from them on first access only.
+        """
+        for name in self.table_names:
+            setattr(self, name + '_np', tables[name])
+            self._pc[name] = None
+        self.Nb = len(self.dat_np)
+
     def pre_calc_reduction1(self):
         """
         Pre calculate the functions of a trellis:
@@ -70,76 +177,54 @@ class Trellis(object):
         Options are:
           - reduction = log2(radix)
           - merge parallel branches
+        The radix-2^reduction branches are built by composing the radix-2 tables of the
+        trellis definition 'reduction' times, a branch is a path of 'reduction' radix-2 branches.
         """
 
-        all_u, all_c, all_s = [], [], []
-        for s in range(self.Ns):
-            u, c, s = self._get_all_paths(self.reduction, s)
-            all_u = all_u + u
-            all_c = all_c + c
-            all_s = all_s + s
-
-        # init tables
-        n_branches_per_state = int(self.Nb / self.Ns)
-        self.get_dat_pc = []
-        self.get_enc_bits_pc = []
-        self.get_next_state_pc = []
-        self.get_prev_state_pc = []
-        self.get_next_branches_pc = [[-1] * n_branches_per_state for i in range(self.Ns)]
-        self.get_prev_branches_pc = [[] for i in range(self.Ns)]
-
-        # loop through all paths and generate a new branch for each
-        for branch_index in range(len(all_u)):
-
-            u = all_u[branch_index]
-            c = all_c[branch_index]
-            s = all_s[branch_index]
-
-            # check if branch already exists
-            n_states = self.get_next_state_pc
-            p_states = self.get_prev_state_pc
-            branch_exists = True in [x == s[0] and y == s[-1] for x, y in zip(p_states, n_states)]
-
-            if self.merge_parallel and branch_exists:
-                pass
-            else:
-                dat_int = utils.bin2dec(u)
-                self.get_dat_pc.append(u)
-                self.get_enc_bits_pc.append(c)
-                self.get_next_state_pc.append(s[-1])
-                self.get_prev_state_pc.append(s[0])
-                self.get_next_branches_pc[s[0]][dat_int] = branch_index
-                self.get_prev_branches_pc[s[-1]].append(branch_index)
-
-    def _get_all_paths(self, depth, state):
-        """
-        recursively get all paths form a start state with depth n
-
-        Parameters
-        ----------
-        depth [int]: depths of recursion
-        state [int]: start state for paths to be returned
-
-        Returns
-        -------
-        pathlist_u, pathlist_c, pathlist_s: [list of lists] list of paths
-        """
-
-        if depth == 0:
-            return [[]], [[]], [[state]]
-        else:
-            # for all next states (next_state
-            #   get all paths with depth-1 from next_state,
-            #   then add the path from state to next_state to all these paths
-            #   add new paths to list
-            pathlist_u, pathlist_c, pathlist_s = [], [], []
-            # pathlist_* are lists of paths
-            for b in self.tdef.get_next_branches(state):
-                next_state = self.tdef.get_next_state(b)
-                u1, c1, s1 = self._get_all_paths(depth - 1, next_state)
-                # for all lists in u1 add the new element
-                pathlist_u += [self.tdef.get_dat(b) + x for x in u1]
-                pathlist_c += [self.tdef.get_enc_bits(b) + x for x in c1]
-                pathlist_s += [[state] + x for x in s1]
-
-            return pathlist_u, pathlist_c, pathlist_s
+        tdef = self.tdef
+
+        # radix-2 tables of the trellis definition
+        dat1 = np.array([tdef.get_dat(b) for b in range(tdef.Nb)], dtype=int).reshape(tdef.Nb, tdef.wu)
+        enc1 = np.array([tdef.get_enc_bits(b) for b in range(tdef.Nb)], dtype=int).reshape(tdef.Nb, tdef.wc)
+        next_state1 = np.array([tdef.get_next_state(b) for b in range(tdef.Nb)], dtype=int)
+        next_branches1 = np.array([tdef.get_next_branches(s) for s in range(self.Ns)], dtype=int)
+
+        # all paths of depth 'reduction' from all states, path_branches[s, p, d] is the
+        # radix-2 branch taken at depth d of path p starting in state s
+        state = np.arange(self.Ns).reshape(self.Ns, 1)
+        path_branches = np.zeros((self.Ns, 1, 0), dtype=int)
+        for d in range(self.reduction):
+            b = next_branches1[state]  # (Ns, n_paths, 2)
+            path_branches = np.concatenate((np.repeat(path_branches, 2, axis=1), b.reshape(self.Ns, -1, 1)), axis=2)
+            state = next_state1[b.reshape(self.Ns, -1)]
+        path_branches = path_branches.reshape(-1, self.reduction)
+
+        all_u = dat1[path_branches].reshape(len(path_branches), -1)
+        all_c = enc1[path_branches].reshape(len(path_branches), -1)
+        all_s_prev = np.repeat(np.arange(self.Ns), path_branches.shape[0] // self.Ns)
+        all_s_next = state.reshape(-1)
+
+        # keep the first of all parallel branches (same start and end state)
+        if self.merge_parallel:
+            n_paths = len(all_u)
+            first = np.full(self.Ns * self.Ns, n_paths)  # first path for each (start, end) state pair
+            np.minimum.at(first, all_s_prev * self.Ns + all_s_next, np.arange(n_paths))
+            keep = np.zeros(n_paths, dtype=bool)
+            keep[first[first < n_paths]] = True
+            all_u, all_c = all_u[keep], all_c[keep]
+            all_s_prev, all_s_next = all_s_prev[keep], all_s_next[keep]
+            self.Nb = len(all_u)
+
+        # branch tables
+        n_branches_per_state = 2 ** self.wu
+        dat_int = all_u @ (2 ** np.arange(self.wu))  # see utils.bin2dec
+        next_branches = np.full((self.Ns, n_branches_per_state), -1, dtype=int)
+        next_branches[all_s_prev, dat_int] = np.arange(len(all_u))
+        prev_branches = np.argsort(all_s_next, kind='stable').reshape(self.Ns, -1)
+
+        self.get_dat_pc = all_u.tolist()
+        self.get_enc_bits_pc = all_c.tolist()
+        self.get_next_state_pc = all_s_next.tolist()
+        self.get_prev_state_pc = all_s_prev.tolist()
+        self.get_next_branches_pc = next_branches.tolist()
+        self.get_prev_branches_pc = prev_branches.tolist()
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+# title           : TrellisCache.py
+# description     : This module implements a persistent cache of precomputed trellises.
+#                   The numpy tables of a trellis are stored as .npy files in a cache directory
+#                   and are memory mapped on load. An in-process LRU cache is kept on top.
+# author          : Felix Arnold
+# python_version  : 3.5.2
+
+import os
+import hashlib
+import tempfile
+import shutil
+from functools import lru_cache
+import numpy as np
+from ConvTrellisDef import ConvTrellisDef
+from Trellis import Trellis
+
+CACHE_VERSION = 1  # increment when the table format changes
+
+# directory of the on-disk cache (None disables the on-disk cache)
+cache_dir = os.environ.get('TURPY_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'turpy'))
+
+
+def get_trellis(gen_matrix, gen_feedback=[], reduction=1, merge_parallel=False):
+    """
+    Returns a trellis of a convolutional code, from the in-process cache, from the on-disk cache
+    or newly computed (in that order). Newly computed trellises are stored in both caches.
+
+    Parameters
+    ----------
+    gen_matrix [list of lists]: generator polynomials (see ConvTrellisDef)
+    gen_feedback [list]: feedback polynomial (see ConvTrellisDef)
+    reduction [int]: log2(radix) (see Trellis)
+    merge_parallel [bool]: merge parallel branches (see Trellis)
+
+    Returns
+    -------
+    trellis: [Trellis] the trellis instance (shared between all callers with the same parameters)
+    """
+    key = (tuple(tuple(int(x) for x in g) for g in gen_matrix),
+           tuple(int(x) for x in gen_feedback),
+           int(reduction),
+           bool(merge_parallel))
+    return _get_trellis(key, cache_dir)
+
+
+def get_reduced_trellis(trellis, stage_reduction):
+    """
+    Returns the trellis of the same code with stage_reduction stages merged into one stage
+    (reduction * stage_reduction), from the caches of get_trellis (see stage_reduction of the decoders)
+
+    Parameters
+    ----------
+    trellis [Trellis]: trellis of a convolutional code (see ConvTrellisDef)
+    stage_reduction [int]: number of stages of trellis merged into one stage
+
+    Returns
+    -------
+    trellis: [Trellis] the trellis instance (shared between all callers with the same parameters)
+    """
+    tdef = trellis.tdef
+    return get_trellis(np.fliplr(tdef.gen_matrix).tolist(), np.fliplr(tdef.gen_feedback)[0].tolist(),
+                       trellis.reduction * stage_reduction, trellis.merge_parallel)
+
+
+def clear_cache(disk=False):
+    """ clear the in-process cache, and the on-disk cache if disk=True """
+    _get_trellis.cache_clear()
+    if disk and cache_dir is not None and os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.startswith('trellis_'):
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def get_cache_path(key, directory):
+    """ directory of a trellis in the on-disk cache """
+    digest = hashlib.sha1(repr((CACHE_VERSION, key)).encode()).hexdigest()
+    return os.path.join(directory, 'trellis_' + digest)
+
+
+@lru_cache(maxsize=32)
+def _get_trellis(key, directory):
+    gen_matrix, gen_feedback, reduction, merge_parallel = key
+    tdef = ConvTrellisDef([list(g) for g in gen_matrix], list(gen_feedback))
+
+    if directory is None:
+        return Trellis(tdef, reduction, merge_parallel)
+
+    path = get_cache_path(key, directory)
+    tables = _load_tables(path)
+    if tables is not None:
+        return Trellis(tdef, reduction, merge_parallel, tables)
+
+    trellis = Trellis(tdef, reduction, merge_parallel)
+    _store_tables(path, trellis.get_tables())
+    return trellis
+
+
+def _load_tables(path):
+    try:
+        return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in Trellis.table_names}
+    except (OSError, ValueError):
+        return None
+
+
+def _store_tables(path, tables):
+    # write into a temporary directory first and then rename it, such that concurrent
+    # processes never see a partially written trellis
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=directory)
+    except OSError:
+        return  # no writable cache directory, the trellis is only cached in-process
+    try:
+        for name, table in tables.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.ascontiguousarray(table))
+        os.rename(tmp_path, path)
+    except OSError:
+        pass  # another process stored the same trellis in the meantime
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
@@ -4,7 +4,10 @@
 # author          : Felix Arnold
 # python_version  : 3.5.2
 
+import time
 import numpy as np
+from DecoderStats import phase_timer, call_timer
+from ConvEncoder import lte_tail_index
 
 
 class TurboDecoder(object):
@@ -14,55 +17,236 @@ class TurboDecoder(object):
         self.convsiso_p1 = convsiso_p1
         self.convsiso_p2 = convsiso_p2
         self.il = interleaver
-        self.n_zp = 4  # zero padding
+        self.n_zp = 4  # zero padding or tail bits per stream
+        # termination of the constituent codes (see TurboEncoder.termination)
+        #   None: zero padding, the padded bits are known zeros (the siso decoders use backward_init = False)
+        #   'lte': the tail bits are extracted from the streams and decoded with the data bits, the siso decoders
+        #          end in state 0 (backward_init = True)
+        self.termination = None
         self.iterations = 6
+        self.ext_scale = 11 / 16  # scaling of the extrinsic information (max-log), 1 for log-MAP siso decoders
+
+        # early termination without reference data, stopping_rule is one of
+        #   None: no early termination
+        #   'hda': hard decisions of two consecutive iterations agree
+        #   'scr': sign changes of the extrinsic information between two iterations <= scr_threshold * n_data
+        #   'min_llr': minimum |llr| of the a posteriori information >= llr_threshold
+        #   'ce': cross entropy between two iterations < ce_threshold * cross entropy of the first iteration
+        #   'crc': crc_check(decoded bits) returns True
+        self.stopping_rule = None
+        self.scr_threshold = 0.005
+        self.llr_threshold = 10
+        self.ce_threshold = 1e-3
+        self.crc_check = None
+        self.iterations_used = 0  # iterations used in the last call of decode (array for 2-D inputs)
+        # DecoderStats instance collecting the decode time, the time per iteration, the iterations used and
+        # the time and operation counts of the phases 'interleaving', 'extrinsic' and 'stopping'
+        # (None: no instrumentation). The phases of the siso decoders are included if the same
+        # instance is set as stats of the siso decoders.
+        self.stats = None
+        self._buffers = None
 
     def decode(self, ys, yp1, yp2, expected_data=[]):
+        """
+        Turbo decoding of one code block (1-D inputs) or of several code blocks
+        at once (2-D inputs of shape (n_blocks, n_llrs)). With a stopping rule the
+        iterations of each block are stopped individually, the number of iterations
+        used per block is stored in iterations_used.
+
+        The a priori, systematic and extrinsic vectors are kept in preallocated buffers which are
+        reused over the iterations and calls (see _get_buffers). The rows 0..k-1 of the buffers hold
+        the k blocks that are still iterated, (de)interleaving is done by gathering into the buffers.
+
+        Returns
+        -------
+        dec_out: [list] decoded data bits ([array] of shape (n_blocks, n_data) for 2-D inputs)
+        errors_iter: [list] number of bit errors (summed over all blocks) per iteration
+        """
+        n_bits = (len(ys[0]) if np.ndim(ys) == 2 else len(ys)) - self.n_zp
+        with call_timer(self.stats, n_bits * (len(ys) if np.ndim(ys) == 2 else 1)):
+            return self._decode(ys, yp1, yp2, expected_data)
+
+    def _decode(self, ys, yp1, yp2, expected_data):
+
+        if self.termination == 'lte':
+            self._check_lte_termination()
 
         # initialize variables
-        n_data = len(ys) - self.n_zp
-        n_datazp = len(ys)
-        Lext = [0] * n_data
-        ext_scale = 11 / 16
-        ys_i = ys[0:-self.n_zp]  # systematic bits without zero padding (interleaved bits)
-        zp = [
-                 self.convsiso_p1.minus_inf] * self.n_zp  # zero padding (the trellis is not terminated to zero but zero padded)
+        batched = np.ndim(ys) == 2
+        ys = np.atleast_2d(np.asarray(ys, dtype=float))
+        yp1 = np.atleast_2d(np.asarray(yp1, dtype=float))
+        yp2 = np.atleast_2d(np.asarray(yp2, dtype=float))
+        n_blocks, n_datazp = ys.shape
+        n_data = n_datazp - self.n_zp
+        ext_scale = self.ext_scale
+        stats = self.stats
+        minus_inf = float(self.convsiso_p1.minus_inf)
         il = self.il
 
+        # number of trellis stages of the siso decoders
+        n_stages = n_data + 3 if self.termination == 'lte' else n_datazp
+        n_p1, n_p2 = (n_stages, n_stages) if self.termination == 'lte' else (yp1.shape[1], yp2.shape[1])
+        buf = self._get_buffers(n_blocks, n_data, n_stages, n_p1, n_p2)
+        ys_i = buf['ys_i']  # systematic bits without zero padding (interleaved bits)
+        ys_il = buf['ys_il']  # interleaved systematic bits
+        Lext = buf['Lext']  # extrinsic information (interleaved order)
+        Lext_new = buf['Lext_new']
+        Lext_a = buf['Lext_a']  # (de)interleaved extrinsic information, a priori information of a siso decoder
+        input_u1, input_u2 = buf['input_u1'], buf['input_u2']
+        yp1_w, yp2_w = buf['yp1'], buf['yp2']
+
+        ys_i[:] = ys[:, 0:n_data]
+        with phase_timer(stats, 'interleaving', n_blocks * n_data):
+            il.interleave(ys_i, out=ys_il)
+        Lext[:] = 0
+        if self.termination == 'lte':
+            # tail bits [x z x' z'] of the constituent codes (systematic tail bits without a priori information)
+            tail = np.empty((n_blocks, 12))
+            tail[:, lte_tail_index] = np.stack((ys, yp1, yp2), axis=1)[:, :, n_data:]
+            input_u1[:, n_data:] = tail[:, 0:3]
+            input_u2[:, n_data:] = tail[:, 6:9]
+            yp1_w[:, :n_data] = yp1[:, :n_data]
+            yp1_w[:, n_data:] = tail[:, 3:6]
+            yp2_w[:, :n_data] = yp2[:, :n_data]
+            yp2_w[:, n_data:] = tail[:, 9:12]
+        else:
+            yp1_w[:] = yp1
+            yp2_w[:] = yp2
+            # zero padding (the trellis is not terminated to zero but zero padded)
+            np.add(ys[:, n_data:], minus_inf, out=input_u1[:, n_data:])
+            input_u2[:, n_data:] = 2 * minus_inf
+
         errors_iter = [0] * self.iterations
+        dec_out = np.zeros((n_blocks, n_data), dtype=int)
+        iterations_used = np.full(n_blocks, self.iterations)
+        ce_first = np.zeros(n_blocks)  # cross entropy of the first iteration
+        active = np.arange(n_blocks)  # blocks that are still iterated
+        k = n_blocks
 
         for i in range(self.iterations):
+            if stats is not None:
+                start = time.perf_counter()
 
             # first half iteration ------------------------------------------------
 
             # prepare apriori information
-            input_u = [x + y for x, y in zip(ys, il.deinterleave(Lext) + zp)]
+            with phase_timer(stats, 'interleaving', k * n_data):
+                il.deinterleave(Lext[:k], out=Lext_a[:k])
+            with phase_timer(stats, 'extrinsic', k * n_data):
+                np.add(ys_i[:k], Lext_a[:k], out=input_u1[:k, 0:n_data])
 
             # decode
-            dec1, cout = self.convsiso_p1.decode(input_u, yp1, n_datazp)
+            dec1 = self._decode_half(self.convsiso_p1, input_u1[:k], yp1_w[:k], n_stages, batched)
 
             #  calculate extrinsic information
-            Lext = list(ext_scale * (np.array(dec1[0:-self.n_zp]) - np.array(il.deinterleave(Lext)) - np.array(ys_i)))
+            with phase_timer(stats, 'extrinsic', k * n_data):
+                np.subtract(dec1[:, 0:n_data], Lext_a[:k], out=Lext_new[:k])
+                Lext_new[:k] -= ys_i[:k]
+                Lext_new[:k] *= ext_scale
 
             # second half iteration ------------------------------------------------
 
             # prepare apriori information
-            input_u = [x + y for x, y in zip(il.interleave(ys_i) + zp, il.interleave(Lext) + zp)]
+            with phase_timer(stats, 'interleaving', k * n_data):
+                il.interleave(Lext_new[:k], out=Lext_a[:k])
+            with phase_timer(stats, 'extrinsic', k * n_data):
+                np.add(ys_il[:k], Lext_a[:k], out=input_u2[:k, 0:n_data])
 
             # decode
-            dec2, cout = self.convsiso_p2.decode(input_u, yp2, n_datazp)
+            dec2 = self._decode_half(self.convsiso_p2, input_u2[:k], yp2_w[:k], n_stages, batched)
 
             #  calculate extrinsic information
-            Lext = list(ext_scale * (
-                        np.array(dec2[0:-self.n_zp]) - np.array(il.interleave(Lext)) - il.interleave(np.array(ys_i))))
+            with phase_timer(stats, 'extrinsic', k * n_data):
+                np.subtract(dec2[:, 0:n_data], Lext_a[:k], out=Lext_new[:k])
+                Lext_new[:k] -= ys_il[:k]
+                Lext_new[:k] *= ext_scale
 
             # hard output
-            dec_out = il.deinterleave((np.array(dec2) > 0).astype(int))  # threshold
+            dec_out_prev = dec_out[active]
+            with phase_timer(stats, 'interleaving', k * n_data):
+                dec_out[active] = il.deinterleave(dec2[:, 0:n_data] > 0)  # threshold
+
+            # early termination
+            with phase_timer(stats, 'stopping', k):
+                stop = self._stop(i, dec_out_prev, dec_out[active], Lext[:k], Lext_new[:k], dec2[:, 0:n_data],
+                                  ce_first, active)
+                Lext, Lext_new = Lext_new, Lext
+                iterations_used[active[stop]] = i + 1
+                if stop.any():
+                    # move the blocks that are still iterated to the first rows of the buffers
+                    keep = ~stop
+                    for w in [ys_i, ys_il, Lext, input_u1, input_u2, yp1_w, yp2_w]:
+                        w[:keep.sum()] = w[:k][keep]
+                    active = active[keep]
+                    k = len(active)
+            if stats is not None:
+                stats.add_iteration(time.perf_counter() - start)
 
             if len(expected_data) > 0:  # ber calculation
-                errors = (np.array(expected_data) != dec_out).sum()
+                errors = int((np.atleast_2d(expected_data) != dec_out).sum())
                 errors_iter[i] = errors
                 if errors == 0:  # stopping criteria
-                    return (dec_out, errors_iter)
-
+                    iterations_used[active] = i + 1
+                    break
+
+            if k == 0:
+                break
+
+        if stats is not None:
+            stats.add_iterations_used(iterations_used)
+        if not batched:
+            self.iterations_used = int(iterations_used[0])
+            return (dec_out[0].tolist(), errors_iter)
+        self.iterations_used = iterations_used
         return (dec_out, errors_iter)
+
+    def _stop(self, i, dec_out_prev, dec_out, Lext_prev, Lext, dec, ce_first, active):
+        """ evaluate the stopping rule for all blocks that are iterated, returns a boolean array """
+        stop = np.zeros(len(active), dtype=bool)
+        if self.stopping_rule == 'hda':
+            stop = (i > 0) & (dec_out_prev == dec_out).all(axis=1)
+        elif self.stopping_rule == 'scr':
+            sign_changes = (np.sign(Lext) != np.sign(Lext_prev)).sum(axis=1)
+            stop = (i > 0) & (sign_changes <= self.scr_threshold * Lext.shape[1])
+        elif self.stopping_rule == 'min_llr':
+            stop = np.min(np.abs(dec), axis=1) >= self.llr_threshold
+        elif self.stopping_rule == 'ce':
+            ce = np.sum((Lext - Lext_prev) ** 2 * np.exp(-np.abs(dec)), axis=1)
+            if i == 0:
+                ce_first[active] = ce
+            stop = (i > 0) & (ce < self.ce_threshold * ce_first[active])
+        elif self.stopping_rule == 'crc':
+            stop = np.array([bool(self.crc_check(d)) for d in dec_out])
+        return stop
+
+    def _check_lte_termination(self):
+        # the 12 tail bits (lte_tail_index) are the tails of two constituent codes with K = 4 and one parity bit,
+        # which are transmitted as n_zp = 4 bits per stream and decoded with the known end state 0
+        if self.n_zp != 4:
+            raise ValueError('lte termination requires n_zp = 4 tail bits per stream')
+        for convsiso in [self.convsiso_p1, self.convsiso_p2]:
+            if convsiso.trellis.tdef.K != 4 or convsiso.trellis.tdef.wc != 1:
+                raise ValueError('lte termination requires constituent codes with K = 4 and one parity bit')
+            if not convsiso.backward_init:
+                raise ValueError('lte termination requires siso decoders with backward_init = True')
+
+    def _get_buffers(self, n_blocks, n_data, n_stages, n_p1, n_p2):
+        """ working buffers of decode, reallocated only if the number or the size of the blocks changes """
+        shapes = (n_blocks, n_data, n_stages, n_p1, n_p2)
+        if self._buffers is None or self._buffers['shapes'] != shapes:
+            self._buffers = {name: np.zeros((n_blocks, n_data)) for name in ['ys_i', 'ys_il', 'Lext', 'Lext_new', 'Lext_a']}
+            self._buffers['input_u1'] = np.zeros((n_blocks, n_stages))
+            self._buffers['input_u2'] = np.zeros((n_blocks, n_stages))
+            self._buffers['yp1'] = np.zeros((n_blocks, n_p1))
+            self._buffers['yp2'] = np.zeros((n_blocks, n_p2))
+            self._buffers['shapes'] = shapes
+        return self._buffers
+
+    @staticmethod
+    def _decode_half(convsiso, input_u, input_c, n_stages, batched):
+        # decode with a siso decoder, 1-D inputs are passed on as 1-D inputs
+        if batched:
+            dec, cout = convsiso.decode(input_u, input_c, n_stages)
+            return dec
+        dec, cout = convsiso.decode(input_u[0], input_c[0], n_stages)
+        return np.atleast_2d(np.asarray(dec))
@@ -5,7 +5,7 @@
 # python_version  : 3.5.2
 
 import numpy as np
-from numpy.random import rand, randn
+from numpy.random import rand
 from scipy.stats import norm
 import matplotlib.pyplot as plt
 from Trellis import Trellis
@@ -14,6 +14,7 @@ from ConvEncoder import TurboEncoder
 from SisoDecoder import SisoDecoder
 from Interleaver import Interleaver
 from TurboDecoder import TurboDecoder
+from Channel import Modulation, Channel, get_noise_var
 
 
 def main(n_data=512, n_blocks=10, verbose=True, do_plot=True):
@@ -30,10 +31,14 @@ def main(n_data=512, n_blocks=10, verbose=True, do_plot=True):
     trellis_p = Trellis(ConvTrellisDef(gp_forward, gp_feedback))
     trellis_identity = Trellis(ConvTrellisDef([[1]]))
     csiso = SisoDecoder(trellis_p)
-    csiso.backward_init = False
     trellises = [trellis_identity, trellis_p, trellis_p]
     turboenc = TurboEncoder(trellises, il)
     td = TurboDecoder(il, csiso, csiso)
+    turboenc.termination = 'lte'  # both constituent encoders are terminated to state 0
+    td.termination = 'lte'
+    bpsk = Modulation('bpsk')
+    awgn = Channel('awgn')
+    rng = np.random.default_rng()
 
     # loop over all SNRs
     error_vec = []
@@ -57,10 +62,10 @@ def main(n_data=512, n_blocks=10, verbose=True, do_plot=True):
             encoded_streams = turboenc.encode(data_u)
             encoded = np.array(turboenc.flatten(encoded_streams))
 
-            # additive noise
-            EbNo = 10.0 ** (EbNodB / 10.0)
-            noise_std = np.sqrt(2 + 1) / np.sqrt(2 * EbNo)
-            encoded_rx = 2 * encoded - 1 + noise_std * randn(len(encoded))
+            # bpsk modulation, additive noise and demapping to llrs
+            noise_var = get_noise_var(EbNodB, 1 / 3, bpsk)
+            y, _ = awgn.transmit(bpsk.modulate(encoded), noise_var, rng)
+            encoded_rx = bpsk.demodulate(y, noise_var)
 
             # turbo decoding
             [ys, yp1, yp2] = turboenc.extract(encoded_rx)  # extract streams
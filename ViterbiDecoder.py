@@ -4,6 +4,10 @@
 # author          : Felix Arnold
 # python_version  : 3.5.2
 
+import numpy as np
+import TrellisCache
+from DecoderStats import phase_timer, call_timer
+
 
 class ViterbiDecoder(object):
 
@@ -11,14 +15,36 @@ class ViterbiDecoder(object):
         self.state = 0
         self.trellis = trellis
         self.terminated = True
+        self.tail_biting = False  # tail-biting code (the start state is the end state), see _decode_tail_biting
+        self.n_wraps = 4  # maximum number of passes over a tail-biting block
+        self.engine = 'python'  # 'python' (reference loops) or 'numpy' (array backed)
+        # initial state metric of the states which are not the start (end) state,
+        # -np.inf makes the known start (end) state a hard constraint
+        self.minus_inf = -10
+        self.normalization_period = 0  # subtract the maximum state metric every n stages (0: no renormalization)
+        self.fixed_point = None  # FixedPoint instance for quantized decoding (None: floating point)
+        # number of trellis stages merged into one recursion step of the numpy engine (decoding on the
+        # trellis with reduction * stage_reduction, used if the number of stages is a multiple of it)
+        self.stage_reduction = 1
+        # DecoderStats instance collecting the decode time, and with the numpy engine the time and operation
+        # counts of the phases 'branch_metrics', 'acs' and 'traceback' (None: no instrumentation)
+        self.stats = None
 
     def decode(self, encoded_rx, n_data):
+        with call_timer(self.stats, n_data * (len(encoded_rx) if np.ndim(encoded_rx) == 2 else 1)):
+            # batches, quantized, reduced stage and tail-biting decoding are handled by the array engine
+            if self.engine == 'numpy' or np.ndim(encoded_rx) == 2 or self.fixed_point is not None \
+                    or self.stage_reduction > 1 or self.tail_biting:
+                return self.decode_numpy(encoded_rx, n_data)
+            return self.decode_python(encoded_rx, n_data)
+
+    def decode_python(self, encoded_rx, n_data):
 
         trellis = self.trellis
         n_stages = int(n_data / self.trellis.wu)
 
         # forward state metric calculation
-        sm_vec = [0] + [-10] * (trellis.Ns - 1)  # init state metric vector
+        sm_vec = [0] + [self.minus_inf] * (trellis.Ns - 1)  # init state metric vector
         decisions = []
         for i in range(0, n_stages):  # for each stage
             decisions_stage = []
@@ -37,6 +63,9 @@ class ViterbiDecoder(object):
                 sm_vec_new.append(sums[decision])  # select
                 decisions_stage.append(decision)
             sm_vec = list(sm_vec_new)
+            if self.normalization_period and (i + 1) % self.normalization_period == 0:  # renormalization
+                sm_max = max(sm_vec)
+                sm_vec = [sm - sm_max for sm in sm_vec]
             decisions.append(decisions_stage)
 
         # traceback
@@ -52,3 +81,272 @@ class ViterbiDecoder(object):
             state = trellis.get_prev_state_pc[branch_taken]
 
         return data_r
+
+    def decode_numpy(self, encoded_rx, n_data):
+        """
+        Array backed viterbi decoder. Produces the same output as decode_python.
+        Several code blocks can be decoded at once by passing a 2-D input of
+        shape (n_blocks, n_llrs), the recursion is then vectorized over the blocks.
+        If fixed_point is set, the llrs are quantized and the state metrics are computed
+        in integer arithmetic (see FixedPoint).
+        With stage_reduction > 1 the block is decoded on the higher radix trellis, which divides
+        the number of sequential add-compare-select steps by stage_reduction.
+        If tail_biting is set, the block is decoded as tail-biting block with the wrap-around
+        viterbi algorithm (see _decode_tail_biting).
+
+        Parameters
+        ----------
+        encoded_rx [list or array]: llrs of the coded bits
+        n_data [int]: number of data bits per block (n_data / trellis.wu stages are decoded)
+
+        Returns
+        -------
+        data_r: [list] decoded data bits ([array] of shape (n_blocks, n_data) for 2-D inputs)
+        """
+
+        trellis = self.trellis
+        n_stages = int(n_data / trellis.wu)
+        if self.stage_reduction > 1 and n_stages % self.stage_reduction == 0:
+            trellis = TrellisCache.get_reduced_trellis(trellis, self.stage_reduction)
+            n_stages = int(n_data / trellis.wu)
+        batched = np.ndim(encoded_rx) == 2
+        encoded_rx = np.atleast_2d(np.asarray(encoded_rx, dtype=float))
+        fp = self.fixed_point
+        if fp is not None:
+            encoded_rx = fp.quantize(encoded_rx)
+        n_blocks = encoded_rx.shape[0]
+
+        prev_br = trellis.prev_branches_np
+
+        # branch metrics of all stages [n_stages x n_blocks x Nb]
+        with phase_timer(self.stats, 'branch_metrics', n_stages * n_blocks * trellis.Nb):
+            llr = encoded_rx[:, :trellis.wc * n_stages].reshape(n_blocks, n_stages, trellis.wc).transpose(1, 0, 2)
+            # in the order of the acs [n_stages x n_blocks x radix x Ns]
+            gamma = trellis.get_branch_metrics(llr, data=False, branches=prev_br.T)
+
+        if self.tail_biting:
+            data_r = self._decode_tail_biting(trellis, gamma)
+        else:
+            # forward state metric calculation
+            with phase_timer(self.stats, 'acs', n_stages * n_blocks * trellis.Ns):
+                if fp is None:
+                    sm_vec = np.full((n_blocks, trellis.Ns), float(self.minus_inf))  # init state metric vector
+                else:
+                    sm_vec = np.full((n_blocks, trellis.Ns), fp.get_init_value(), dtype=fp.get_dtype())
+                sm_vec[:, 0] = 0
+                decisions, sm_vec, _ = self._forward(trellis, sm_vec, gamma)
+
+            # traceback
+            with phase_timer(self.stats, 'traceback', n_stages * n_blocks):
+                if self.terminated:
+                    state = np.zeros(n_blocks, dtype=int)  # start state when terminated trellis
+                elif fp is None:
+                    state = np.argmax(sm_vec, axis=1)
+                else:
+                    state = fp.argmax(sm_vec)
+                data_r = self._traceback(trellis, decisions, state)
+
+        data_r = data_r.reshape(n_blocks, -1)
+        if batched:
+            return data_r
+        return list(data_r[0])
+
+    def _decode_tail_biting(self, trellis, gamma):
+        """
+        Wrap-around viterbi algorithm (WAVA) for tail-biting codes: the recursion is started with equal state
+        metrics and repeated over the block with the final state metrics of the previous pass as initial ones,
+        at most n_wraps times. A block is decided as soon as its best survivor is tail-biting (it starts in the
+        state it ends in), after the last pass the best tail-biting survivor (or the best survivor, if there
+        is none) is taken. The passes are computed for the blocks that are not decided yet.
+
+        Parameters
+        ----------
+        trellis [Trellis]: trellis of the branch metrics
+        gamma [array]: branch metrics [n_stages x n_blocks x radix x Ns] (see get_branch_metrics)
+
+        Returns
+        -------
+        data_r: [array] decoded data bits of shape (n_blocks, n_stages, wu)
+        """
+        fp = self.fixed_point
+        n_stages, n_blocks = gamma.shape[0], gamma.shape[1]
+        data_r = np.empty((n_blocks, n_stages, trellis.wu), dtype=int)
+        active = np.arange(n_blocks)  # blocks that are not decided
+        sm_vec = np.zeros((n_blocks, trellis.Ns), dtype=float if fp is None else fp.get_dtype())
+        for wrap in range(self.n_wraps):
+            with phase_timer(self.stats, 'acs', n_stages * len(active) * trellis.Ns):
+                if fp is None:
+                    sm_vec -= np.max(sm_vec, axis=1, keepdims=True)
+                decisions, sm_vec, origin = self._forward(trellis, sm_vec, gamma, True)
+
+            # best survivor, or after the last pass the best tail-biting survivor
+            with phase_timer(self.stats, 'traceback', n_stages * len(active)):
+                tail_biting = origin == np.arange(trellis.Ns)
+                if wrap < self.n_wraps - 1:
+                    state = np.argmax(sm_vec, axis=1) if fp is None else fp.argmax(sm_vec)
+                    done = tail_biting[np.arange(len(active)), state]
+                else:
+                    # state metrics relative to the best one (fixed point: modular difference)
+                    sm_rel = sm_vec if fp is None else fp.subtract(sm_vec, fp.max(sm_vec)[:, None]).astype(float)
+                    state = np.where(tail_biting.any(axis=1), np.argmax(np.where(tail_biting, sm_rel, -np.inf), axis=1),
+                                     np.argmax(sm_rel, axis=1))
+                    done = np.ones(len(active), dtype=bool)
+                if done.any():
+                    data_r[active[done]] = self._traceback(trellis, decisions[:, done], state[done])
+            active = active[~done]
+            if len(active) == 0:
+                break
+            sm_vec = sm_vec[~done]
+            gamma = gamma[:, ~done]
+        return data_r
+
+    def _forward(self, trellis, sm_vec, gamma, track_origin=False):
+        """
+        add, compare, select over all stages, vectorized over the radix branches of all states.
+        Returns the decisions [n_stages x n_blocks x Ns], the final state metric vectors and,
+        with track_origin, the start state of the survivor of each state [n_blocks x Ns]
+        """
+        fp = self.fixed_point
+        prev_br_state = trellis.prev_state_np[trellis.prev_branches_np.T]  # [radix x Ns]
+        radix = prev_br_state.shape[0]
+        n_stages, n_blocks = gamma.shape[0], gamma.shape[1]
+        decisions = np.empty((n_stages, n_blocks, trellis.Ns), dtype=np.int8)
+        origin = np.tile(np.arange(trellis.Ns), (n_blocks, 1)) if track_origin else None
+        for i in range(n_stages):  # for each stage
+            if fp is None:
+                sums = np.take(sm_vec, prev_br_state, axis=1) + gamma[i]  # add
+                sm_vec = sums[:, 0].copy()
+                decisions[i] = 0
+                for k in range(1, radix):  # compare (the first maximum is taken for ties), select
+                    np.copyto(decisions[i], k, where=sums[:, k] > sm_vec)
+                    np.maximum(sm_vec, sums[:, k], out=sm_vec)
+                if self.normalization_period and (i + 1) % self.normalization_period == 0:  # renormalization
+                    sm_vec -= np.max(sm_vec, axis=1, keepdims=True)
+            else:
+                sums = np.moveaxis(fp.add(np.take(sm_vec, prev_br_state, axis=1), gamma[i]), 1, -1)  # add
+                decisions[i] = fp.argmax(sums)  # compare
+                sm_vec = fp.normalize(np.take_along_axis(sums, decisions[i][..., None], axis=2)[..., 0])  # select
+            if track_origin:
+                origin = np.take_along_axis(np.take(origin, prev_br_state, axis=1), decisions[i][:, None], axis=1)[:, 0]
+        return decisions, sm_vec, origin
+
+    @staticmethod
+    def _traceback(trellis, decisions, state):
+        """ traceback from the end states of the blocks, returns the data bits [n_blocks x n_stages x wu] """
+        prev_state = trellis.prev_state_np
+        prev_br = trellis.prev_branches_np
+        n_stages, n_blocks = decisions.shape[0], decisions.shape[1]
+        blocks = np.arange(n_blocks)
+        data_r = np.empty((n_blocks, n_stages, trellis.wu), dtype=int)
+        for i in reversed(range(n_stages)):  # loop over all stages backwards
+            decision = decisions[i][blocks, state]
+            branch_taken = prev_br[state, decision]
+            data_r[:, i] = trellis.dat_np[branch_taken]
+            state = prev_state[branch_taken]
+        return data_r
+
+
+class StreamingViterbiDecoder(object):
+    """
+    Viterbi decoder for continuous streams. The llrs are fed in chunks of arbitrary length and
+    the decoded bits are emitted with a fixed latency of traceback_depth trellis stages.
+    Only the decisions of at most 2 * traceback_depth stages are stored (packed, one bit per
+    state for radix 2, log2(radix) bits per state in general).
+    """
+
+    def __init__(self, trellis, traceback_depth=None):
+        self.trellis = trellis
+        self.terminated = True  # end state of the stream is 0 (used by flush)
+        if traceback_depth is None:
+            traceback_depth = trellis.get_convergence_length()
+        self.traceback_depth = traceback_depth
+        self.n_dec_bits = max(1, int(np.ceil(np.log2(trellis.prev_branches_np.shape[1]))))  # bits per decision
+        self.reset()
+
+    def reset(self):
+        self.sm_vec = np.full(self.trellis.Ns, -np.inf)  # init state metric vector
+        self.sm_vec[0] = 0
+        self.llr_rest = np.zeros(0)  # llrs of an incomplete stage
+        self.decisions = np.zeros((0, -(-self.trellis.Ns * self.n_dec_bits // 8)), dtype=np.uint8)
+
+    def feed(self, llrs):
+        """
+        Process a chunk of llrs and return the data bits that are decided
+
+        Parameters
+        ----------
+        llrs [list or array]: next llrs of the coded bits
+
+        Returns
+        -------
+        data_r: [array] decoded data bits (may be empty)
+        """
+        trellis = self.trellis
+        llrs = np.concatenate((self.llr_rest, np.asarray(llrs, dtype=float)))
+        n_stages = len(llrs) // trellis.wc
+        self.llr_rest = llrs[n_stages * trellis.wc:]
+
+        # process the chunk in pieces of traceback_depth stages to bound the decision memory
+        data_r = [np.zeros(0, dtype=np.uint8)]
+        for start in range(0, n_stages, self.traceback_depth):
+            stop = min(start + self.traceback_depth, n_stages)
+            self._acs(llrs[start * trellis.wc:stop * trellis.wc].reshape(-1, trellis.wc))
+            n_out = len(self.decisions) - self.traceback_depth
+            if n_out > 0:
+                data_r.append(self._traceback(int(np.argmax(self.sm_vec)), n_out))
+        return np.concatenate(data_r)
+
+    def flush(self):
+        """ Return the remaining data bits at the end of the stream and reset the decoder """
+        if self.terminated:
+            state = 0  # start state when terminated trellis
+        else:
+            state = int(np.argmax(self.sm_vec))
+        data_r = self._traceback(state, len(self.decisions))
+        self.reset()
+        return data_r
+
+    def decode_stream(self, chunks):
+        """ Generator yielding the decoded bits for each chunk of llrs, and finally the flushed bits """
+        for chunk in chunks:
+            yield self.feed(chunk)
+        yield self.flush()
+
+    def _acs(self, llr):
+        trellis = self.trellis
+        prev_br = trellis.prev_branches_np
+        prev_br_state = trellis.prev_state_np[prev_br]
+
+        # branch metrics [n_stages x Nb]
+        gamma = np.zeros((len(llr), trellis.enc_bits_np.shape[0]))
+        for l in range(trellis.wc):
+            gamma += llr[:, l:l + 1] * trellis.enc_bits_np[:, l]
+
+        sm_vec = self.sm_vec
+        decisions = np.empty((len(llr), trellis.Ns), dtype=np.uint8)
+        for i in range(len(llr)):  # for each stage
+            sums = sm_vec[prev_br_state] + gamma[i][prev_br]  # add
+            decisions[i] = np.argmax(sums, axis=1)  # compare
+            sm_vec = np.max(sums, axis=1)  # select
+        self.sm_vec = sm_vec - np.max(sm_vec)  # normalization (the metrics of a stream are unbounded)
+
+        # store the decisions packed
+        bits = np.unpackbits(decisions[:, :, None], axis=2, bitorder='little')[:, :, :self.n_dec_bits]
+        packed = np.packbits(bits.reshape(len(llr), -1), axis=1)
+        self.decisions = np.concatenate((self.decisions, packed))
+
+    def _traceback(self, state, n_out):
+        """ traceback over all stored stages from state and return the data of the oldest n_out stages """
+        trellis = self.trellis
+        n_stages = len(self.decisions)
+        bits = np.unpackbits(self.decisions, axis=1, count=trellis.Ns * self.n_dec_bits)
+        decisions = bits.reshape(n_stages, trellis.Ns, self.n_dec_bits) @ (2 ** np.arange(self.n_dec_bits))
+
+        data_r = np.empty((n_stages, trellis.wu), dtype=np.uint8)
+        for i in reversed(range(n_stages)):  # loop over all stages backwards
+            branch_taken = trellis.prev_branches_np[state, decisions[i, state]]
+            data_r[i] = trellis.dat_np[branch_taken]
+            state = trellis.prev_state_np[branch_taken]
+
+        self.decisions = self.decisions[n_out:]
+        return data_r[:n_out].reshape(-1)
@@ -5,7 +5,7 @@
 # python_version  : 3.5.2
 
 import numpy as np
-from numpy.random import rand, randn
+from numpy.random import rand
 from scipy.stats import norm
 from ConvTrellisDef import ConvTrellisDef
 from Trellis import Trellis
@@ -13,6 +13,7 @@ from ConvEncoder import ConvEncoder
 from ViterbiDecoder import ViterbiDecoder
 import matplotlib.pyplot as plt
 from SisoDecoder import SisoDecoder
+from Channel import Modulation, Channel, get_noise_var
 
 
 def main(n_data=5000, verbose=True, do_plot=True):
@@ -32,6 +33,9 @@ def main(n_data=5000, verbose=True, do_plot=True):
     trellis = Trellis(ConvTrellisDef(gen_poly, gen_feedback))
     convenc = ConvEncoder(trellis)
     viterbi = ViterbiDecoder(trellis)
+    bpsk = Modulation('bpsk')
+    awgn = Channel('awgn')
+    rng = np.random.default_rng()
 
     # loop over all SNRs
     ber_vec = []
@@ -47,10 +51,10 @@ def main(n_data=5000, verbose=True, do_plot=True):
         # convolutional encoding, incl zero termination
         encoded = convenc.encode(data_u)
 
-        # additive noise
-        EbNo = 10.0 ** (EbNodB_range[n] / 10.0)
-        noise_std = np.sqrt(trellis.get_rate()) / np.sqrt(2 * EbNo)
-        encoded_rx = 2 * np.array(encoded) - 1 + noise_std * randn(len(encoded))
+        # bpsk modulation, additive noise and demapping to llrs
+        noise_var = get_noise_var(EbNodB_range[n], 1 / trellis.get_rate(), bpsk)
+        y, _ = awgn.transmit(bpsk.modulate(encoded), noise_var, rng)
+        encoded_rx = bpsk.demodulate(y, noise_var)
 
         # viterbi decoding
         if use_viterbi:
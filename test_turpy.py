@@ -2,12 +2,36 @@ from ConvTrellisDef import ConvTrellisDef
 from Trellis import Trellis
 from ConvEncoder import ConvEncoder
 from ViterbiDecoder import ViterbiDecoder
+from ViterbiDecoder import StreamingViterbiDecoder
 from ConvEncoder import TurboEncoder
 from SisoDecoder import SisoDecoder
 from Interleaver import Interleaver
+from Interleaver import get_interleaver, lte_qpp_params
 from TurboDecoder import TurboDecoder
+from FixedPoint import FixedPoint
+import MaxStar
+import TrellisCache
+import Simulation
+from RateMatching import Puncturer, CircularBufferRateMatcher
+from Channel import Modulation, Channel, get_noise_var
+import Benchmark
+from DecoderStats import DecoderStats, aggregate
 
 import numpy as np
+import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+@pytest.fixture
+def trellis_cache_dir(tmp_path, monkeypatch):
+    # on-disk trellis cache in a temporary directory, the in-process cache is cleared before and after the test
+    # (the environment variable is set for simulation worker processes which import TrellisCache anew)
+    monkeypatch.setattr(TrellisCache, 'cache_dir', str(tmp_path))
+    monkeypatch.setenv('TURPY_CACHE_DIR', str(tmp_path))
+    TrellisCache.clear_cache()
+    yield tmp_path
+    TrellisCache.clear_cache()
 
 
 def test_scripts():
@@ -371,3 +395,1012 @@ def test_trellis():
 
     d = ct.get_dat_pc[7]
     assert [0] == d
+
+
+def test_siso_numpy():
+    # the array backed engine must produce the same output as the reference engine
+    np.random.seed(1)
+    g = [[1, 1, 0, 1]]
+    fb = [0, 0, 1, 1]
+    n_data = 24
+
+    for reduction in [1, 2, 3]:
+        trellis = Trellis(ConvTrellisDef(g, fb), reduction)
+        input_u = list(np.random.randn(n_data))
+        input_c = list(np.random.randn(n_data * trellis.tdef.wc))
+        for backward_init in [True, False]:
+            convsiso = SisoDecoder(trellis)
+            convsiso.backward_init = backward_init
+            ref_u, ref_c = convsiso.decode(input_u, input_c, n_data)
+            convsiso.engine = 'numpy'
+            out_u, out_c = convsiso.decode(input_u, input_c, n_data)
+            assert ref_u == out_u
+            assert ref_c == out_c
+
+    # reference values (same as in test_siso)
+    g = [[1, 0, 0], [1, 1, 1]]
+    d = [1, 0, 1, 0, 0, 1]
+    trellis = Trellis(ConvTrellisDef(g))
+    e = ConvEncoder(trellis).encode(d, True)
+    e[1] = int(not (e[1]))
+    e[-1] = int(not (e[-1]))
+    convsiso = SisoDecoder(trellis)
+    convsiso.engine = 'numpy'
+    n_stages = len(d) + trellis.tdef.K - 1
+    data_r, c = convsiso.decode([0] * n_stages, e, n_stages)
+    minf = convsiso.minus_inf
+    assert [2, -2, 2, -2, -2, 2, -1 + minf, minf] == data_r
+    assert [2, 2, -2, 2, 2, -2, -2, 2, -2, 2, 2, 2, -1 + minf, 2, minf, 2] == c
+
+
+def test_batch_decoding():
+    # decoding a batch of blocks must give the same result as decoding block by block
+    np.random.seed(2)
+    n_blocks = 4
+
+    # viterbi
+    g = [[1, 0, 0], [1, 1, 1]]
+    trellis = Trellis(ConvTrellisDef(g))
+    viterbi = ViterbiDecoder(trellis)
+    n_stages = 12
+    e = np.random.randn(n_blocks, n_stages * trellis.wc)
+    data_r = viterbi.decode(e, n_stages)
+    assert (n_blocks, n_stages) == data_r.shape
+    for k in range(n_blocks):
+        assert viterbi.decode(list(e[k]), n_stages) == list(data_r[k])
+
+    # siso
+    convsiso = SisoDecoder(trellis)
+    u = np.random.randn(n_blocks, n_stages)
+    out_u, out_c = convsiso.decode(u, e, n_stages)
+    assert (n_blocks, n_stages) == out_u.shape
+    assert e.shape == out_c.shape
+    for k in range(n_blocks):
+        ref_u, ref_c = convsiso.decode(list(u[k]), list(e[k]), n_stages)
+        assert ref_u == list(out_u[k])
+        assert ref_c == list(out_c[k])
+
+    # turbo
+    n_data = 16
+    trellis_identity = Trellis(ConvTrellisDef([[1]]))
+    trellis_p = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    il = Interleaver()
+    il.gen_qpp_perm(n_data)
+    turboenc = TurboEncoder([trellis_identity, trellis_p, trellis_p], il)
+    csiso = SisoDecoder(trellis_p)
+    csiso.backward_init = False
+    td = TurboDecoder(il, csiso, csiso)
+
+    d = (np.random.rand(n_blocks, n_data) >= 0.5).astype(int)
+    rx = []
+    for k in range(n_blocks):
+        encoded = np.array(turboenc.flatten(turboenc.encode(list(d[k]))))
+        rx.append(2 * encoded - 1 + 0.8 * np.random.randn(len(encoded)))
+    [ys, yp1, yp2] = turboenc.extract(np.array(rx))
+    drx, errors = td.decode(ys, yp1, yp2)
+    assert d.shape == drx.shape
+    for k in range(n_blocks):
+        [ys, yp1, yp2] = turboenc.extract(rx[k])
+        assert td.decode(ys, yp1, yp2)[0] == list(drx[k])
+
+
+def test_trellis_tables():
+    g = [[1, 0, 0], [1, 1, 1]]
+    fb = [0, 0, 1]
+    for reduction in [1, 2]:
+        ct = Trellis(ConvTrellisDef(g, fb), reduction)
+
+        assert (ct.Nb, ct.wc) == ct.enc_bits_np.shape
+        assert (ct.Nb, ct.wu) == ct.dat_np.shape
+        assert (ct.Ns, ct.radix) == ct.next_branches_np.shape
+        assert (ct.Ns, ct.radix) == ct.prev_branches_np.shape
+        assert np.int8 == ct.enc_bits_np.dtype
+        assert np.int32 == ct.prev_state_np.dtype
+
+        # the tables contain the same information as the lists
+        for b in range(ct.Nb):
+            assert list(ct.enc_bits_np[b]) == list(ct.get_enc_bits_pc[b])
+            assert list(ct.dat_np[b]) == list(ct.get_dat_pc[b])
+            assert ct.next_state_np[b] == ct.get_next_state_pc[b]
+            assert ct.prev_state_np[b] == ct.get_prev_state_pc[b]
+        for s in range(ct.Ns):
+            assert list(ct.next_branches_np[s]) == list(ct.get_next_branches_pc[s])
+            assert list(ct.prev_branches_np[s]) == list(ct.get_prev_branches_pc[s])
+
+        # correlation metric of the branches
+        llr = np.random.randn(ct.wc + ct.wu)
+        metric = ct.get_branch_metrics(llr)
+        b = 3
+        bits = list(ct.get_enc_bits_pc[b]) + list(ct.get_dat_pc[b])
+        assert np.isclose(sum([x * y for x, y in zip(bits, llr)]), metric[b])
+
+
+def test_trellis_construction():
+    # K=9 code, radix 16
+    g = [[1, 0, 1, 1, 1, 0, 0, 0, 1], [1, 1, 1, 1, 0, 1, 0, 1, 1]]
+    t0 = time.time()
+    trellis = Trellis(ConvTrellisDef(g), 4)
+    assert time.time() - t0 < 1
+    assert (trellis.Ns, trellis.radix) == trellis.next_branches_np.shape
+
+    # radix 16 encoding is identical to radix 2 encoding
+    d = list((np.random.rand(32) >= 0.5).astype(int))
+    e = ConvEncoder(Trellis(ConvTrellisDef(g))).encode(d, False)
+    assert e == ConvEncoder(trellis).encode(d, False)
+
+    # merge parallel branches: only one branch between each pair of states remains
+    trellis = Trellis(ConvTrellisDef([[1, 0, 1]], [0, 1, 1]), 4, True)
+    assert trellis.Ns * trellis.Ns == trellis.Nb
+    pairs = set(zip(trellis.get_prev_state_pc, trellis.get_next_state_pc))
+    assert trellis.Nb == len(pairs)
+    for s in range(trellis.Ns):
+        for b in trellis.get_prev_branches_pc[s]:
+            assert s == trellis.get_next_state_pc[b]
+        for b in trellis.get_next_branches_pc[s]:
+            assert b == -1 or s == trellis.get_prev_state_pc[b]
+
+    # the missing branches (-1) are not taken silently
+    assert (trellis.next_branches_np == -1).any()
+    convsiso = SisoDecoder(trellis)
+    convsiso.engine = 'numpy'
+    with pytest.raises(ValueError):
+        convsiso.decode(np.zeros(8), np.zeros(8), 8)
+    convenc = ConvEncoder(trellis)
+    with pytest.raises(ValueError):
+        convenc.step(int(np.nonzero(trellis.next_branches_np[0] == -1)[0][0]))
+
+
+def test_trellis_cache(trellis_cache_dir):
+    tmp_path = trellis_cache_dir
+    g = [[1, 0, 1, 1], [1, 1, 1, 1]]
+    fb = [0, 0, 1, 1]
+
+    # first call computes the trellis and stores it on disk, second call hits the in-process cache
+    trellis = TrellisCache.get_trellis(g, fb, 2)
+    assert trellis is TrellisCache.get_trellis(g, fb, 2)
+    assert 1 == len(list(tmp_path.iterdir()))
+
+    # load from disk (memory mapped)
+    TrellisCache.clear_cache()
+    trellis_disk = TrellisCache.get_trellis(g, fb, 2)
+    assert trellis_disk is not trellis
+    assert isinstance(trellis_disk.enc_bits_np, np.memmap)
+    assert trellis_disk._pc['prev_branches'] is None  # the lists are only built on access
+    reference = Trellis(ConvTrellisDef(g, fb), 2)
+    for name, table in reference.get_tables().items():
+        assert (table == trellis_disk.get_tables()[name]).all()
+    assert reference.get_prev_branches_pc == trellis_disk.get_prev_branches_pc
+    assert reference.Nb == trellis_disk.Nb
+
+    # the cached trellis can be used for encoding and decoding
+    d = [1, 0, 1, 1, 0, 0]
+    assert ConvEncoder(reference).encode(d) == ConvEncoder(trellis_disk).encode(d)
+
+    TrellisCache.clear_cache(disk=True)
+    assert 0 == len(list(tmp_path.iterdir()))
+
+
+def test_conv_enc_array():
+    np.random.seed(3)
+    codes = [([[1, 0, 0], [1, 1, 1]], [], 1),  # feed forward
+             ([[1, 0, 0], [1, 1, 1]], [0, 0, 1], 2),  # recursive, radix 4
+             ([[1, 1, 0, 1]], [0, 0, 1, 1], 1),  # turbo code constituent encoder
+             ([[1, 0, 1, 1, 0, 1, 1], [1, 1, 1, 1, 0, 0, 1]], [0, 1, 0, 0, 1, 1, 1], 1)]  # K=7 recursive
+    for g, fb, reduction in codes:
+        convenc = ConvEncoder(Trellis(ConvTrellisDef(g, fb), reduction))
+        d = (np.random.rand(4, 30) >= 0.5).astype(np.uint8)
+        for zero_termination in [True, False]:
+            e = convenc.encode(d, zero_termination)  # batch
+            for k in range(len(d)):
+                e_ref = convenc.encode(list(d[k]), zero_termination)
+                assert e_ref == list(e[k])
+                assert e_ref == list(convenc.encode(d[k], zero_termination))
+
+    # reference values of test_conv_enc
+    convenc = ConvEncoder(Trellis(ConvTrellisDef([[1, 0, 0], [1, 1, 1]], [0, 0, 1])))
+    e = convenc.encode(np.array([1, 0, 1, 1, 0, 0]), False)
+    assert np.uint8 == e.dtype
+    assert [1, 1, 0, 1, 0, 1, 1, 1, 0, 1, 1, 0] == list(e)
+
+    # random feedback polynomials, incl. a feedback without taps (impulse response 1)
+    feedbacks = [[0, 0, 0, 0]] + [[0] + list(np.random.randint(0, 2, 3)) for i in range(8)]
+    for fb in feedbacks:
+        convenc = ConvEncoder(Trellis(ConvTrellisDef([[1, 0, 1, 1], [1, 1, 0, 1]], fb)))
+        d = (np.random.rand(3, 25) >= 0.5).astype(np.uint8)
+        e = convenc.encode_array(d, False)
+        for k in range(len(d)):
+            assert convenc.encode(list(d[k]), False) == list(e[k])
+
+
+def test_streaming_viterbi():
+    np.random.seed(4)
+    g = [[1, 0, 1], [1, 1, 1]]
+    for reduction in [1, 2]:
+        trellis = Trellis(ConvTrellisDef(g), reduction)
+        convenc = ConvEncoder(trellis)
+        d = (np.random.rand(500) >= 0.5).astype(np.uint8)
+        e = convenc.encode(d)
+        e_rx = 2.0 * e - 1 + 0.7 * np.random.randn(len(e))
+        n_stages = len(d) + trellis.tdef.K - 1
+        data_ref = ViterbiDecoder(trellis).decode(e_rx, n_stages)
+
+        # feed the stream in chunks of different lengths (not aligned to stages)
+        viterbi = StreamingViterbiDecoder(trellis, 16)
+        chunks = np.split(e_rx, [3, 4, 50, 51, 400, 700])
+        out = list(viterbi.decode_stream(chunks))
+        assert list(np.concatenate(out)) == data_ref
+
+        # bounded latency: all bits except the last traceback_depth stages are emitted
+        viterbi.reset()
+        n_out = len(viterbi.feed(e_rx[:200 * trellis.wc]))
+        assert n_out == 200 * trellis.wu - 16 * trellis.wu
+        assert len(viterbi.decisions) == 16
+
+
+def test_siso_windowed():
+    np.random.seed(5)
+    g = [[1, 0, 1], [1, 1, 1]]
+    trellis = Trellis(ConvTrellisDef(g))
+    d = (np.random.rand(3, 300) >= 0.5).astype(np.uint8)
+    e = ConvEncoder(trellis).encode(d)
+    e_rx = 2.0 * e - 1 + 0.8 * np.random.randn(*e.shape)
+    n_stages = d.shape[1] + trellis.tdef.K - 1
+    u = np.zeros((3, n_stages))
+
+    convsiso = SisoDecoder(trellis)
+    ref_u, ref_c = convsiso.decode(u, e_rx, n_stages)
+
+    # a single window covering the whole block is identical to the full block decoding
+    convsiso.window_size = n_stages
+    out_u, out_c = convsiso.decode(u, e_rx, n_stages)
+    assert (ref_u == out_u).all()
+    assert (ref_c == out_c).all()
+
+    # small windows with training: same soft output up to the normalization of the beta metrics
+    convsiso.window_size = 32
+    convsiso.training_length = 64
+    out_u, out_c = convsiso.decode(u, e_rx, n_stages)
+    assert np.allclose(ref_u, out_u)
+    assert np.allclose(ref_c, out_c)
+
+    # 1-D input
+    out_u, out_c = convsiso.decode(list(u[0]), list(e_rx[0]), n_stages)
+    assert np.allclose(ref_u[0], out_u)
+
+
+def test_siso_subblocks():
+    np.random.seed(6)
+    g = [[1, 0, 1], [1, 1, 1]]
+    trellis = Trellis(ConvTrellisDef(g))
+    d = (np.random.rand(2, 300) >= 0.5).astype(np.uint8)
+    e = ConvEncoder(trellis).encode(d)
+    e_rx = 2.0 * e - 1 + 0.8 * np.random.randn(*e.shape)
+    n_stages = d.shape[1] + trellis.tdef.K - 1
+    u = np.zeros((2, n_stages))
+
+    convsiso = SisoDecoder(trellis)
+    ref_u, ref_c = convsiso.decode(u, e_rx, n_stages)
+
+    # sub-blocks with acquisition: same soft output up to the normalization of the state metrics
+    convsiso.n_subblocks = 7
+    convsiso.acquisition_length = 64
+    out_u, out_c = convsiso.decode(u, e_rx, n_stages)
+    assert np.allclose(ref_u, out_u)
+    assert np.allclose(ref_c, out_c)
+
+    # decoding on an executor gives the same result
+    with ThreadPoolExecutor(2) as executor:
+        convsiso.executor = executor
+        out_u2, out_c2 = convsiso.decode(u, e_rx, n_stages)
+    assert (out_u == out_u2).all()
+    assert (out_c == out_c2).all()
+
+    # sub-block decoding in the turbo decoder
+    n_data = 64
+    trellis_p = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    il = Interleaver()
+    il.gen_qpp_perm(n_data)
+    turboenc = TurboEncoder([Trellis(ConvTrellisDef([[1]])), trellis_p, trellis_p], il)
+    csiso = SisoDecoder(trellis_p)
+    csiso.backward_init = False
+    csiso.n_subblocks = 4
+    td = TurboDecoder(il, csiso, csiso)
+    d = list((np.random.rand(n_data) >= 0.5).astype(int))
+    encoded = np.array(turboenc.flatten(turboenc.encode(d)))
+    [ys, yp1, yp2] = turboenc.extract(2 * encoded - 1 + 0.5 * np.random.randn(len(encoded)))
+    drx, errors = td.decode(ys, yp1, yp2, d)
+    assert d == drx
+
+
+def test_simulation(trellis_cache_dir):
+    # results are reproducible and independent of the number of workers
+    link = Simulation.ConvLink(100)
+    ebn0_range = [0, 2, 4]
+    results = Simulation.run(link, ebn0_range, max_errors=20, max_blocks=30, blocks_per_unit=4, n_workers=1)
+    results_mp = Simulation.run(link, ebn0_range, max_errors=20, max_blocks=30, blocks_per_unit=4, n_workers=2)
+    for r, r_mp in zip(results, results_mp):
+        assert (r.ebn0_db, r.n_blocks, r.n_bits) == (r_mp.ebn0_db, r_mp.n_blocks, r_mp.n_bits)
+        assert (r.errors == r_mp.errors).all()
+
+    # stopping rules
+    for r in results:
+        assert r.errors[-1] >= 20 or r.n_blocks == 30
+        assert r.n_bits == 100 * r.n_blocks
+    assert results[0].n_blocks < 30  # many errors at low EbN0
+
+    # turbo link, errors per iteration
+    results = Simulation.run(Simulation.TurboLink(64), [1], max_blocks=4, blocks_per_unit=2, n_workers=1)
+    results_log_map = Simulation.run(Simulation.TurboLink(64, max_star='log_map'), [1], max_blocks=4,
+                                     blocks_per_unit=2, n_workers=1)
+    assert 4 == results_log_map[0].n_blocks
+    assert 6 == len(results[0].errors)
+    assert 4 == results[0].n_blocks
+    assert 6 == len(results[0].get_ber())
+
+
+def test_turbo_stopping_rules():
+    np.random.seed(7)
+    n_data = 64
+    trellis_p = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    il = Interleaver()
+    il.gen_qpp_perm(n_data)
+    turboenc = TurboEncoder([Trellis(ConvTrellisDef([[1]])), trellis_p, trellis_p], il)
+    csiso = SisoDecoder(trellis_p)
+    csiso.backward_init = False
+    td = TurboDecoder(il, csiso, csiso)
+    td.iterations = 10
+
+    d = (np.random.rand(8, n_data) >= 0.5).astype(np.uint8)
+    encoded = turboenc.flatten(turboenc.encode(d))
+    [ys, yp1, yp2] = turboenc.extract(2.0 * encoded - 1 + 0.5 * np.random.randn(*encoded.shape))
+
+    td.crc_check = lambda bits: any((bits == x).all() for x in d)  # ideal crc
+    td.llr_threshold = 5
+    for rule in ['hda', 'scr', 'min_llr', 'ce', 'crc']:
+        td.stopping_rule = rule
+        drx, _ = td.decode(ys, yp1, yp2)
+        assert (d == drx).all()
+        assert (8,) == td.iterations_used.shape
+        assert (td.iterations_used < td.iterations).all()
+
+    # 1-D input
+    td.stopping_rule = 'hda'
+    drx, _ = td.decode(ys[0], yp1[0], yp2[0])
+    assert list(d[0]) == drx
+    assert 2 <= td.iterations_used < td.iterations
+
+    # no stopping rule
+    td.stopping_rule = None
+    td.decode(ys[0], yp1[0], yp2[0])
+    assert td.iterations == td.iterations_used
+
+
+def test_turbo_buffers():
+    np.random.seed(8)
+    n_data = 32
+    trellis_p = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    il = Interleaver()
+    il.gen_qpp_perm(n_data)
+    turboenc = TurboEncoder([Trellis(ConvTrellisDef([[1]])), trellis_p, trellis_p], il)
+    csiso = SisoDecoder(trellis_p)
+    csiso.backward_init = False
+    td = TurboDecoder(il, csiso, csiso)
+
+    d = (np.random.rand(4, n_data) >= 0.5).astype(np.uint8)
+    encoded = turboenc.flatten(turboenc.encode(d))
+    [ys, yp1, yp2] = turboenc.extract(2.0 * encoded - 1 + 0.6 * np.random.randn(*encoded.shape))
+
+    # the buffers are reused for blocks of the same size and do not carry state between calls
+    drx, _ = td.decode(ys, yp1, yp2)
+    buffers = td._buffers
+    td.stopping_rule = 'hda'
+    td.decode(ys[::-1], yp1[::-1], yp2[::-1])
+    td.stopping_rule = None
+    drx2, _ = td.decode(ys, yp1, yp2)
+    assert buffers is td._buffers
+    assert (drx == drx2).all()
+    assert (d == drx).all()
+
+
+def test_interleaver_array():
+    N = 40
+    il = Interleaver()
+    il.gen_qpp_perm_poly(N, 3, 10)
+    assert np.int32 == il.perm.dtype
+    assert [(3 * x + 10 * x ** 2) % N for x in range(N)] == list(il.perm)
+
+    # 1-D and batched numpy arrays
+    d = np.random.randn(3, N)
+    di = il.interleave(d)
+    assert (d[1][il.perm] == di[1]).all()
+    assert (d == il.deinterleave(di)).all()
+
+    # into a preallocated buffer
+    out = np.zeros(N)
+    il.interleave(d[0], out=out)
+    assert (di[0] == out).all()
+
+    # reverse permutation
+    il.gen_rev_perm(N)
+    assert list(range(N))[::-1] == il.interleave(list(range(N)))
+
+    # QPP for large N: no overflow of the intermediate results
+    N = 2 ** 22
+    k1 = 2 ** 21 + 1
+    k2 = 2 ** 21 + 2
+    il.gen_qpp_perm_poly(N, k1, k2)
+    x = N - 3
+    assert (k1 * x + k2 * x ** 2) % N == il.perm[x]
+    assert (il.perm[il.perm_inv] == np.arange(N)).all()
+
+
+def test_interleaver_library():
+    il = Interleaver()
+
+    # LTE: all block sizes of the table are valid QPP interleavers
+    assert 188 == len(lte_qpp_params)
+    for K in lte_qpp_params:
+        il.gen_lte_perm(K)
+        assert (np.sort(il.perm) == np.arange(K)).all()
+    assert [0, 743, 2446, 5109, 2588, 1027, 426, 785] == list(il.perm[:8])  # K = 6144
+    with pytest.raises(ValueError):
+        il.gen_lte_perm(41)
+
+    # UMTS: valid permutations for all cases of R and C
+    for K in [40, 159, 160, 200, 481, 530, 531, 2281, 3210, 5114]:
+        il.gen_umts_perm(K)
+        assert (np.sort(il.perm) == np.arange(K)).all()
+
+    # S-random: spreading property
+    rng = np.random.default_rng(3)
+    il.gen_srandom_perm(512, 12, rng)
+    p = il.perm.astype(int)
+    assert (np.sort(p) == np.arange(512)).all()
+    for d in range(1, 13):
+        assert (np.abs(p[d:] - p[:-d]) > 12).all()
+
+    # DRP without dithering is the relative prime interleaver
+    il.gen_drp_perm(64, 13, 5)
+    assert [(5 + 13 * i) % 64 for i in range(64)] == list(il.perm)
+    il.gen_drp_perm(64, 13, 5, [1, 0, 3, 2], [3, 1, 0, 2])
+    assert (np.sort(il.perm) == np.arange(64)).all()
+
+    # cache per (type, N)
+    assert get_interleaver('lte', 1024) is get_interleaver('lte', 1024)
+    assert get_interleaver('lte', 1024) is not get_interleaver('lte', 1056)
+    il_s = get_interleaver('srandom', 256, s=8, seed=1)
+    assert il_s is get_interleaver('srandom', 256, seed=1, s=8)
+    assert il_s is not get_interleaver('srandom', 256, s=8, seed=2)
+
+
+def test_contention_free():
+    il = Interleaver()
+
+    # QPP interleavers are contention-free for all divisors of N
+    il.gen_lte_perm(1024)
+    assert [2 ** i for i in range(11)] == il.get_contention_free_degrees()
+    banks = il.get_bank_mapping(8)
+    assert (128, 8) == banks.shape
+    assert (il.perm[[t * 128 + 5 for t in range(8)]] // 128 == banks[5]).all()
+    assert not il.is_contention_free(3)
+
+    # a random interleaver is (almost surely) not
+    il.gen_rand_perm(1024, np.random.default_rng(0))
+    assert not il.is_contention_free(8)
+
+    # generator for block sizes which are not in the LTE table
+    for N, P in [(60, 4), (330, 11), (1000, 8)]:
+        il.gen_contention_free_perm(N, P, np.random.default_rng(1))
+        assert (np.sort(il.perm) == np.arange(N)).all()
+        assert il.is_contention_free(P)
+    with pytest.raises(ValueError):
+        il.gen_contention_free_perm(1000, 3)
+
+
+def test_fixed_point():
+    np.random.seed(5)
+    n_blocks = 8
+    n_data = 200
+    trellis = Trellis(ConvTrellisDef([[1, 0, 1, 1], [1, 1, 1, 1]]))
+    n_stages = n_data + trellis.tdef.K - 1
+    d = np.random.randint(0, 2, (n_blocks, n_data))
+    encoded = ConvEncoder(trellis).encode(d)
+    rx = 4 * (2.0 * encoded - 1) + 2 * np.random.randn(*encoded.shape)
+
+    fp = FixedPoint(llr_bits=6, llr_frac_bits=1)
+    assert [31, -31, 2, -2, 0] == list(fp.quantize([20, -100, 1.1, -0.9, 0.1]))
+    assert np.int16 == fp.quantize([1.0]).dtype
+
+    # the in-place add, compare, select is bit exact to the separate operations (incl. wrap around
+    # and saturation at the bounds)
+    for config in [(6, 1, 16, 'modulo'), (6, 1, 10, 'modulo'), (6, 1, 16, 'subtract_max'), (6, 1, 9, 'subtract_max')]:
+        fpc = FixedPoint(*config)
+        bound = 2 ** (fpc.sm_bits - 1)
+        for radix in [2, 4]:
+            sm = np.random.randint(-bound, bound, (3, radix, 8)).astype(fpc.get_dtype())
+            gamma = np.random.randint(-62, 63, (3, radix, 8)).astype(fpc.get_dtype())
+            ref = fpc.normalize(fpc.max(np.moveaxis(fpc.add(sm, gamma), 1, -1)))
+            assert (ref == fpc.acs(sm, gamma)).all()
+
+    # integer llrs are quantized exactly: same soft output as the floating point decoder
+    # (without the state initialization, which is -10 in floating point)
+    llr_c = np.clip(np.round(rx), -31, 31)
+    llr_u = np.zeros((n_blocks, n_stages))
+    convsiso = SisoDecoder(trellis)
+    convsiso.forward_init = False
+    convsiso.backward_init = False
+    ref_u, ref_c = convsiso.decode(llr_u, llr_c, n_stages)
+    for config in [(6, 0, 16, 'modulo'), (6, 0, 10, 'modulo'), (6, 0, 16, 'subtract_max')]:
+        convsiso.fixed_point = FixedPoint(*config)
+        out_u, out_c = convsiso.decode(llr_u, llr_c, n_stages)
+        assert (ref_u == out_u).all()
+        assert (ref_c == out_c).all()
+
+    # a coded bit which is 0 on all branches has a negative soft output
+    convsiso = SisoDecoder(Trellis(ConvTrellisDef([[0, 0, 0], [1, 1, 1]])))
+    convsiso.fixed_point = FixedPoint()
+    _, out_c = convsiso.decode(np.zeros(10), np.ones(20), 10)
+    assert (np.array(out_c[0::2]) < 0).all()
+    convsiso.fixed_point = None
+    _, out_c = convsiso.decode(np.zeros(10), np.ones(20), 10)
+    assert (np.array(out_c[0::2]) == convsiso.minus_inf).all()
+
+    # narrow state metrics: modulo normalization wraps around, subtract-max keeps the metrics bounded,
+    # both decode the same way as with wide state metrics
+    viterbi = ViterbiDecoder(trellis)
+    viterbi.fixed_point = FixedPoint(6, 1, 16, 'modulo')
+    ref = viterbi.decode(rx, n_stages)
+    assert (ref[:, :n_data] != d).sum() < 10
+    for config in [(6, 1, 9, 'modulo'), (6, 1, 9, 'subtract_max'), (6, 1, 32, 'modulo')]:
+        viterbi.fixed_point = FixedPoint(*config)
+        assert (ref == viterbi.decode(rx, n_stages)).all()
+
+    convsiso = SisoDecoder(trellis)
+    convsiso.fixed_point = FixedPoint(6, 1, 16, 'modulo')
+    ref_u, _ = convsiso.decode(np.zeros((n_blocks, n_stages)), rx, n_stages)
+    assert (d != (ref_u[:, :n_data] > 0)).sum() < 10
+    for config in [(6, 1, 10, 'modulo'), (6, 1, 10, 'subtract_max')]:
+        convsiso.fixed_point = FixedPoint(*config)
+        out_u, _ = convsiso.decode(np.zeros((n_blocks, n_stages)), rx, n_stages)
+        assert (ref_u[:, :n_data] == out_u[:, :n_data]).all()
+
+    # the windowed decoder works on the same integer state metrics
+    convsiso.window_size = 32
+    convsiso.training_length = 32
+    out_u, _ = convsiso.decode(np.zeros((n_blocks, n_stages)), rx, n_stages)
+    assert ((out_u[:, :n_data] > 0) == (ref_u[:, :n_data] > 0)).mean() > 0.99
+
+
+def test_state_metric_normalization():
+    np.random.seed(3)
+    n_data = 60
+    for reduction in [1, 2]:
+        trellis = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]), reduction)
+        input_u = list(3 * np.random.randn(n_data))
+        input_c = list(3 * np.random.randn(n_data * trellis.tdef.wc))
+        convsiso = SisoDecoder(trellis)
+        ref_u, ref_c = convsiso.decode(input_u, input_c, n_data)
+        for period in [1, 4]:
+            # the soft outputs do not depend on the normalization, the engines give the same output
+            convsiso.normalization_period = period
+            convsiso.engine = 'python'
+            out_u, out_c = convsiso.decode(input_u, input_c, n_data)
+            assert np.allclose(ref_u, out_u)
+            assert np.allclose(ref_c, out_c)
+            convsiso.engine = 'numpy'
+            assert (out_u, out_c) == convsiso.decode(input_u, input_c, n_data)
+
+    # the metrics of long blocks stay bounded
+    gamma = convsiso._gamma(*convsiso._stage_inputs(1e3 * np.random.randn(20000), 1e3 * np.random.randn(20000), 20000))
+    alpha = convsiso._forward(convsiso._init_sm(1, True), gamma)
+    assert (alpha[4::4].max(axis=2) == 0).all()
+
+    # high snr (large llrs): the soft outputs are not bounded by the default minus_inf
+    trellis = Trellis(ConvTrellisDef([[1, 0, 1], [1, 1, 1]]))
+    n_stages = 1000 + trellis.tdef.K - 1
+    encoded = ConvEncoder(trellis).encode(np.random.randint(0, 2, 1000))
+    rx = 8 * (2.0 * encoded - 1 + 0.5 * np.random.randn(len(encoded)))
+    convsiso = SisoDecoder(trellis)
+    convsiso.engine = 'numpy'
+    ref_u, ref_c = convsiso.decode(np.zeros(n_stages), rx, n_stages)
+    assert np.median(np.abs(ref_u)) > 20
+    convsiso.normalization_period = 1
+    for engine in ['python', 'numpy']:
+        convsiso.engine = engine
+        out_u, out_c = convsiso.decode(np.zeros(n_stages), rx, n_stages)
+        assert np.allclose(ref_u, out_u)
+        assert np.allclose(ref_c, out_c)
+
+    # -inf as initial state metric (opt-in): the zero termination is a hard constraint (data of test_siso)
+    trellis = Trellis(ConvTrellisDef([[1, 0, 0], [1, 1, 1]]))
+    e = [1, 0, 0, 1, 1, 0, 0, 1, 0, 1, 1, 1, 0, 1, 0, 0]
+    convsiso = SisoDecoder(trellis)
+    convsiso.minus_inf = -np.inf
+    for engine in ['python', 'numpy']:
+        convsiso.engine = engine
+        data_r, c = convsiso.decode([0] * 8, e, 8)
+        assert [2, -2, 2, -2, -2, 2, -np.inf, -np.inf] == list(data_r)
+        assert [2, 2, -2, 2, 2, -2, -2, 2, -2, 2, 2, 2, -np.inf, 2, -np.inf, 2] == list(c)
+
+    # viterbi
+    viterbi = ViterbiDecoder(Trellis(ConvTrellisDef([[1, 0, 1], [1, 1, 1]])))
+    assert -10 == viterbi.minus_inf
+    encoded_rx = list(np.random.randn(200))
+    ref = viterbi.decode(encoded_rx, 100)
+    viterbi.normalization_period = 3
+    assert ref == viterbi.decode(encoded_rx, 100)
+    viterbi.engine = 'numpy'
+    assert ref == viterbi.decode(encoded_rx, 100)
+
+
+def test_max_star():
+    np.random.seed(7)
+    x = 3 * np.random.randn(5, 4)
+    exact = np.log(np.exp(x).sum(axis=1))
+    assert np.allclose(exact, MaxStar.log_map(x))
+    assert (x.max(axis=1) == MaxStar.max_log(x)).all()
+    assert np.abs(MaxStar.constant_log_map(x) - exact).max() < 1
+    assert np.abs(MaxStar.lut_log_map(x) - exact).max() < 0.5
+    assert -np.inf == MaxStar.log_map(np.array([-np.inf, -np.inf]))
+    assert -np.inf == MaxStar.lut_log_map(np.array([-np.inf, -np.inf]))
+
+    # log-MAP BCJR gives the exact a posteriori llrs (compared to the enumeration of all code words)
+    trellis = Trellis(ConvTrellisDef([[1, 0, 1], [1, 1, 1]]))
+    n_data = 6
+    n_stages = n_data + trellis.tdef.K - 1
+    input_u = np.random.randn(n_stages)
+    input_c = np.random.randn(2 * n_stages)
+    words = [[int(b) for b in np.binary_repr(v, n_data)] for v in range(2 ** n_data)]
+    metrics = []
+    for w in words:
+        c = ConvEncoder(trellis).encode(w)
+        metrics.append(np.dot(w, input_u[:n_data]) + np.dot(c, input_c))
+    metrics = np.array(metrics)
+    bits = np.array(words)
+    app = [np.logaddexp.reduce(metrics[bits[:, i] == 1]) - np.logaddexp.reduce(metrics[bits[:, i] == 0])
+           for i in range(n_data)]
+
+    convsiso = SisoDecoder(trellis)
+    convsiso.minus_inf = -np.inf  # only the zero terminated code words
+    out_u, _ = convsiso.decode(input_u, input_c, n_stages)
+    assert not np.allclose(app, out_u[:n_data])
+    for max_star in ['log_map', MaxStar.log_map]:
+        convsiso.max_star = max_star
+        out_u, _ = convsiso.decode(input_u, input_c, n_stages)
+        assert np.allclose(app, out_u[:n_data])
+    for max_star in ['constant_log_map', 'lut_log_map']:
+        convsiso.max_star = max_star
+        out_u, _ = convsiso.decode(input_u, input_c, n_stages)
+        assert np.abs(np.array(app) - out_u[:n_data]).max() < 1
+
+
+def test_stage_reduction(trellis_cache_dir):
+    # decoding a radix-2 trellis with merged stages gives the same result with fewer recursion steps
+    np.random.seed(11)
+    n_blocks = 3
+    n_data = 48
+    for g, fb in [([[1, 1, 0, 1]], [0, 0, 1, 1]), ([[1, 0, 1], [1, 1, 1]], [])]:
+        trellis = Trellis(ConvTrellisDef(g, fb))
+        input_u = np.random.randn(n_blocks, n_data)
+        input_c = np.random.randn(n_blocks, n_data * trellis.wc)
+        convsiso = SisoDecoder(trellis)
+        ref_u, ref_c = convsiso.decode(input_u, input_c, n_data)
+        viterbi = ViterbiDecoder(trellis)
+        ref = viterbi.decode(input_c, n_data)
+        for stage_reduction in [2, 4]:
+            convsiso.stage_reduction = stage_reduction
+            out_u, out_c = convsiso.decode(input_u, input_c, n_data)
+            # both decoders use the trellis of the cache
+            reduced = TrellisCache.get_reduced_trellis(trellis, stage_reduction)
+            assert 2 ** stage_reduction == reduced.radix
+            assert reduced is convsiso._get_reduced_decoder().trellis
+            assert np.allclose(ref_u, out_u)
+            assert np.allclose(ref_c, out_c)
+            viterbi.stage_reduction = stage_reduction
+            assert (ref == viterbi.decode(input_c, n_data)).all()
+
+        # sliding window decoding, the window is given in stages of the radix-2 trellis
+        convsiso.window_size = 16
+        convsiso.training_length = 16
+        ref_u, _ = convsiso.decode(input_u, input_c, n_data)
+        convsiso.stage_reduction = 1
+        out_u, _ = convsiso.decode(input_u, input_c, n_data)
+        assert np.allclose(ref_u, out_u)
+
+        # a number of stages which is not a multiple of stage_reduction is decoded on the radix-2 trellis
+        convsiso.stage_reduction = 5
+        convsiso.window_size = 0
+        out_u, _ = convsiso.decode(input_u[0], input_c[0], n_data)
+        ref_u, _ = SisoDecoder(trellis).decode(input_u[0], input_c[0], n_data)
+        assert ref_u == out_u
+
+    # default training, acquisition and traceback length: 5 * K data bits
+    trellis = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    assert 20 == trellis.get_convergence_length()
+    assert 10 == TrellisCache.get_reduced_trellis(trellis, 2).get_convergence_length()
+    assert 20 == StreamingViterbiDecoder(trellis).traceback_depth
+
+
+def test_benchmark(tmp_path):
+
+    grid = {'K': [3, 5], 'reduction': [1, 2], 'n_data': [40], 'n_blocks': [2]}
+    results = Benchmark.run(grid, min_time=0.001, repeat=1, verbose=False)
+    # 4 trellis cases (K x reduction), the benchmarks are run in the order of Benchmark.benchmarks
+    assert [r['name'] for r in results[:4]] == ['Trellis'] * 4
+    names = [r['name'] for r in results]
+    assert sorted(set(names), key=names.index) == list(Benchmark.benchmarks)
+    for r in results:
+        assert r['seconds'] > 0
+        assert r['mbps'] is None if r['name'] == 'Trellis' else r['mbps'] > 0
+
+    # the generator polynomials are the standard codes, e.g. (133, 171) for K = 7
+    assert Benchmark.get_gen_matrix(7) == [[1, 0, 1, 1, 0, 1, 1], [1, 1, 1, 1, 0, 0, 1]]
+
+    # json round trip and comparison of two result files
+    path = str(tmp_path / 'bench.json')
+    Benchmark.save(results, path)
+    loaded = Benchmark.load(path)
+    assert loaded['results'] == results
+    assert loaded['info']['numpy'] == np.__version__
+    speedups = Benchmark.compare(path, path)
+    assert len(speedups) == len(results)
+    assert all(s == 1 for _, _, s in speedups)
+
+
+def test_decoder_stats():
+
+    n_data = 40
+    trellis = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    convsiso = SisoDecoder(trellis)
+    convsiso.backward_init = False
+    il = get_interleaver('lte', n_data)
+    td = TurboDecoder(il, convsiso, convsiso)
+    td.stopping_rule = 'hda'
+    ys, yp1, yp2 = np.random.randn(3, 3, n_data + 4) + 2
+    ref, _ = td.decode(ys, yp1, yp2)
+
+    # instrumentation of the turbo decoder and its siso decoders, the output is not changed
+    stats = DecoderStats()
+    td.stats = stats
+    convsiso.stats = stats
+    dec, _ = td.decode(ys, yp1, yp2)
+    assert (ref == dec).all()
+    assert stats.n_calls == 1  # the siso decodes are nested calls
+    assert stats.n_bits == 3 * n_data
+    assert len(stats.iteration_time) == td.iterations_used.max()
+    assert stats.iterations_used == td.iterations_used.tolist()
+    n_half = 2 * sum(td.iterations_used)  # siso decodes of single blocks
+    assert stats.op_count['acs'] == n_half * 2 * (n_data + 4) * trellis.Ns
+    assert stats.op_count['branch_metrics'] == n_half * (n_data + 4) * trellis.Nb
+    assert set(stats.phase_time) == {'branch_metrics', 'acs', 'soft_output', 'interleaving', 'extrinsic', 'stopping'}
+    breakdown = stats.get_breakdown()
+    assert np.isclose(sum(breakdown.values()), 1)
+    assert stats.get_throughput() > 0
+
+    # viterbi decoder, aggregation of several instances
+    viterbi = ViterbiDecoder(trellis)
+    viterbi.stats = DecoderStats()
+    viterbi.decode(np.random.randn(2, 2 * n_data), n_data)
+    viterbi.decode(np.random.randn(2 * n_data), n_data)
+    assert viterbi.stats.n_calls == 2
+    assert viterbi.stats.op_count['traceback'] == 2 * n_data
+    total = aggregate([stats, viterbi.stats])
+    assert total.n_bits == stats.n_bits + 3 * n_data
+    assert total.op_count['acs'] == stats.op_count['acs'] + viterbi.stats.op_count['acs']
+    assert 'Mbit/s' in total.report()
+
+
+def test_channel():
+
+    rng = np.random.default_rng(0)
+    for scheme, bits_per_symbol in [('bpsk', 1), ('qpsk', 2), ('16qam', 4)]:
+        modulation = Modulation(scheme)
+        assert modulation.bits_per_symbol == bits_per_symbol
+        constellation = modulation.get_constellation()
+        assert np.isclose(np.mean(np.abs(constellation) ** 2), 1)  # unit symbol energy
+
+        # the symbols of a batch are the constellation points of their bits
+        bits = rng.integers(0, 2, (3, 101), dtype=np.uint8)
+        symbols = modulation.modulate(bits)
+        assert symbols.shape == (3, -(-101 // bits_per_symbol))
+        padded = np.concatenate((bits, np.zeros((3, -101 % bits_per_symbol), dtype=np.uint8)), axis=1)
+        index = padded.reshape(3, -1, bits_per_symbol) @ (2 ** np.arange(bits_per_symbol))
+        assert np.allclose(symbols, constellation[index])
+
+        # noiseless demapping: the signs of the llrs are the bits
+        out = np.zeros((3, 101), dtype=np.float32)
+        llr = modulation.demodulate(symbols, 0.5, n_bits=101, out=out)
+        assert llr is out
+        assert ((llr > 0) == bits).all()
+
+        # exact llrs compared to the log-sum-exp over all constellation points
+        for fading in ['awgn', 'rayleigh', 'block_rayleigh']:
+            noise_var = get_noise_var(3, 1 / 2, modulation)
+            y, h = Channel(fading).transmit(symbols, noise_var, rng)
+            assert (h is None) == (fading == 'awgn')
+            h_ref = 1 if h is None else h[..., None]
+            metric = -np.abs(y[..., None] - h_ref * constellation) ** 2 / noise_var
+            point_bits = (np.arange(len(constellation))[:, None] >> np.arange(bits_per_symbol)) & 1
+            ref = np.stack([np.logaddexp.reduce(metric[..., point_bits[:, k] == 1], axis=-1)
+                            - np.logaddexp.reduce(metric[..., point_bits[:, k] == 0], axis=-1)
+                            for k in range(bits_per_symbol)], axis=-1).reshape(3, -1)[:, :101]
+            exact = modulation.demodulate(y, noise_var, h, 'exact', n_bits=101)
+            max_log = modulation.demodulate(y, noise_var, h, 'max_log', n_bits=101)
+            assert exact.dtype == np.float32
+            assert np.allclose(exact, ref, rtol=1e-4, atol=1e-3)
+            if scheme != '16qam':  # max-log is exact for one bit per dimension
+                assert np.allclose(max_log, exact)
+
+    # BPSK over AWGN: llr = 2 y / sigma^2
+    y, _ = Channel().transmit(np.ones(10000, dtype=np.float32), 0.5, rng)
+    assert y.dtype == np.float32
+    assert np.isclose(np.var(y), 0.25, rtol=0.05)
+    assert np.allclose(Modulation().demodulate(y, 0.5), 2 * y / 0.25)
+
+
+def test_rate_matching():
+
+    # puncturing of a rate 1/2 convolutional code to rate 2/3, depuncturing and viterbi decoding
+    n_data = 100
+    trellis = Trellis(ConvTrellisDef([[1, 0, 1], [1, 1, 1]]))
+    convenc = ConvEncoder(trellis)
+    convenc.rate_matching = Puncturer([1, 1, 0, 1])
+    data = np.random.randint(0, 2, (4, n_data), dtype=np.uint8)
+    encoded = convenc.encode(data)
+    assert encoded.shape == (4, convenc.get_n_encoded(n_data) * 3 // 4)
+    assert list(encoded[0]) == convenc.encode(list(data[0]))
+    llr = convenc.dematch(2.0 * encoded - 1, n_data)
+    assert llr.shape == (4, convenc.get_n_encoded(n_data))
+    assert (llr[:, 2::4] == 0).all()
+    decoded = ViterbiDecoder(trellis).decode(llr, n_data + 2)[:, :n_data]
+    assert (decoded == data).all()
+
+    # circular buffer rate matching: all bits once for n_transmitted = 3 * D, systematic bits first (rv 0)
+    n_encoded = 3 * (40 + 4)
+    indices = CircularBufferRateMatcher(n_encoded).get_indices(n_encoded)
+    assert sorted(indices) == list(range(n_encoded))
+    assert (indices[:40] % 3 == 0).all()
+    for rv in range(4):
+        buffer, k0 = CircularBufferRateMatcher(100, rv).get_buffer(n_encoded)
+        assert k0 == 2 * (2 * 12 * rv + 2)  # 2 rows, 12 = ceil(192 / 16)
+        assert (buffer == -1).sum() == 3 * 20  # dummy bits
+
+    # repetition: the llrs of repeated bits are combined
+    matcher = CircularBufferRateMatcher(2 * n_encoded + 10, rv=2)
+    llr = matcher.dematch(np.ones((2, matcher.n_transmitted)), n_encoded)
+    assert llr.sum() == 2 * matcher.n_transmitted
+    assert set(np.unique(llr)) == {2, 3}
+
+    # rate 1/2 turbo code: the rate matching is applied by flatten, de-rate matching by extract
+    n_data = 40
+    il = get_interleaver('lte', n_data)
+    trellis_p = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    turboenc = TurboEncoder([Trellis(ConvTrellisDef([[1]])), trellis_p, trellis_p], il)
+    convsiso = SisoDecoder(trellis_p)
+    convsiso.backward_init = False
+    td = TurboDecoder(il, convsiso, convsiso)
+    data = np.random.randint(0, 2, (3, n_data), dtype=np.uint8)
+    full = turboenc.flatten(turboenc.encode(data))
+    for rate_matching in [Puncturer([1, 1, 0, 1, 0, 1]), CircularBufferRateMatcher(2 * n_data)]:
+        turboenc.rate_matching = rate_matching
+        encoded = turboenc.flatten(turboenc.encode(data))
+        assert encoded.shape == (3, rate_matching.get_n_transmitted(full.shape[1]))
+        ys, yp1, yp2 = turboenc.extract(2.0 * encoded - 1, n_data)
+        llr = np.stack([ys, yp1, yp2], axis=-1).reshape(3, -1)
+        assert ((llr == 0) | ((llr > 0) == full)).all()
+        dec, _ = td.decode(ys, yp1, yp2)
+        assert (dec == data).all()
+    with pytest.raises(ValueError):
+        turboenc.extract(encoded)
+
+
+def test_tail_biting(trellis_cache_dir):
+
+    rng = np.random.default_rng(24)  # fixed data and noise (the error counts are compared)
+    n_data = 40
+    for g in [[[1, 0, 1], [1, 1, 1]], [[1, 0, 1, 1, 0, 1, 1], [1, 1, 1, 1, 0, 0, 1]]]:
+        trellis = Trellis(ConvTrellisDef(g))
+        K = trellis.tdef.K
+        convenc = ConvEncoder(trellis)
+        data = rng.integers(0, 2, (8, n_data), dtype=np.uint8)
+
+        # the encoder starts in the state given by the last K-1 bits and ends in it
+        encoded = convenc.encode_tail_biting(data)
+        assert encoded.shape == (8, 2 * n_data)
+        preloaded = convenc.encode(np.concatenate((data[:, n_data - K + 1:], data), axis=1), False)
+        assert (preloaded[:, 2 * (K - 1):] == encoded).all()
+        assert convenc.encode_tail_biting(list(data[0])) == list(encoded[0])
+
+        viterbi = ViterbiDecoder(trellis)
+        viterbi.tail_biting = True
+        assert (viterbi.decode(2.0 * encoded - 1, n_data) == data).all()
+        assert viterbi.decode(list(2.0 * encoded[0] - 1), n_data) == list(data[0])
+
+        # noisy blocks: more passes do not increase the errors, the same decisions on the radix-4 trellis
+        llr = 2.0 * encoded - 1 + 0.7 * rng.standard_normal(encoded.shape)
+        errors = []
+        for n_wraps in [1, 2, 4]:
+            viterbi.n_wraps = n_wraps
+            errors.append((viterbi.decode(llr, n_data) != data).sum())
+        assert errors[2] <= errors[0]
+        ref = viterbi.decode(llr, n_data)
+        viterbi.stage_reduction = 2
+        assert (viterbi.decode(llr, n_data) == ref).all()
+
+    with pytest.raises(ValueError):
+        ConvEncoder(Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))).encode_tail_biting(data)
+
+    # simulation link without termination
+    results = Simulation.run(Simulation.ConvLink(48, tail_biting=True), [4], max_blocks=20, n_workers=1)
+    assert results[0].n_bits == 48 * results[0].n_blocks
+
+
+def test_turbo_termination(trellis_cache_dir):
+
+    n_data = 40
+    il = get_interleaver('lte', n_data)
+    trellis_p = Trellis(ConvTrellisDef([[1, 1, 0, 1]], [0, 0, 1, 1]))
+    turboenc = TurboEncoder([Trellis(ConvTrellisDef([[1]])), trellis_p, trellis_p], il)
+    turboenc.termination = 'lte'
+    data = np.random.randint(0, 2, (4, n_data), dtype=np.uint8)
+
+    # the tail bits drive the recursive encoders to state 0
+    convenc = ConvEncoder(trellis_p)
+    for datam in [list(data[0]), list(il.interleave(data[0]))]:
+        convenc.encode(datam + list(convenc.get_tail_bits(np.array(datam))), False)
+        assert convenc.get_state() == 0
+    assert not ConvEncoder(Trellis(ConvTrellisDef([[1, 0, 1], [1, 1, 1]]))).get_tail_bits(data).any()
+
+    # streams of n_data + 4 bits, the 12 tail bits are distributed over the streams
+    ys, yp1, yp2 = turboenc.encode(data)
+    assert ys.shape == yp1.shape == yp2.shape == (4, n_data + 4)
+    assert (ys[:, :n_data] == data).all()
+    assert turboenc.encode(list(data[0]))[1] == list(yp1[0])
+    tail = convenc.get_tail_bits(data)
+    parity = convenc.encode(np.concatenate((data, tail), axis=1), False)
+    assert (ys[:, n_data] == tail[:, 0]).all()
+    assert (yp1[:, n_data] == parity[:, n_data]).all()
+    assert (yp1[:, n_data + 1] == tail[:, 2]).all()
+    assert (yp2[:, n_data] == tail[:, 1]).all()
+    trellis_k3 = Trellis(ConvTrellisDef([[1, 0, 1]], [0, 1, 1]))
+    with pytest.raises(ValueError):
+        TurboEncoder([Trellis(ConvTrellisDef([[1]])), trellis_k3, trellis_k3], il).encode_terminated(data)
+
+    # decoding with the known end states
+    convsiso = SisoDecoder(trellis_p)
+    td = TurboDecoder(il, convsiso, convsiso)
+    td.termination = 'lte'
+    encoded = turboenc.flatten([ys, yp1, yp2])
+    llr = 4 * (2.0 * encoded - 1) + np.random.randn(*encoded.shape)
+    dec, _ = td.decode(*turboenc.extract(llr))
+    assert (dec == data).all()
+    dec, _ = td.decode(*turboenc.extract(llr[0]))
+    assert dec == list(data[0])
+
+    # rate matching of the terminated streams
+    turboenc.rate_matching = CircularBufferRateMatcher(2 * n_data)
+    encoded = turboenc.flatten(turboenc.encode(data))
+    dec, _ = td.decode(*turboenc.extract(4 * (2.0 * encoded - 1), n_data))
+    assert (dec == data).all()
+
+    # misconfigurations of the lte termination
+    turboenc.rate_matching = None
+    ys, yp1, yp2 = turboenc.extract(llr)
+    convsiso.backward_init = False  # the end state would not be used
+    with pytest.raises(ValueError):
+        td.decode(ys, yp1, yp2)
+    convsiso.backward_init = True
+    td.n_zp = 3
+    with pytest.raises(ValueError):
+        td.decode(ys, yp1, yp2)
+    td.n_zp = 4
+    td_k3 = TurboDecoder(il, SisoDecoder(trellis_k3), SisoDecoder(trellis_k3))
+    td_k3.termination = 'lte'
+    with pytest.raises(ValueError):
+        td_k3.decode(ys, yp1, yp2)
+    turboenc.n_zp = 3
+    with pytest.raises(ValueError):
+        turboenc.encode(data)
+
+    results = Simulation.run(Simulation.TurboLink(64), [1], max_blocks=4, blocks_per_unit=2, n_workers=1)
+    assert 4 == results[0].n_blocks